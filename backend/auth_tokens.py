@@ -0,0 +1,161 @@
+"""
+Подписанные токены доступа к API.
+
+/login один раз проверяет пароль (медленный KDF, см. passwords.py) и выдает
+токен с именем и идентификатором пользователя и сроком действия (TOKEN_TTL
+секунд), подписанный HMAC-SHA256. Проверка токена в get_current_user — одна
+HMAC подпись и разбор JSON без хеша пароля, плюс поиск пользователя по
+индексу хранилища (в пуле потоков), чтобы токены удаленных пользователей
+сразу переставали действовать. Токены —
+стандартные JWT (HS256): с python-jose они создаются и проверяются им, без
+него — тем же форматом через hmac, так что токены совместимы в обе стороны.
+
+Ключ подписи берется из SECRET_KEY, иначе из файла SECRET_KEY_FILE, который
+создается со случайным ключом при первом запуске: токены переживают
+перезапуск сервера и подходят всем его воркерам.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+
+try:
+    from jose import JWTError, jwt
+except ImportError:
+    jwt = None
+
+# Время жизни токена (секунды)
+TOKEN_TTL = int(os.environ.get("TOKEN_TTL", str(24 * 3600)))
+# Файл с ключом подписи, если SECRET_KEY не задан
+SECRET_KEY_FILE = os.environ.get("SECRET_KEY_FILE", "secret_key")
+TOKEN_ALGORITHM = "HS256"
+# Сколько ждать ключ в пустом файле ключа (секунды)
+SECRET_KEY_WAIT = 2.0
+
+def _read_secret_key(path: str) -> str:
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read().strip()
+
+def load_secret_key(path: str = SECRET_KEY_FILE) -> str:
+    """Ключ подписи из SECRET_KEY или файла (создается при первом запуске)
+
+    Ключ сначала пишется во временный файл и только потом ссылкой появляется
+    под именем path, поэтому другие воркеры никогда не видят файл без ключа.
+    Пустой ключ (пустой SECRET_KEY или пустой файл) не принимается: токены с
+    пустым ключом HMAC может подписать кто угодно.
+    """
+    if "SECRET_KEY" in os.environ:
+        secret_key = os.environ["SECRET_KEY"].strip()
+        if not secret_key:
+            raise RuntimeError("SECRET_KEY задан, но пуст")
+        return secret_key
+
+    if not os.path.exists(path):
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=os.path.basename(path))
+        try:
+            secret_key = secrets.token_urlsafe(32)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(secret_key)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, 0o600)
+            # link не заменяет существующий файл: если воркеры стартуют
+            # одновременно, ключ создаст только один, остальные прочитают его
+            os.link(tmp_path, path)
+            print(f"Создан ключ подписи токенов: {path}")
+            return secret_key
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+
+    # Пустой файл мог остаться от старой версии, создававшей его до записи ключа
+    deadline = time.monotonic() + SECRET_KEY_WAIT
+    while True:
+        secret_key = _read_secret_key(path)
+        if secret_key:
+            return secret_key
+        if time.monotonic() >= deadline:
+            raise RuntimeError(f"Файл ключа подписи {path} пуст; удалите его или задайте SECRET_KEY")
+        time.sleep(0.1)
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+class TokenSigner:
+    """Выдача и проверка подписанных токенов доступа
+
+    Ключ читается при первом обращении, а не при создании объекта.
+    """
+
+    def __init__(self, secret_key: Optional[str] = None, ttl: int = TOKEN_TTL,
+                 key_file: str = SECRET_KEY_FILE):
+        self.ttl = ttl
+        self.key_file = key_file
+        self._secret_key = secret_key
+        self._lock = threading.Lock()
+
+    @property
+    def secret_key(self) -> str:
+        if self._secret_key is None:
+            with self._lock:
+                if self._secret_key is None:
+                    self._secret_key = load_secret_key(self.key_file)
+        if not self._secret_key:
+            raise RuntimeError("Пустой ключ подписи токенов")
+        return self._secret_key
+
+    def issue(self, username: str, user_id: str) -> Dict:
+        """Новый токен пользователя (ответ /login)"""
+        now = int(time.time())
+        claims = {"sub": username, "uid": user_id, "iat": now, "exp": now + self.ttl}
+        if jwt is not None:
+            token = jwt.encode(claims, self.secret_key, algorithm=TOKEN_ALGORITHM)
+        else:
+            token = self._encode(claims)
+        return {"access_token": token, "token_type": "bearer", "expires_in": self.ttl}
+
+    def verify(self, token: str) -> Optional[Dict]:
+        """Содержимое токена или None, если подпись неверна или срок истек"""
+        if jwt is not None:
+            try:
+                return jwt.decode(token, self.secret_key, algorithms=[TOKEN_ALGORITHM])
+            except JWTError:
+                return None
+
+        claims = self._decode(token)
+        if claims is None or claims.get("exp", 0) < time.time():
+            return None
+        return claims
+
+    def _sign(self, message: bytes) -> bytes:
+        return hmac.new(self.secret_key.encode(), message, hashlib.sha256).digest()
+
+    def _encode(self, claims: Dict) -> str:
+        """JWT HS256 без python-jose"""
+        header = _b64encode(json.dumps({"alg": TOKEN_ALGORITHM, "typ": "JWT"}, separators=(",", ":")).encode())
+        payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+        signature = _b64encode(self._sign(f"{header}.{payload}".encode()))
+        return f"{header}.{payload}.{signature}"
+
+    def _decode(self, token: str) -> Optional[Dict]:
+        try:
+            header, payload, signature = token.split(".")
+            if not hmac.compare_digest(self._sign(f"{header}.{payload}".encode()), _b64decode(signature)):
+                return None
+            if json.loads(_b64decode(header)).get("alg") != TOKEN_ALGORITHM:
+                return None
+            return json.loads(_b64decode(payload))
+        except ValueError:
+            return None
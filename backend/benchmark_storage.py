@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк форматов хранения записей: CSV против колоночного (columnar_storage.py)
+
+Создает историю из --rows записей по стандартным полям в обоих форматах и
+замеряет полное чтение, чтение трех колонок для /stats, дописывание одной
+записи и размер на диске:
+
+    python benchmark_storage.py --rows 10000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from columnar_storage import ColumnarStorage
+from fields_registry import FieldRegistry
+from storage import FileStorage
+
+# Колонки, которые читает get_user_stats
+STATS_COLUMNS = ["date", "kol_sna", "ocenka_dny"]
+
+def make_history(rows: int, seed: int = 42) -> pd.DataFrame:
+    """Случайная история пользователя по стандартным полям"""
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp("2000-01-01") + pd.to_timedelta(np.arange(rows), unit="D")
+    return pd.DataFrame({
+        "date": dates.strftime("%Y-%m-%d"),
+        "kol_sna": np.round(rng.uniform(4, 12, rows), 1),
+        "kolichestvo_sna_0": rng.integers(0, 11, rows),
+        "nalichee_zarydki": rng.integers(0, 2, rows),
+        "zavrrak_koloriy": rng.integers(0, 2, rows),
+        "obed_koloriy": rng.integers(0, 2, rows),
+        "chteniy": rng.integers(0, 2, rows),
+        "sostavlenye_rasporydka": rng.integers(0, 2, rows),
+        "ocenka_dny": rng.integers(1, 11, rows),
+    })
+
+def measure(func, repeat: int) -> float:
+    """Лучшее время из repeat запусков, мс"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+def disk_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк CSV и колоночного формата записей")
+    parser.add_argument("--rows", type=int, default=10_000, help="Записей в истории")
+    parser.add_argument("--repeat", type=int, default=20, help="Число замеров")
+    args = parser.parse_args()
+
+    history = make_history(args.rows)
+    record = history.iloc[-1].to_dict()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Стандартная схема полей во временном каталоге
+        fields = FieldRegistry(os.path.join(workdir, "fields_config.json"))
+        user = {"user_id": "bench", "username": "bench", "data_file": "bench_data.csv"}
+        backends = {
+            "csv": (FileStorage(os.path.join(workdir, "users.json"), os.path.join(workdir, "csv")),
+                    os.path.join(workdir, "csv", "bench_data.csv")),
+            "columnar": (ColumnarStorage(os.path.join(workdir, "users.json"), os.path.join(workdir, "columnar"),
+                                         fields),
+                         os.path.join(workdir, "columnar", "bench_columns")),
+        }
+
+        print(f"📦 История: {args.rows} записей, {len(history.columns)} колонок\n")
+        print(f"{'Формат':<10}{'чтение, мс':>12}{'/stats, мс':>12}{'запись, мс':>12}{'размер, КБ':>12}")
+        for name, (storage, path) in backends.items():
+            storage.write_records(user, history)
+            pd.testing.assert_frame_equal(storage.read_records(user), history, check_dtype=False)
+
+            full = measure(lambda: storage.read_records(user), args.repeat)
+            stats = measure(lambda: storage.read_records(user, STATS_COLUMNS), args.repeat)
+            append = measure(lambda: storage.append_records(user, [record]), args.repeat)
+            size = disk_size(path) / 1024
+            print(f"{name:<10}{full:>12.2f}{stats:>12.2f}{append:>12.2f}{size:>12.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""
+Колоночное бинарное хранилище записей пользователей.
+
+Вместо CSV записи пользователя лежат в папке <user_id>_columns: по файлу на
+колонку с массивом фиксированного типа и meta.json со списком колонок, их
+типами и числом строк. Типы выводятся из схемы полей (fields_config.json):
+boolean и небольшие integer — int8, остальные integer — int16/int32, number —
+float64, date — datetime64[D]. Пропуски хранятся как NaN/NaT, а в целых
+колонках — минимальным значением типа (например, -128 для int8).
+
+Файлы открываются через np.memmap, поэтому чтение не разбирает текст и не
+выводит типы, а read_records(columns=[...]) читает только нужные колонки.
+С типами схемы (dtypes) целые колонки превращаются в nullable массивы pandas
+по маске пропусков, а даты — в datetime64 без разбора строк.
+Новые записи дописываются в конец файлов колонок; число строк в meta.json
+меняется последним (атомарно), так что недописанный хвост после сбоя
+игнорируется и обрезается при следующей записи. Полная перезапись создает
+файлы нового поколения и переключает на них meta.json.
+
+Включается переменной окружения DATA_FORMAT=columnar (для STORAGE_BACKEND=files).
+CSV таблицы, созданные раньше, читаются как есть и переводятся в колоночный
+формат при первой записи в них.
+"""
+
+import json
+import os
+import shutil
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from fields_registry import FieldRegistry, fields_registry
+from file_lock import atomic_write
+from storage import FileStorage, _filter_dates, apply_dtypes
+
+# Версия формата meta.json
+COLUMNAR_FORMAT_VERSION = 1
+# Тип колонки даты
+DATE_DTYPE = "datetime64[D]"
+
+def _int_dtype(min_value, max_value) -> str:
+    """Наименьший целый тип, в который помещается диапазон (минимум типа — пропуск)"""
+    for dtype in ("int8", "int16", "int32"):
+        info = np.iinfo(dtype)
+        if min_value is not None and max_value is not None \
+                and info.min < min_value and max_value <= info.max:
+            return dtype
+    return "int64"
+
+def schema_dtype(field: Optional[Dict]) -> Optional[str]:
+    """Тип хранения поля по его описанию в fields_config.json (None — тип неизвестен)"""
+    if field is None:
+        return None
+    field_type = field.get("field_type", "number")
+    if field_type == "boolean":
+        return "int8"
+    if field_type == "integer":
+        return _int_dtype(field.get("min_value"), field.get("max_value"))
+    return "float64"
+
+def _missing_value(dtype: str):
+    if dtype.startswith("int"):
+        return np.iinfo(dtype).min
+    if dtype == DATE_DTYPE:
+        return np.datetime64("NaT")
+    if dtype.startswith("<U") or dtype.startswith("U"):
+        return ""
+    return np.nan
+
+def encode_column(values: pd.Series, dtype: str) -> np.ndarray:
+    """Переводит значения колонки в массив типа dtype
+
+    ValueError, если значения не помещаются в тип (дробные или вне диапазона
+    для целых, не даты для даты, не числа для float64).
+    """
+    if dtype == DATE_DTYPE:
+        present = values.notna()
+        dates = pd.to_datetime(values[present].astype(str), format="%Y-%m-%d", errors="coerce")
+        if dates.isna().any():
+            raise ValueError("ожидается дата ГГГГ-ММ-ДД")
+        result = np.full(len(values), np.datetime64("NaT"), dtype=DATE_DTYPE)
+        result[present.to_numpy()] = dates.to_numpy().astype(DATE_DTYPE)
+        return result
+
+    if dtype.startswith("<U") or dtype.startswith("U"):
+        text = values.astype(object).where(values.notna(), "").astype(str)
+        if len(text) and text.str.len().max() > np.dtype(dtype).itemsize // 4:
+            raise ValueError("строка длиннее ширины колонки")
+        return text.to_numpy(dtype=dtype)
+
+    numbers = pd.to_numeric(values, errors="coerce")
+    if (numbers.isna() & values.notna()).any():
+        raise ValueError("ожидается число")
+    numbers = numbers.to_numpy(dtype=float)
+    if dtype == "float64":
+        return numbers
+
+    missing = np.isnan(numbers)
+    present = numbers[~missing]
+    info = np.iinfo(dtype)
+    if (present != np.round(present)).any() or (present <= info.min).any() or (present > info.max).any():
+        raise ValueError(f"значения не помещаются в {dtype}")
+    result = np.where(missing, info.min, numbers).astype(dtype)
+    return result
+
+def decode_column(array: np.ndarray, dtype: str, typed: bool = False):
+    """Значения колонки в том виде, в каком их возвращает pd.read_csv
+
+    typed: целые — nullable массив pandas той же ширины, даты — datetime64.
+    """
+    if typed and dtype == DATE_DTYPE:
+        return array.astype("datetime64[s]")
+    if typed and dtype.startswith("int"):
+        return pd.arrays.IntegerArray(np.array(array), array == np.iinfo(dtype).min)
+    if dtype == DATE_DTYPE:
+        text = np.datetime_as_string(array, unit="D").astype(object)
+        text[np.isnat(array)] = np.nan
+        return text
+    if dtype.startswith("<U") or dtype.startswith("U"):
+        text = np.asarray(array).astype(object)
+        text[array == ""] = np.nan
+        return text
+    if dtype == "float64":
+        return np.array(array)
+
+    missing = array == np.iinfo(dtype).min
+    if missing.any():
+        return np.where(missing, np.nan, array.astype(float))
+    return array.astype("int64")
+
+class ColumnarStorage(FileStorage):
+    """Пользователи в JSON файле, записи в колоночных бинарных файлах"""
+
+    def __init__(self, users_file: str = "users.json", data_dir: str = "user_data",
+                 fields: Optional[FieldRegistry] = None):
+        super().__init__(users_file, data_dir)
+        self.fields = fields or fields_registry
+
+    def _table_dir(self, user: Dict) -> str:
+        return os.path.join(self.data_dir, f"{user['user_id']}_columns")
+
+    def _meta_path(self, user: Dict) -> str:
+        return os.path.join(self._table_dir(user), "meta.json")
+
+    def _column_path(self, user: Dict, column: Dict) -> str:
+        return os.path.join(self._table_dir(user), column["file"])
+
+    def _load_meta(self, user: Dict) -> Optional[Dict]:
+        try:
+            with open(self._meta_path(user), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _save_meta(self, user: Dict, meta: Dict):
+        with atomic_write(self._meta_path(user)) as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    def _is_legacy(self, user: Dict) -> bool:
+        """Таблица пользователя еще в CSV (создана до перехода на колоночный формат)"""
+        return not os.path.exists(self._meta_path(user)) and os.path.exists(self._data_path(user))
+
+    def _choose_dtype(self, name: str, values: pd.Series) -> str:
+        """Тип колонки: из схемы, если значения в него помещаются, иначе шире"""
+        candidates = [DATE_DTYPE] if name == "date" else []
+        dtype = schema_dtype(self.fields.get_field(name))
+        if dtype is not None:
+            candidates.append(dtype)
+        candidates.append("float64")
+        for candidate in candidates:
+            try:
+                encode_column(values, candidate)
+                return candidate
+            except ValueError:
+                continue
+        width = max(1, int(values.dropna().astype(str).str.len().max() or 1)) if values.notna().any() else 1
+        return f"<U{width}"
+
+    def _open_column(self, user: Dict, column: Dict, rows: int) -> np.ndarray:
+        if rows == 0:
+            return np.empty(0, dtype=column["dtype"])
+        return np.memmap(self._column_path(user, column), dtype=column["dtype"], mode="r", shape=(rows,))
+
+    def data_signature(self, user: Dict) -> Optional[Tuple]:
+        if self._is_legacy(user):
+            return super().data_signature(user)
+        try:
+            stat = os.stat(self._meta_path(user))
+        except FileNotFoundError:
+            return None
+        # meta.json каждый раз подменяется новым файлом, поэтому меняется и inode
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def columns(self, user: Dict) -> List[str]:
+        if self._is_legacy(user):
+            return super().columns(user)
+        meta = self._load_meta(user)
+        return [column["name"] for column in meta["columns"]] if meta else []
+
+    def read_records(self, user: Dict, columns: Optional[List[str]] = None,
+                     dtypes: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+        if self._is_legacy(user):
+            return super().read_records(user, columns, dtypes)
+        meta = self._load_meta(user)
+        if meta is None:
+            return pd.DataFrame()
+
+        selected = [
+            column for column in meta["columns"]
+            if columns is None or column["name"] in columns
+        ]
+        data = {
+            column["name"]: decode_column(self._open_column(user, column, meta["rows"]),
+                                          column["dtype"], typed=bool(dtypes))
+            for column in selected
+        }
+        return apply_dtypes(pd.DataFrame(data, columns=[column["name"] for column in selected]), dtypes)
+
+    def write_records(self, user: Dict, data: pd.DataFrame):
+        table_dir = self._table_dir(user)
+        os.makedirs(table_dir, exist_ok=True)
+        old = self._load_meta(user)
+        generation = old["generation"] + 1 if old else 1
+
+        columns = []
+        for index, name in enumerate(data.columns):
+            values = data[name].reset_index(drop=True)
+            dtype = self._choose_dtype(str(name), values)
+            column = {"name": str(name), "dtype": dtype, "file": f"c{index}_{generation}.bin"}
+            with atomic_write(self._column_path(user, column), "wb") as f:
+                f.write(encode_column(values, dtype).tobytes())
+            columns.append(column)
+
+        self._save_meta(user, {
+            "format": COLUMNAR_FORMAT_VERSION,
+            "rows": len(data),
+            "generation": generation,
+            "columns": columns
+        })
+
+        # Файлы прошлых поколений больше не нужны (открытые memmap на Linux
+        # продолжают читать удаленные файлы; на Windows удалим в следующий раз)
+        current = {column["file"] for column in columns} | {"meta.json"}
+        for filename in os.listdir(table_dir):
+            if filename not in current and not filename.startswith(".tmp_"):
+                try:
+                    os.remove(os.path.join(table_dir, filename))
+                except OSError:
+                    pass
+
+        legacy = self._data_path(user)
+        if os.path.exists(legacy):
+            os.remove(legacy)
+
+    def append_records(self, user: Dict, records: List[Dict]):
+        meta = None if self._is_legacy(user) else self._load_meta(user)
+        if meta is None:
+            # Таблицы нет или она еще в CSV: записываем целиком в новом формате
+            existing = super().read_records(user) if self._is_legacy(user) else pd.DataFrame()
+            self.write_records(user, pd.concat([existing, pd.DataFrame(records)], ignore_index=True))
+            return
+
+        new_rows = pd.DataFrame(records)
+        rows = meta["rows"]
+        columns = list(meta["columns"])
+        for name in new_rows.columns:
+            if all(column["name"] != name for column in columns):
+                dtype = self._choose_dtype(str(name), new_rows[name])
+                columns.append({"name": str(name), "dtype": dtype,
+                                "file": f"c{len(columns)}_{meta['generation']}.bin"})
+
+        try:
+            encoded = [
+                encode_column(new_rows[column["name"]] if column["name"] in new_rows.columns
+                              else pd.Series([None] * len(new_rows)), column["dtype"])
+                for column in columns
+            ]
+        except ValueError:
+            # Значения не помещаются в типы колонок: перезаписываем таблицу
+            # целиком, типы будут выбраны заново
+            existing = self.read_records(user)
+            self.write_records(user, pd.concat([existing, new_rows], ignore_index=True))
+            return
+
+        for column, values in zip(columns, encoded):
+            itemsize = np.dtype(column["dtype"]).itemsize
+            path = self._column_path(user, column)
+            stored = os.path.getsize(path) // itemsize if os.path.exists(path) else 0
+            with open(path, "ab") as f:
+                # Обрезаем хвост недописанной прошлой записи
+                f.truncate(min(stored, rows) * itemsize)
+                if stored < rows:
+                    # Новая колонка: для прежних строк — пропуски
+                    f.write(np.full(rows - stored, _missing_value(column["dtype"]),
+                                    dtype=column["dtype"]).tobytes())
+                f.write(values.tobytes())
+
+        self._save_meta(user, dict(meta, rows=rows + len(new_rows), columns=columns))
+
+    def iter_records(self, user: Dict, since: Optional[str] = None, until: Optional[str] = None,
+                     after: Optional[int] = None, chunk_size: int = 1000) -> Iterator[pd.DataFrame]:
+        if self._is_legacy(user):
+            return super().iter_records(user, since, until, after, chunk_size)
+        meta = self._load_meta(user)
+        if meta is None:
+            raise FileNotFoundError(self._meta_path(user))
+
+        # Снимок: строки, дописанные после вызова, не читаются
+        rows = meta["rows"]
+        arrays = [(column, self._open_column(user, column, rows)) for column in meta["columns"]]
+        start = 0 if after is None else after + 1
+
+        def chunks():
+            for begin in range(start, rows, chunk_size):
+                end = min(begin + chunk_size, rows)
+                chunk = pd.DataFrame(
+                    {column["name"]: decode_column(array[begin:end], column["dtype"]) for column, array in arrays},
+                    columns=[column["name"] for column, _ in arrays],
+                    index=pd.RangeIndex(begin, end)
+                )
+                chunk = _filter_dates(chunk, since, until)
+                if not chunk.empty:
+                    yield chunk
+
+        return chunks()
+
+    def delete_user(self, user: Dict):
+        super().delete_user(user)
+        shutil.rmtree(self._table_dir(user), ignore_errors=True)
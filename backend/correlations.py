@@ -0,0 +1,136 @@
+"""
+Инкрементальный расчет корреляций между полями записей пользователя.
+
+Для каждой пары полей хранится число совместных наблюдений, средние,
+суммы квадратов отклонений и совместный момент (алгоритм Уэлфорда), поэтому
+новая запись учитывается за O(полей²) без перечитывания всей истории, а вся
+история при перестроении — одним векторизованным проходом.
+Пропуски обрабатываются попарно, как в DataFrame.corr().
+"""
+
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, List, Optional, Tuple
+
+class CorrelationAccumulator:
+    """Накопитель попарных статистик для коэффициента корреляции Пирсона"""
+
+    def __init__(self, columns: List[str], signature: Optional[Tuple] = None):
+        self.columns = list(columns)
+        self.signature = signature
+        size = len(self.columns)
+        # n[i, j] — число строк, где заполнены оба поля i и j
+        self.n = np.zeros((size, size))
+        # mean[i, j] и m2[i, j] — среднее и сумма квадратов отклонений поля i
+        # по строкам, где заполнены оба поля i и j
+        self.mean = np.zeros((size, size))
+        self.m2 = np.zeros((size, size))
+        # comoment[i, j] — сумма произведений отклонений полей i и j
+        self.comoment = np.zeros((size, size))
+
+    @staticmethod
+    def numeric_columns(df: pd.DataFrame) -> List[str]:
+        """Поля таблицы, участвующие в корреляциях (все, кроме даты)"""
+        return [column for column in df.columns if column != 'date']
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame, signature: Optional[Tuple] = None) -> "CorrelationAccumulator":
+        """Строит накопитель по всей истории пользователя"""
+        columns = cls.numeric_columns(df)
+        accumulator = cls(columns, signature)
+        values = df[columns].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+        if len(values) == 0:
+            return accumulator
+
+        # Вся история считается одним проходом матричных произведений.
+        # Значения сдвигаются на средние столбцов, чтобы суммы квадратов
+        # не теряли точность; попарные статистики от сдвига не зависят
+        present = ~np.isnan(values)
+        counts = present.sum(axis=0)
+        shift = np.nansum(values, axis=0) / np.maximum(counts, 1)
+        centered = np.where(present, values - shift, 0.0)
+        pair = present.astype(float)
+
+        n = pair.T @ pair
+        # sums[i, j] — сумма сдвинутых значений поля i по строкам пары (i, j)
+        sums = centered.T @ pair
+        filled = n > 0
+        safe_n = np.where(filled, n, 1.0)
+
+        accumulator.n = n
+        accumulator.mean = np.where(filled, sums / safe_n + shift[:, None], 0.0)
+        m2 = (centered ** 2).T @ pair - sums ** 2 / safe_n
+        accumulator.m2 = np.where(filled, np.maximum(m2, 0.0), 0.0)
+        comoment = centered.T @ centered - sums * sums.T / safe_n
+        accumulator.comoment = np.where(filled, comoment, 0.0)
+        return accumulator
+
+    def covers(self, record: Dict) -> bool:
+        """Проверяет, что все поля записи уже учитываются накопителем"""
+        return all(key == 'date' or key in self.columns for key in record)
+
+    def _to_row(self, record: Dict) -> np.ndarray:
+        row = pd.to_numeric(
+            pd.Series([record.get(column) for column in self.columns], dtype=object),
+            errors='coerce'
+        )
+        return row.to_numpy(dtype=float)
+
+    def _update_row(self, row: np.ndarray):
+        present = ~np.isnan(row)
+        pair = np.outer(present, present)
+        if not pair.any():
+            return
+
+        x = np.where(present, row, 0.0)
+        # x_i для пары (i, j) лежит в строке i, x_j — в столбце j
+        xi = np.broadcast_to(x[:, None], pair.shape)
+        xj = np.broadcast_to(x[None, :], pair.shape)
+
+        self.n += pair
+        delta = np.where(pair, xi - self.mean, 0.0)
+        self.mean += np.where(pair, delta / np.maximum(self.n, 1), 0.0)
+        self.m2 += np.where(pair, delta * (xi - self.mean), 0.0)
+        # mean.T[i, j] — уже обновленное среднее поля j по той же паре строк
+        self.comoment += np.where(pair, delta * (xj - self.mean.T), 0.0)
+
+    def update(self, record: Dict):
+        """Учитывает одну новую запись"""
+        self._update_row(self._to_row(record))
+
+    def update_many(self, records: Iterable[Dict]):
+        """Учитывает несколько новых записей"""
+        for record in records:
+            self.update(record)
+
+    def correlation_matrix(self) -> pd.DataFrame:
+        """Матрица корреляций, совпадающая с DataFrame.corr()"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            matrix = self.comoment / np.sqrt(self.m2 * self.m2.T)
+        matrix = np.clip(matrix, -1.0, 1.0)
+        return pd.DataFrame(matrix, index=self.columns, columns=self.columns)
+
+    def correlations_with(self, target: str) -> Optional[pd.Series]:
+        """Корреляции всех полей с целевым полем (без самого поля)"""
+        if target not in self.columns:
+            return None
+        return self.correlation_matrix()[target].drop(target)
+
+    def to_dict(self) -> Dict:
+        return {
+            "columns": self.columns,
+            "signature": list(self.signature) if self.signature is not None else None,
+            "n": self.n.tolist(),
+            "mean": self.mean.tolist(),
+            "m2": self.m2.tolist(),
+            "comoment": self.comoment.tolist()
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "CorrelationAccumulator":
+        signature = tuple(data["signature"]) if data.get("signature") is not None else None
+        accumulator = cls(data["columns"], signature)
+        size = len(accumulator.columns)
+        for name in ("n", "mean", "m2", "comoment"):
+            setattr(accumulator, name, np.array(data[name], dtype=float).reshape(size, size))
+        return accumulator
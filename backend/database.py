@@ -1,15 +1,29 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 # SQLite database URL (for development)
 SQLALCHEMY_DATABASE_URL = "sqlite:///./day_tracker.db"
 
+def create_sqlite_engine(database_url: str = SQLALCHEMY_DATABASE_URL):
+    """Create a SQLite engine with WAL journaling enabled"""
+    sqlite_engine = create_engine(
+        database_url,
+        connect_args={"check_same_thread": False}  # Only needed for SQLite
+    )
+
+    @event.listens_for(sqlite_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets readers work while a single writer appends records
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    return sqlite_engine
+
 # Create engine
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, 
-    connect_args={"check_same_thread": False}  # Only needed for SQLite
-)
+engine = create_sqlite_engine(SQLALCHEMY_DATABASE_URL)
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -0,0 +1,291 @@
+"""
+Реестр полей данных (fields_config.json), общий для веб-сервера и UserManager.
+
+Конфигурация читается с диска один раз и перечитывается только при изменении
+времени модификации файла. Каждое изменение схемы увеличивает version, по
+которой другие кэши могут понять, что набор полей изменился.
+Изменения делаются под межпроцессной блокировкой (file_lock) поверх заново
+прочитанного файла, поэтому воркеры uvicorn не теряют поля друг друга.
+
+По схеме выводятся типы колонок pandas (get_dtypes): boolean и integer —
+наименьший nullable целый тип, вмещающий [min_value, max_value], number —
+float32, дата — datetime64.
+
+Схема версионируется: добавление и удаление поля увеличивает schema_version
+в fields_config.json и записывается в schema_changes. Таблицы пользователей
+при этом не переписываются — UserManager помнит, при какой версии схемы
+таблица записана, и приводит ее к текущей при чтении (project): удаленные
+поля скрываются, новые заполняются default_value поля, а колонки полей,
+удаленных и добавленных заново после записи таблицы, считаются устаревшими.
+Сами файлы переписываются лениво (schema_migration.py).
+"""
+
+import os
+import copy
+import json
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+import pandas as pd
+
+from file_lock import FileLock, atomic_write
+
+# Файл для хранения определений полей
+FIELDS_CONFIG_FILE = "fields_config.json"
+# Тип колонки date в таблицах пользователей
+DATE_DTYPE = "datetime64[s]"
+# Nullable целые типы pandas от узкого к широкому и их диапазоны
+INTEGER_DTYPES = (("Int8", -2 ** 7, 2 ** 7 - 1), ("Int16", -2 ** 15, 2 ** 15 - 1),
+                  ("Int32", -2 ** 31, 2 ** 31 - 1))
+
+# Стандартные поля
+DEFAULT_FIELDS_CONFIG = {
+    "fields": [
+        {
+            "name": "kol_sna",
+            "display_name": "Количество сна (часы)",
+            "field_type": "number",
+            "min_value": 4.0,
+            "max_value": 12.0,
+            "description": "Количество часов сна"
+        },
+        {
+            "name": "kolichestvo_sna_0",
+            "display_name": "Качество сна после 00:00",
+            "field_type": "integer",
+            "min_value": 0,
+            "max_value": 10,
+            "description": "Оценка качества сна после полуночи"
+        },
+        {
+            "name": "nalichee_zarydki",
+            "display_name": "Наличие зарядки",
+            "field_type": "boolean",
+            "description": "Делали ли зарядку"
+        },
+        {
+            "name": "zavrrak_koloriy",
+            "display_name": "Калорийный завтрак",
+            "field_type": "boolean",
+            "description": "Был ли калорийный завтрак"
+        },
+        {
+            "name": "obed_koloriy",
+            "display_name": "Калорийный обед",
+            "field_type": "boolean",
+            "description": "Был ли калорийный обед"
+        },
+        {
+            "name": "chteniy",
+            "display_name": "Чтение",
+            "field_type": "boolean",
+            "description": "Читали ли сегодня"
+        },
+        {
+            "name": "sostavlenye_rasporydka",
+            "display_name": "Составление распорядка",
+            "field_type": "boolean",
+            "description": "Составляли ли распорядок дня"
+        },
+        {
+            "name": "ocenka_dny",
+            "display_name": "Оценка дня",
+            "field_type": "integer",
+            "min_value": 1,
+            "max_value": 10,
+            "description": "Общая оценка дня"
+        }
+    ]
+}
+
+def field_dtype(field: Dict) -> str:
+    """Тип колонки pandas для поля по field_type, min_value и max_value"""
+    field_type = field.get("field_type", "number")
+    if field_type == "boolean":
+        return "Int8"
+    if field_type == "integer":
+        low, high = field.get("min_value"), field.get("max_value")
+        if low is not None and high is not None:
+            for dtype, dtype_min, dtype_max in INTEGER_DTYPES:
+                if dtype_min <= low and high <= dtype_max:
+                    return dtype
+        return "Int64"
+    return "float32"
+
+class FieldRegistry:
+    """Потокобезопасный кэш конфигурации полей с перечитыванием по mtime"""
+
+    def __init__(self, config_file: str = FIELDS_CONFIG_FILE):
+        self.config_file = config_file
+        self.version = 0
+        self._lock = threading.RLock()
+        self._config: Optional[Dict] = None
+        self._fields: Dict[str, Dict] = {}
+        self._mtime: Optional[int] = None
+
+    def _file_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.config_file).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def file_lock(self) -> FileLock:
+        """Межпроцессная блокировка изменений конфигурации полей"""
+        return FileLock(self.config_file + ".lock")
+
+    def _set_config(self, config: Dict):
+        self._config = config
+        self._fields = {field["name"]: field for field in config["fields"]}
+        self.version += 1
+
+    def _save(self):
+        """Сохраняет конфигурацию полей"""
+        with atomic_write(self.config_file) as f:
+            json.dump(self._config, f, ensure_ascii=False, indent=2)
+        self._mtime = self._file_mtime()
+
+    def _ensure_loaded(self):
+        """Загружает конфигурацию, если её ещё нет или файл изменился"""
+        mtime = self._file_mtime()
+        if self._config is not None and mtime == self._mtime:
+            return
+
+        if mtime is None:
+            self._set_config(copy.deepcopy(DEFAULT_FIELDS_CONFIG))
+            try:
+                self._save()
+            except Exception as e:
+                print(f"Ошибка сохранения конфигурации полей: {e}")
+            return
+
+        try:
+            with open(self.config_file, 'r', encoding='utf-8') as f:
+                self._set_config(json.load(f))
+            self._mtime = mtime
+        except Exception as e:
+            print(f"Ошибка загрузки конфигурации полей: {e}")
+            if self._config is None:
+                self._set_config(copy.deepcopy(DEFAULT_FIELDS_CONFIG))
+
+    def get_config(self) -> Dict:
+        """Возвращает копию конфигурации полей"""
+        with self._lock:
+            self._ensure_loaded()
+            return copy.deepcopy(self._config)
+
+    def get_version(self) -> int:
+        """Версия схемы полей (меняется при каждом изменении набора полей)"""
+        with self._lock:
+            self._ensure_loaded()
+            return self.version
+
+    def get_field(self, name: str) -> Optional[Dict]:
+        """Возвращает описание поля по имени"""
+        with self._lock:
+            self._ensure_loaded()
+            return self._fields.get(name)
+
+    def get_dtypes(self) -> Dict[str, str]:
+        """Типы колонок таблицы пользователя: date и поля схемы"""
+        with self._lock:
+            self._ensure_loaded()
+            dtypes = {"date": DATE_DTYPE}
+            dtypes.update({name: field_dtype(field) for name, field in self._fields.items()})
+            return dtypes
+
+    def get_field_names(self) -> List[str]:
+        """Имена полей в порядке конфигурации"""
+        with self._lock:
+            self._ensure_loaded()
+            return list(self._fields.keys())
+
+    def get_schema_version(self) -> int:
+        """Версия схемы из fields_config.json (в отличие от version, общая для всех процессов)"""
+        with self._lock:
+            self._ensure_loaded()
+            return self._config.get("schema_version", 0)
+
+    def changed_since(self, schema_version: int) -> Set[str]:
+        """Поля, добавленные или удаленные после версии схемы schema_version"""
+        with self._lock:
+            self._ensure_loaded()
+            return {
+                change["field"] for change in self._config.get("schema_changes", [])
+                if change["version"] > schema_version
+            }
+
+    def project(self, df: pd.DataFrame, schema_version: int,
+                columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """Приводит таблицу, записанную при версии schema_version, к текущей схеме
+
+        Колонки идут в порядке схемы (date, затем поля); columns — оставить
+        только эти колонки. Поля, которых в таблице нет или которые изменились
+        после ее записи, заполняются default_value поля (или пропусками).
+        """
+        with self._lock:
+            self._ensure_loaded()
+            fields = dict(self._fields)
+        changed = self.changed_since(schema_version)
+        selected = None if columns is None else set(columns)
+
+        projected = {}
+        for name in ["date"] + list(fields):
+            if selected is not None and name not in selected:
+                continue
+            if name in df.columns and name not in changed:
+                projected[name] = df[name]
+                continue
+            default = fields.get(name, {}).get("default_value")
+            projected[name] = pd.Series(np.nan if default is None else default, index=df.index)
+        return pd.DataFrame(projected, index=df.index)
+
+    def _reload_locked(self):
+        """Перечитывает конфигурацию с диска независимо от mtime
+
+        Вызывается под file_lock перед изменением: mtime может не успеть
+        измениться после записи другим процессом, а изменение поверх
+        устаревшей копии потеряло бы чужое поле или повторило schema_version.
+        """
+        self._mtime = None
+        self._ensure_loaded()
+
+    def _record_change(self, config: Dict, action: str, name: str):
+        """Увеличивает версию схемы и записывает изменение в schema_changes"""
+        version = config.get("schema_version", 0) + 1
+        config["schema_version"] = version
+        config.setdefault("schema_changes", []).append(
+            {"version": version, "action": action, "field": name}
+        )
+
+    def add_field(self, field: Dict) -> bool:
+        """Добавляет поле; возвращает False, если поле уже существует"""
+        with self._lock, self.file_lock():
+            self._reload_locked()
+            if field["name"] in self._fields:
+                return False
+
+            config = copy.deepcopy(self._config)
+            config["fields"].append(field)
+            self._record_change(config, "add", field["name"])
+            self._set_config(config)
+            self._save()
+            return True
+
+    def delete_field(self, name: str) -> Optional[Dict]:
+        """Удаляет поле и возвращает его описание (None, если поля нет)"""
+        with self._lock, self.file_lock():
+            self._reload_locked()
+            field = self._fields.get(name)
+            if field is None:
+                return None
+
+            config = copy.deepcopy(self._config)
+            config["fields"] = [f for f in config["fields"] if f["name"] != name]
+            self._record_change(config, "delete", name)
+            self._set_config(config)
+            self._save()
+            return field
+
+# Общий реестр для процесса
+fields_registry = FieldRegistry()
@@ -0,0 +1,82 @@
+"""
+Межпроцессные блокировки файлов и атомарная запись.
+
+FileLock держит эксклюзивную блокировку lock-файла (fcntl на Linux/macOS,
+msvcrt на Windows), поэтому несколько воркеров uvicorn не перезаписывают одни
+и те же данные одновременно. atomic_write пишет во временный файл рядом с
+целевым и подменяет его через os.replace, так что читатели видят либо старую,
+либо новую версию файла целиком.
+"""
+
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+class FileLock:
+    """Эксклюзивная межпроцессная блокировка на основе lock-файла"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "a+b")
+
+        if os.name == "nt":
+            # msvcrt блокирует байтовый диапазон и сдается после ~10 секунд,
+            # поэтому повторяем попытки до успеха
+            while True:
+                try:
+                    self._file.seek(0)
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+        else:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            if os.name == "nt":
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+@contextmanager
+def atomic_write(path: str, mode: str = "w", encoding: str = "utf-8"):
+    """Открывает временный файл и атомарно подменяет им path после записи"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=os.path.basename(path))
+    try:
+        kwargs = {} if "b" in mode else {"encoding": encoding, "newline": ""}
+        with os.fdopen(fd, mode, **kwargs) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест веб-сервера: смешанный параллельный трафик и перцентили задержек
+
+Создает пользователя с большой историей и пользователя с маленькой, затем
+параллельно шлет запросы /health, /stats и /data от обоих и печатает
+p50/p95/p99 по каждому типу запроса. Сервер должен быть запущен:
+
+    python web_server.py
+    python load_test.py --history 5000 --threads 32 --requests 2000
+"""
+
+import argparse
+import random
+import secrets
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+def make_record(day: int) -> dict:
+    """Случайная запись дня"""
+    return {
+        "kol_sna": round(random.uniform(4, 12), 1),
+        "kolichestvo_sna_0": random.randint(0, 10),
+        "nalichee_zarydki": random.randint(0, 1),
+        "zavrrak_koloriy": random.randint(0, 1),
+        "obed_koloriy": random.randint(0, 1),
+        "chteniy": random.randint(0, 1),
+        "sostavlenye_rasporydka": random.randint(0, 1),
+        "ocenka_dny": random.randint(1, 10),
+        "date": (datetime.now() - timedelta(days=day)).strftime('%Y-%m-%d')
+    }
+
+def create_user(base_url: str, history: int) -> tuple:
+    """Регистрирует пользователя и заполняет его историю"""
+    username = f"load_{secrets.token_hex(4)}"
+    password = secrets.token_hex(8)
+    requests.post(f"{base_url}/register", json={"username": username, "password": password}).raise_for_status()
+
+    session = requests.Session()
+    session.auth = (username, password)
+
+    for day in range(history):
+        session.post(f"{base_url}/data", json=make_record(day)).raise_for_status()
+
+    return username, password
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест веб-сервера")
+    parser.add_argument("--url", default="http://localhost:4000")
+    parser.add_argument("--history", type=int, default=2000, help="Записей у «тяжелого» пользователя")
+    parser.add_argument("--threads", type=int, default=16, help="Параллельных клиентов")
+    parser.add_argument("--requests", type=int, default=1000, help="Всего запросов")
+    args = parser.parse_args()
+
+    print(f"📦 Создание пользователей (история: {args.history} записей)...")
+    heavy = create_user(args.url, args.history)
+    light = create_user(args.url, 5)
+    login = requests.post(f"{args.url}/login", json={"username": light[0], "password": light[1]})
+    login.raise_for_status()
+    light_token = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+    scenarios = [
+        ("GET /health", lambda s: s.get(f"{args.url}/health")),
+        ("GET /stats (большая история)", lambda s: s.get(f"{args.url}/stats", auth=heavy)),
+        ("GET /data (большая история)", lambda s: s.get(f"{args.url}/data", auth=heavy)),
+        ("GET /stats (малая история)", lambda s: s.get(f"{args.url}/stats", auth=light)),
+        ("GET /stats (малая история, токен)", lambda s: s.get(f"{args.url}/stats", headers=light_token)),
+        ("POST /data (малая история)", lambda s: s.post(f"{args.url}/data", json=make_record(0), auth=light)),
+    ]
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+
+    def worker(_):
+        session = requests.Session()
+        name, call = random.choice(scenarios)
+        start = time.perf_counter()
+        response = call(session)
+        latencies[name].append((time.perf_counter() - start) * 1000)
+        if response.status_code >= 400:
+            errors[name] += 1
+
+    print(f"🚀 {args.requests} запросов в {args.threads} потоков...")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(worker, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    print(f"\n{'Запрос':<32}{'кол-во':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'ошибки':>8}")
+    for name, _ in scenarios:
+        values = latencies[name]
+        if not values:
+            continue
+        print(f"{name:<32}{len(values):>8}{percentile(values, 50):>10.1f}"
+              f"{percentile(values, 95):>10.1f}{percentile(values, 99):>10.1f}{errors[name]:>8}")
+    print(f"\n⏱️ Всего: {elapsed:.1f} с, {args.requests / elapsed:.0f} запросов/с")
+
+if __name__ == "__main__":
+    main()
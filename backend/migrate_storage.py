@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Перенос пользователей и их записей из users.json и user_data/*.csv в SQLite
+
+Пример:
+    python migrate_storage.py --database sqlite:///./day_tracker.db
+"""
+
+import argparse
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from storage import FileStorage, SQLiteStorage
+
+def migrate(users_file: str, data_dir: str, database_url: str = None) -> int:
+    """Копирует всех пользователей и их таблицы в SQLite, возвращает число пользователей"""
+    source = FileStorage(users_file, data_dir)
+    target = SQLiteStorage(database_url)
+
+    users = source.load_users()
+    migrated = 0
+
+    for username, user in users.items():
+        target.save_users(users, [username])
+
+        if source.data_signature(user) is None:
+            print(f"⚠️ {username}: таблица данных не найдена, создаю пустую")
+            target.create_table(user, ['date'])
+            continue
+
+        df = source.read_records(user)
+        target.write_records(user, df)
+        migrated += 1
+        print(f"✅ {username}: перенесено записей: {len(df)}")
+
+    return migrated
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос данных UserManager в SQLite")
+    parser.add_argument("--users-file", default="users.json", help="Файл пользователей")
+    parser.add_argument("--data-dir", default="user_data", help="Папка с CSV таблицами")
+    parser.add_argument("--database", default=None,
+                        help="URL базы SQLite (по умолчанию из database.py)")
+    args = parser.parse_args()
+
+    count = migrate(args.users_file, args.data_dir, args.database or os.environ.get("DATABASE_URL"))
+    print(f"\n🏁 Перенесено пользователей с данными: {count}")
+    print("Для работы с SQLite запустите сервер с STORAGE_BACKEND=sqlite")
+
+if __name__ == "__main__":
+    main()
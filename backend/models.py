@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, Text, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Float, Text, ForeignKey, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -101,3 +101,53 @@ class MoodTracking(Base):
     user = relationship("User", back_populates="mood_trackings")
     daily_record = relationship("DailyRecord", back_populates="mood_trackings")
 
+class TrackerUser(Base):
+    """Пользователь UserManager (SQLite хранилище вместо users.json)"""
+    __tablename__ = "tracker_users"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(String, unique=True, index=True)
+    username = Column(String, unique=True, index=True)
+    password_hash = Column(String)
+    email = Column(String)
+    created_at = Column(String)  # ISO строка, как в users.json
+    last_login = Column(String, nullable=True)
+    data_file = Column(String)
+    
+    # Колонки таблицы записей (JSON список) и версия данных для кэшей
+    columns = Column(Text, default="[]")
+    data_version = Column(Integer, default=0)
+    
+    # Relationships
+    records = relationship("TrackerRecord", back_populates="user")
+    states = relationship("TrackerState", back_populates="user")
+
+class TrackerRecord(Base):
+    """Запись дня пользователя UserManager (вместо строки CSV таблицы)"""
+    __tablename__ = "tracker_records"
+    __table_args__ = (
+        Index("ix_tracker_records_user_date", "user_pk", "date"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_pk = Column(Integer, ForeignKey("tracker_users.id"), index=True)
+    date = Column(String, index=True)  # YYYY-MM-DD
+    data = Column(Text)  # JSON значения полей записи
+    
+    # Relationships
+    user = relationship("TrackerUser", back_populates="records")
+
+class TrackerState(Base):
+    """Служебное состояние пользователя UserManager (например, накопитель корреляций)"""
+    __tablename__ = "tracker_states"
+    __table_args__ = (
+        Index("ix_tracker_states_user_name", "user_pk", "name", unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_pk = Column(Integer, ForeignKey("tracker_users.id"), index=True)
+    name = Column(String)
+    data = Column(Text)  # JSON состояние
+    
+    # Relationships
+    user = relationship("TrackerUser", back_populates="states")
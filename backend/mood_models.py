@@ -0,0 +1,218 @@
+"""
+Модели предсказания оценки дня для пользователей UserManager.
+
+Связывает таблицы пользователей с DayAnalyzer из ml/: признаками служат
+числовые поля из fields_config.json, целью — оценка дня. Обученные модели
+хранятся в ModelRegistry и переобучаются только при изменении данных.
+Пользователи, которым не хватает данных для своей модели (или выбравшие режим
+population), получают предсказания общей модели с персональным сдвигом.
+ML зависимости (scikit-learn) необязательны: без них ML_AVAILABLE = False.
+"""
+
+import os
+import sys
+import threading
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from fields_registry import fields_registry
+from user_manager import CORRELATION_TARGET, UserManager
+
+# Модули анализа лежат в ../ml
+ML_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ml")
+if ML_DIR not in sys.path:
+    sys.path.append(ML_DIR)
+
+try:
+    from analyzer import TRAINING_MODES, DayAnalyzer
+    from model_registry import ModelRegistry
+    from population_model import PopulationModel
+    ML_AVAILABLE = True
+except ImportError as e:
+    print(f"⚠️ ML модули недоступны ({e}); предсказания отключены")
+    ML_AVAILABLE = False
+
+# Типы полей, которые используются как признаки модели
+NUMERIC_FIELD_TYPES = ("number", "integer", "boolean")
+# Режим без собственной модели: только общая модель со сдвигом пользователя
+POPULATION_MODE = "population"
+# Режим обучения по умолчанию (full, warm_start, online_linear, time_series_cv или population)
+DEFAULT_TRAINING_MODE = os.environ.get("TRAINING_MODE", "full")
+# Имя служебного состояния пользователя с настройками обучения
+TRAINING_STATE = "training"
+# Максимум сценариев в одном what-if запросе
+MAX_WHAT_IF_SCENARIOS = 10000
+
+def population_frames(user_manager: UserManager) -> Dict[str, pd.DataFrame]:
+    """Таблицы всех пользователей для обучения общей модели (user_id -> DataFrame)"""
+    frames = {}
+    for user in user_manager.list_users():
+        df = user_manager.get_user_data(user["username"])
+        if df is not None and not df.empty:
+            frames[user["user_id"]] = df
+    return frames
+
+class ModelNotReadyError(Exception):
+    """У пользователя недостаточно данных для обучения модели"""
+
+class MoodModelService:
+    """Модели оценки дня по пользователям (обучение по требованию и кэш)"""
+
+    def __init__(self, user_manager: UserManager, registry=None, fields=None):
+        self.user_manager = user_manager
+        self.registry = registry or ModelRegistry()
+        self.fields = fields or fields_registry
+        self.target = CORRELATION_TARGET
+        # TrainingScheduler: если задан, модели обучаются в фоне, а запросы
+        # используют последнюю сохраненную модель
+        self.scheduler = None
+        self._lock = threading.Lock()
+        # username -> DayAnalyzer с загруженной моделью
+        self._analyzers: Dict[str, "DayAnalyzer"] = {}
+        self._train_locks: Dict[str, threading.Lock] = {}
+
+    def feature_columns(self) -> List[str]:
+        """Числовые поля пользователя, кроме целевого"""
+        return [
+            field["name"] for field in self.fields.get_config()["fields"]
+            if field.get("field_type") in NUMERIC_FIELD_TYPES and field["name"] != self.target
+        ]
+
+    def training_modes(self) -> tuple:
+        """Режимы, доступные пользователю"""
+        return TRAINING_MODES + (POPULATION_MODE,)
+
+    def get_training_mode(self, username: str) -> str:
+        """Режим обучения модели пользователя"""
+        state = self.user_manager.load_user_state(username, TRAINING_STATE) or {}
+        return state.get("mode", DEFAULT_TRAINING_MODE)
+
+    def set_training_mode(self, username: str, mode: str) -> bool:
+        """Задает режим обучения модели пользователя"""
+        if mode not in self.training_modes():
+            raise ValueError(f"Неизвестный режим обучения: {mode} (доступны: {', '.join(self.training_modes())})")
+        return self.user_manager.save_user_state(username, TRAINING_STATE, {"mode": mode})
+
+    def _analyzer(self, username: str, user_id: str) -> "DayAnalyzer":
+        features = self.feature_columns()
+        with self._lock:
+            analyzer = self._analyzers.get(username)
+            if analyzer is None or analyzer.feature_columns != features:
+                analyzer = DayAnalyzer(registry=self.registry, user_id=user_id,
+                                       feature_columns=features, target=self.target)
+                self._analyzers[username] = analyzer
+            return analyzer
+
+    def population(self) -> "PopulationModel":
+        """Общая модель по текущим числовым полям"""
+        return PopulationModel(self.registry, self.feature_columns(), self.target)
+
+    def get_analyzer(self, username: str) -> Optional["DayAnalyzer"]:
+        """DayAnalyzer с моделью, актуальной для текущих данных пользователя
+
+        Возвращает None, если пользователя нет; ModelNotReadyError — если
+        данных недостаточно для обучения и общей модели тоже нет.
+        """
+        user_id = self.user_manager.get_user_id(username)
+        if user_id is None:
+            return None
+        
+        mode = self.get_training_mode(username)
+        if mode == POPULATION_MODE:
+            return self._population_analyzer(username, user_id, "Общая модель еще не обучена")
+        
+        if self.scheduler is not None:
+            return self._trained_analyzer(username, user_id)
+        
+        df = self.user_manager.get_user_data(username)
+        if df is None:
+            return None
+
+        analyzer = self._analyzer(username, user_id)
+        with self._lock:
+            train_lock = self._train_locks.setdefault(username, threading.Lock())
+        # Одновременные запросы одного пользователя обучают модель один раз
+        with train_lock:
+            result = analyzer.train_mood_prediction_model(df, mode)
+        if "error" in result:
+            return self._population_analyzer(username, user_id, result["error"], df)
+        return analyzer
+
+    def _trained_analyzer(self, username: str, user_id: str) -> "DayAnalyzer":
+        """Анализатор с последней обученной в фоне моделью"""
+        analyzer = self._analyzer(username, user_id)
+        if analyzer.has_model():
+            return analyzer
+        
+        # Прошлое обучение не удалось, а новых записей с тех пор не было
+        status = self.scheduler.get_status(username)
+        if status["status"] == "failed" and status["new_records"] == 0:
+            return self._population_analyzer(username, user_id, status["error"])
+        
+        self.scheduler.schedule(username)
+        return self._population_analyzer(username, user_id, "Модель обучается, повторите запрос позже")
+
+    def _population_analyzer(self, username: str, user_id: str, error: str,
+                             df: Optional[pd.DataFrame] = None) -> "DayAnalyzer":
+        """Общая модель со сдвигом пользователя, пока своей модели нет
+
+        Если общая модель еще не обучена, ставит ее обучение (при наличии
+        планировщика) и поднимает ModelNotReadyError(error).
+        """
+        population = self.population()
+        analyzer = population.analyzer(
+            user_id, df if df is not None else lambda: self.user_manager.get_user_data(username)
+        )
+        if analyzer is None:
+            if self.scheduler is not None:
+                self.scheduler.schedule_population()
+            raise ModelNotReadyError(error)
+        return analyzer
+
+    def model_updated(self, username: str):
+        """Сбрасывает загруженную модель пользователя после переобучения"""
+        with self._lock:
+            self._analyzers.pop(username, None)
+
+    def predict_batch(self, username: str, rows: List[Dict]) -> Optional[Dict]:
+        """Предсказания оценки дня для списка наборов признаков"""
+        analyzer = self.get_analyzer(username)
+        if analyzer is None:
+            return None
+        predictions = analyzer.predict_mood_batch(pd.DataFrame(rows))
+        return {
+            "features": analyzer.model_features(),
+            "model": self.model_source(analyzer),
+            "predictions": [round(float(value), 2) for value in predictions]
+        }
+
+    def what_if(self, username: str, base: Dict, grid: Dict[str, List]) -> Optional[Dict]:
+        """Предсказания по сетке значений выбранных признаков"""
+        analyzer = self.get_analyzer(username)
+        if analyzer is None:
+            return None
+
+        unknown = [feature for feature in grid if feature not in analyzer.model_features()]
+        if unknown:
+            raise ValueError(f"Неизвестные признаки: {', '.join(unknown)}")
+        scenarios = 1
+        for values in grid.values():
+            scenarios *= len(values)
+        if scenarios > MAX_WHAT_IF_SCENARIOS:
+            raise ValueError(f"Слишком много сценариев: {scenarios} (максимум {MAX_WHAT_IF_SCENARIOS})")
+
+        result = analyzer.what_if_grid(base, grid)
+        result["predicted_mood"] = result["predicted_mood"].round(2)
+        return {
+            "features": analyzer.model_features(),
+            "model": self.model_source(analyzer),
+            "scenarios": result.to_dict("records")
+        }
+
+    def model_source(self, analyzer: "DayAnalyzer") -> Dict:
+        """Какая модель дала предсказание: своя или общая со сдвигом"""
+        metadata = analyzer.model_metadata or {}
+        if metadata.get("mode") == POPULATION_MODE:
+            return {"type": "population", "calibration": metadata["calibration"]}
+        return {"type": "user", "mode": metadata.get("mode")}
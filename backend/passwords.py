@@ -0,0 +1,120 @@
+"""
+Хеширование паролей пользователей.
+
+Пароли хешируются медленной соленой функцией: bcrypt через passlib, если он
+установлен и работает, иначе scrypt из hashlib. Проверка такого хеша стоит
+десятки миллисекунд, поэтому выполняется только при входе: /login выдает
+подписанный токен (auth_tokens.py), и дальше запросы проверяют только его.
+
+Хеши старого формата (несоленый SHA-256) по-прежнему принимаются, а
+needs_rehash подсказывает заменить их при следующем успешном входе.
+"""
+
+import base64
+import hashlib
+import hmac
+import re
+import secrets
+import threading
+from typing import Optional
+
+try:
+    from passlib.context import CryptContext
+except ImportError:
+    CryptContext = None
+
+# Параметры scrypt: 2^14 итераций, 16 МБ памяти на проверку
+SCRYPT_LOG_N = 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_SALT_BYTES = 16
+SCRYPT_KEY_BYTES = 32
+# Хеш старого формата: SHA-256 пароля в hex
+LEGACY_HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+_bcrypt_lock = threading.Lock()
+_bcrypt_context = None
+_bcrypt_checked = False
+
+def _bcrypt() -> Optional["CryptContext"]:
+    """Контекст passlib с bcrypt или None, если bcrypt недоступен
+
+    Несовместимые версии passlib и bcrypt падают только при первом хешировании,
+    поэтому контекст проверяется пробным хешем один раз на процесс.
+    """
+    global _bcrypt_context, _bcrypt_checked
+    with _bcrypt_lock:
+        if not _bcrypt_checked:
+            _bcrypt_checked = True
+            if CryptContext is not None:
+                try:
+                    context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+                    context.verify("probe", context.hash("probe"))
+                    _bcrypt_context = context
+                except Exception as e:
+                    print(f"⚠️ bcrypt недоступен ({e}); пароли хешируются scrypt")
+        return _bcrypt_context
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _scrypt(password: str, salt: bytes, log_n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=2 ** log_n, r=r, p=p,
+                          maxmem=256 * r * 2 ** log_n, dklen=SCRYPT_KEY_BYTES)
+
+def hash_password(password: str) -> str:
+    """Соленый хеш пароля: bcrypt ($2b$...) или scrypt ($scrypt$...)"""
+    context = _bcrypt()
+    if context is not None:
+        return context.hash(password)
+
+    salt = secrets.token_bytes(SCRYPT_SALT_BYTES)
+    key = _scrypt(password, salt, SCRYPT_LOG_N, SCRYPT_R, SCRYPT_P)
+    return f"$scrypt$ln={SCRYPT_LOG_N},r={SCRYPT_R},p={SCRYPT_P}${_b64encode(salt)}${_b64encode(key)}"
+
+def _scrypt_params(password_hash: str):
+    """Параметры, соль и ключ из хеша $scrypt$ln=..,r=..,p=..$соль$ключ"""
+    _, _, params, salt, key = password_hash.split("$")
+    values = dict(item.split("=") for item in params.split(","))
+    return int(values["ln"]), int(values["r"]), int(values["p"]), _b64decode(salt), _b64decode(key)
+
+def verify_password(password: str, password_hash: str) -> bool:
+    """Проверяет пароль по хешу любого из поддерживаемых форматов"""
+    if not password_hash:
+        return False
+
+    if password_hash.startswith("$scrypt$"):
+        try:
+            log_n, r, p, salt, key = _scrypt_params(password_hash)
+        except ValueError:
+            print("Поврежденный хеш пароля")
+            return False
+        return hmac.compare_digest(_scrypt(password, salt, log_n, r, p), key)
+
+    if password_hash.startswith("$2"):
+        context = _bcrypt()
+        if context is None:
+            print("Хеш пароля bcrypt, но bcrypt недоступен")
+            return False
+        return context.verify(password, password_hash)
+
+    if LEGACY_HASH_PATTERN.match(password_hash):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, password_hash)
+    return False
+
+def needs_rehash(password_hash: str) -> bool:
+    """Нужно ли перехешировать пароль (старый формат или устаревшие параметры)"""
+    if password_hash.startswith("$scrypt$"):
+        try:
+            log_n, r, p, _, _ = _scrypt_params(password_hash)
+        except ValueError:
+            return True
+        return (log_n, r, p) != (SCRYPT_LOG_N, SCRYPT_R, SCRYPT_P)
+    if password_hash.startswith("$2"):
+        context = _bcrypt()
+        return context is not None and context.needs_update(password_hash)
+    return True
@@ -0,0 +1,151 @@
+"""
+Перевод таблиц пользователей в текущую схему полей.
+
+POST /fields и DELETE /fields/{name} меняют только fields_config.json:
+таблицы пользователей остаются как есть, а чтения приводят их к новой схеме на
+лету (FieldRegistry.project). Таблица переписывается при первой записи с
+измененным полем или фоновой задачей SchemaCompactor (SCHEMA_COMPACTION=1),
+которая обходит пользователей пачками по SCHEMA_COMPACTION_BATCH с паузой
+SCHEMA_COMPACTION_PAUSE секунд между пачками, чтобы не отнимать диск и
+процессор у запросов. Каждая таблица переписывается под блокировкой
+пользователя, и чтения до и после перевода дают одинаковый результат.
+
+Перевести все таблицы сразу можно вручную:
+
+    python schema_migration.py --batch-size 100
+"""
+
+import argparse
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from user_manager import UserManager
+
+# Переписывать таблицы в фоне после изменения схемы полей
+SCHEMA_COMPACTION = os.environ.get("SCHEMA_COMPACTION", "0") == "1"
+# Пользователей в одной пачке
+SCHEMA_COMPACTION_BATCH = int(os.environ.get("SCHEMA_COMPACTION_BATCH", "50"))
+# Пауза между пачками (секунды)
+SCHEMA_COMPACTION_PAUSE = float(os.environ.get("SCHEMA_COMPACTION_PAUSE", "1.0"))
+
+def compact_users(user_manager: UserManager, batch_size: int = SCHEMA_COMPACTION_BATCH,
+                  pause: float = 0.0, stop: Optional[threading.Event] = None,
+                  report: Optional[Dict] = None) -> Dict:
+    """Переписывает таблицы, записанные в старой схеме полей, пачками по batch_size
+
+    stop прерывает обход между пачками; report (если передан) заполняется по
+    ходу работы, чтобы по нему можно было следить за прогрессом.
+    """
+    started = time.perf_counter()
+    usernames = [user["username"] for user in user_manager.list_users()]
+    if report is None:
+        report = {}
+    report.update(schema_version=user_manager.fields.get_schema_version(),
+                  users=len(usernames), processed=0, migrated=0, failed=0)
+
+    for start in range(0, len(usernames), max(1, batch_size)):
+        if start and pause > 0:
+            if stop is not None:
+                stop.wait(pause)
+            else:
+                time.sleep(pause)
+        if stop is not None and stop.is_set():
+            break
+        for username in usernames[start:start + max(1, batch_size)]:
+            try:
+                if user_manager.migrate_user(username):
+                    report["migrated"] += 1
+            except Exception as e:
+                print(f"Ошибка перевода таблицы {username} в новую схему: {e}")
+                report["failed"] += 1
+            report["processed"] += 1
+
+    report["duration_seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+class SchemaCompactor:
+    """Фоновый поток, переписывающий таблицы после изменения схемы полей
+
+    Одновременно идет не больше одного обхода; изменение схемы во время обхода
+    запускает еще один обход после него.
+    """
+
+    def __init__(self, user_manager: UserManager, batch_size: int = SCHEMA_COMPACTION_BATCH,
+                 pause: float = SCHEMA_COMPACTION_PAUSE):
+        self.user_manager = user_manager
+        self.batch_size = batch_size
+        self.pause = pause
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._rerun = False
+        # Текущий (или последний) обход
+        self._job: Optional[Dict] = None
+
+    def _is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def schedule(self) -> Dict:
+        """Запускает обход таблиц (или отмечает, что нужен еще один)"""
+        with self._lock:
+            if self._is_running():
+                self._rerun = True
+            else:
+                self._stop.clear()
+                self._start()
+        return self.get_status()
+
+    def _start(self):
+        self._job = {"started_at": datetime.now().isoformat(), "finished_at": None}
+        self._thread = threading.Thread(target=self._run, args=(self._job,),
+                                        name="schema-compaction", daemon=True)
+        self._thread.start()
+
+    def _run(self, job: Dict):
+        try:
+            compact_users(self.user_manager, self.batch_size, self.pause, self._stop, job)
+        except Exception as e:
+            print(f"Ошибка перевода таблиц в новую схему: {e}")
+            job["error"] = str(e)
+        job["finished_at"] = datetime.now().isoformat()
+
+        with self._lock:
+            if self._rerun and not self._stop.is_set():
+                self._rerun = False
+                self._start()
+            else:
+                self._thread = None
+
+    def get_status(self) -> Dict:
+        """Состояние фонового перевода для /fields/compaction и /health"""
+        with self._lock:
+            job = dict(self._job) if self._job is not None else None
+            running = self._is_running()
+        return {
+            "status": "running" if running else "idle",
+            "schema_version": self.user_manager.fields.get_schema_version(),
+            "job": job
+        }
+
+    def shutdown(self):
+        """Останавливает обход после текущей пачки"""
+        self._stop.set()
+
+def main():
+    parser = argparse.ArgumentParser(description="Перевод таблиц пользователей в текущую схему полей")
+    parser.add_argument("--batch-size", type=int, default=SCHEMA_COMPACTION_BATCH, help="Пользователей в пачке")
+    parser.add_argument("--pause", type=float, default=0.0, help="Пауза между пачками, с")
+    args = parser.parse_args()
+
+    user_manager = UserManager()
+    print(f"🗂️ Перевод таблиц в схему версии {user_manager.fields.get_schema_version()}")
+    report = compact_users(user_manager, args.batch_size, args.pause)
+    print(f"Пользователей: {report['users']}, переписано таблиц: {report['migrated']}, "
+          f"ошибок: {report['failed']}")
+    print(f"⏱️ Всего: {report['duration_seconds']:.1f} с")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,609 @@
+"""
+Хранилища данных для UserManager.
+
+FileStorage хранит пользователей в каталоге users.json с журналом изменений
+(user_directory.py) и записи в CSV файле на каждого пользователя. SQLiteStorage хранит всё в SQLite (режим WAL) с индексами по
+пользователю и дате. Нужное хранилище выбирается переменной окружения
+STORAGE_BACKEND ("files" или "sqlite"); для "files" записи можно хранить в
+колоночном бинарном формате (DATA_FORMAT=columnar, см. columnar_storage.py).
+
+Изменения данных одного пользователя выполняются под межпроцессной
+блокировкой user_lock(), поэтому сервер можно запускать в несколько воркеров.
+"""
+
+import os
+import csv
+import json
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from file_lock import FileLock, atomic_write
+from user_directory import UserDirectory
+
+class StorageBackend:
+    """Базовый интерфейс хранилища пользователей и их записей"""
+
+    # Папка для lock-файлов пользователей
+    lock_dir = "."
+
+    def user_lock(self, user: Dict) -> FileLock:
+        """Межпроцессная блокировка данных пользователя"""
+        return FileLock(os.path.join(self.lock_dir, f"{user['user_id']}.lock"))
+
+    def load_users(self) -> Dict[str, Dict]:
+        """Загружает всех пользователей: username -> данные пользователя"""
+        raise NotImplementedError
+
+    def load_user(self, username: str) -> Optional[Dict]:
+        """Загружает одного пользователя (например, созданного другим процессом)"""
+        raise NotImplementedError
+
+    def load_user_by_id(self, user_id: str) -> Optional[Dict]:
+        """Загружает пользователя по user_id"""
+        raise NotImplementedError
+
+    def add_user(self, user: Dict) -> bool:
+        """Добавляет пользователя; False, если такое имя уже занято"""
+        raise NotImplementedError
+
+    def save_users(self, users: Dict[str, Dict], usernames: Optional[Iterable[str]] = None):
+        """Сохраняет пользователей (всех или только перечисленных в usernames)"""
+        raise NotImplementedError
+
+    def delete_user(self, user: Dict):
+        """Удаляет пользователя и его данные из хранилища"""
+        raise NotImplementedError
+
+    def create_table(self, user: Dict, columns: List[str]):
+        """Создает пустую таблицу записей пользователя"""
+        raise NotImplementedError
+
+    def data_signature(self, user: Dict) -> Optional[Tuple]:
+        """Отпечаток версии данных пользователя (None, если таблицы нет)"""
+        raise NotImplementedError
+
+    def columns(self, user: Dict) -> List[str]:
+        """Имена колонок таблицы пользователя (без чтения записей)"""
+        raise NotImplementedError
+
+    def read_records(self, user: Dict, columns: Optional[List[str]] = None,
+                     dtypes: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+        """Читает все записи пользователя
+
+        columns — только эти колонки; dtypes — типы колонок (см.
+        FieldRegistry.get_dtypes), без них типы выводятся как в pd.read_csv.
+        """
+        raise NotImplementedError
+
+    def write_records(self, user: Dict, data: pd.DataFrame):
+        """Полностью перезаписывает записи пользователя"""
+        raise NotImplementedError
+
+    def append_records(self, user: Dict, records: List[Dict]):
+        """Добавляет записи в конец таблицы пользователя"""
+        raise NotImplementedError
+
+    def iter_records(self, user: Dict, since: Optional[str] = None, until: Optional[str] = None,
+                     after: Optional[int] = None, chunk_size: int = 1000) -> Iterator[pd.DataFrame]:
+        """Читает записи частями по chunk_size строк
+
+        Индекс каждой части — позиция записи в таблице, по которой можно
+        продолжить чтение (after). Возвращаются записи с позицией больше after
+        и датой в диапазоне [since, until]. Снимок данных фиксируется при
+        вызове, сами части читаются лениво.
+        """
+        raise NotImplementedError
+
+    def load_state(self, user: Dict, name: str) -> Optional[Dict]:
+        """Читает служебное состояние пользователя (например, накопитель корреляций)"""
+        raise NotImplementedError
+
+    def save_state(self, user: Dict, name: str, state: Optional[Dict]):
+        """Сохраняет служебное состояние пользователя (None удаляет его)"""
+        raise NotImplementedError
+
+
+class _PrefixReader:
+    """Читает из файла не больше заданного числа байт (снимок на момент открытия)"""
+
+    def __init__(self, f, size: int):
+        self._f = f
+        self._left = size
+
+    def read(self, size: int = -1) -> bytes:
+        if self._left <= 0:
+            return b''
+        if size is None or size < 0 or size > self._left:
+            size = self._left
+        data = self._f.read(size)
+        self._left -= len(data)
+        return data
+
+
+def _filter_dates(chunk: pd.DataFrame, since: Optional[str], until: Optional[str]) -> pd.DataFrame:
+    """Оставляет записи с датой в диапазоне [since, until] (даты ГГГГ-ММ-ДД)"""
+    if since is None and until is None:
+        return chunk
+    dates = chunk['date'].astype(str)
+    mask = pd.Series(True, index=chunk.index)
+    if since is not None:
+        mask &= dates >= since
+    if until is not None:
+        mask &= dates <= until
+    return chunk[mask]
+
+
+def _cast_column(values: pd.Series, dtype: str) -> pd.Series:
+    """Приводит колонку к типу dtype; ValueError, если значения в него не помещаются"""
+    if dtype.startswith("datetime64"):
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return values
+        return pd.to_datetime(values, format="%Y-%m-%d").astype(dtype)
+
+    numbers = pd.to_numeric(values)
+    if dtype.startswith("Int"):
+        present = numbers.dropna().to_numpy(dtype=float)
+        info = np.iinfo(dtype.lower())
+        if (present != np.round(present)).any() or (present < info.min).any() or (present > info.max).any():
+            raise ValueError(f"значения не помещаются в {dtype}")
+    return numbers.astype(dtype)
+
+def apply_dtypes(df: pd.DataFrame, dtypes: Optional[Dict[str, str]]) -> pd.DataFrame:
+    """Приводит колонки таблицы к типам схемы
+
+    Колонки, значения которых не помещаются в тип схемы (например, данные,
+    записанные до изменения поля), остаются с выведенным типом.
+    """
+    if not dtypes:
+        return df
+    for column in df.columns:
+        dtype = dtypes.get(column)
+        if dtype is None or str(df[column].dtype) == dtype:
+            continue
+        try:
+            df[column] = _cast_column(df[column], dtype)
+        except (ValueError, TypeError, OverflowError) as e:
+            print(f"Колонка {column} оставлена с типом {df[column].dtype}: {e}")
+    return df
+
+def _reader_dtypes(dtypes: Dict[str, str]) -> Dict[str, str]:
+    """Типы для pd.read_csv: целые читаются в Int64 (узкий тип при переполнении
+    молча обрезал бы значения) и сужаются в apply_dtypes с проверкой диапазона"""
+    return {
+        column: "Int64" if dtype.startswith("Int") else dtype
+        for column, dtype in dtypes.items()
+        if not dtype.startswith("datetime64")
+    }
+
+
+class FileStorage(StorageBackend):
+    """Пользователи в каталоге users.json с журналом, записи в отдельном CSV на пользователя"""
+
+    def __init__(self, users_file: str = "users.json", data_dir: str = "user_data"):
+        self.users_file = users_file
+        self.data_dir = data_dir
+        self.lock_dir = data_dir
+        self.directory = UserDirectory(users_file)
+        self._ensure_data_dir()
+
+    def _ensure_data_dir(self):
+        """Создает папку для данных пользователей если её нет"""
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+            print(f"Создана папка: {self.data_dir}")
+
+    def _data_path(self, user: Dict) -> str:
+        return os.path.join(self.data_dir, user["data_file"])
+
+    def load_users(self) -> Dict[str, Dict]:
+        return self.directory.all()
+
+    def load_user(self, username: str) -> Optional[Dict]:
+        return self.directory.get(username)
+
+    def load_user_by_id(self, user_id: str) -> Optional[Dict]:
+        return self.directory.get_by_id(user_id)
+
+    def add_user(self, user: Dict) -> bool:
+        return self.directory.add(user)
+
+    def save_users(self, users: Dict[str, Dict], usernames: Optional[Iterable[str]] = None):
+        if usernames is None:
+            self.directory.replace_all(users)
+            return
+        # В журнал попадают только перечисленные пользователи; изменения
+        # других процессов при этом не затираются
+        self.directory.update(users[username] for username in usernames if username in users)
+
+    def _state_path(self, user: Dict, name: str) -> str:
+        return os.path.join(self.data_dir, f"{user['user_id']}_{name}.json")
+
+    def delete_user(self, user: Dict):
+        self.directory.remove(user["username"], user["user_id"])
+
+        filename = self._data_path(user)
+        if os.path.exists(filename):
+            os.remove(filename)
+        for state_file in os.listdir(self.data_dir):
+            if state_file.startswith(f"{user['user_id']}_") and state_file.endswith(".json"):
+                os.remove(os.path.join(self.data_dir, state_file))
+
+    def create_table(self, user: Dict, columns: List[str]):
+        self.write_records(user, pd.DataFrame(columns=columns))
+
+    def data_signature(self, user: Dict) -> Optional[Tuple]:
+        filename = self._data_path(user)
+        if not os.path.exists(filename):
+            return None
+        stat = os.stat(filename)
+        return stat.st_mtime_ns, stat.st_size
+
+    def columns(self, user: Dict) -> List[str]:
+        return self._read_header(self._data_path(user)) or []
+
+    def read_records(self, user: Dict, columns: Optional[List[str]] = None,
+                     dtypes: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+        kwargs = {}
+        if columns is not None:
+            selected = set(columns)
+            kwargs["usecols"] = lambda column: column in selected
+        if not dtypes:
+            return pd.read_csv(self._data_path(user), **kwargs)
+
+        try:
+            df = pd.read_csv(self._data_path(user), dtype=_reader_dtypes(dtypes), **kwargs)
+        except (ValueError, TypeError):
+            # В файле есть значения не по схеме: читаем с выводом типов
+            df = pd.read_csv(self._data_path(user), **kwargs)
+        return apply_dtypes(df, dtypes)
+
+    def write_records(self, user: Dict, data: pd.DataFrame):
+        with atomic_write(self._data_path(user)) as f:
+            data.to_csv(f, index=False)
+
+    def _read_header(self, filename: str) -> Optional[List[str]]:
+        """Читает заголовок CSV таблицы, не загружая сами данные"""
+        if not os.path.exists(filename):
+            return None
+
+        with open(filename, 'r', encoding='utf-8', newline='') as f:
+            header = next(csv.reader(f), None)
+        return header or None
+
+    def _ends_with_newline(self, filename: str) -> bool:
+        """Проверяет, что файл заканчивается переводом строки"""
+        with open(filename, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return True
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def append_records(self, user: Dict, records: List[Dict]):
+        filename = self._data_path(user)
+        columns = self._read_header(filename)
+
+        # Если таблицы нет или в записях появились новые поля,
+        # переписываем файл целиком с расширенным заголовком
+        if columns is None or any(key not in columns for record in records for key in record):
+            df = self.read_records(user) if columns is not None else pd.DataFrame()
+            new_df = pd.concat([df, pd.DataFrame(records)], ignore_index=True)
+            self.write_records(user, new_df)
+            return
+
+        # Иначе дописываем строки в конец файла без чтения истории
+        if not self._ends_with_newline(filename):
+            with open(filename, 'a', encoding='utf-8') as f:
+                f.write('\n')
+        rows = pd.DataFrame(records).reindex(columns=columns)
+        rows.to_csv(filename, mode='a', header=False, index=False)
+
+    def iter_records(self, user: Dict, since: Optional[str] = None, until: Optional[str] = None,
+                     after: Optional[int] = None, chunk_size: int = 1000) -> Iterator[pd.DataFrame]:
+        start = 0 if after is None else after + 1
+        # Размер фиксируем сразу: строки, дописанные после вызова, не читаются
+        f = open(self._data_path(user), 'rb')
+        size = os.fstat(f.fileno()).st_size
+
+        def chunks():
+            with f:
+                reader = pd.read_csv(_PrefixReader(f, size), chunksize=chunk_size,
+                                     skiprows=range(1, start + 1))
+                for chunk in reader:
+                    chunk.index = chunk.index + start
+                    chunk = _filter_dates(chunk, since, until)
+                    if not chunk.empty:
+                        yield chunk
+
+        return chunks()
+
+    def load_state(self, user: Dict, name: str) -> Optional[Dict]:
+        filename = self._state_path(user, name)
+        if not os.path.exists(filename):
+            return None
+        with open(filename, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_state(self, user: Dict, name: str, state: Optional[Dict]):
+        filename = self._state_path(user, name)
+        if state is None:
+            if os.path.exists(filename):
+                os.remove(filename)
+            return
+        with atomic_write(filename) as f:
+            json.dump(state, f, ensure_ascii=False)
+
+
+class SQLiteStorage(StorageBackend):
+    """Пользователи и записи в SQLite (WAL) с индексами по пользователю и дате"""
+
+    def __init__(self, database_url: Optional[str] = None):
+        # Импортируем SQLAlchemy только при выборе этого хранилища
+        from sqlalchemy.orm import sessionmaker
+        from database import SQLALCHEMY_DATABASE_URL, create_sqlite_engine
+        from models import Base, TrackerUser, TrackerRecord, TrackerState
+
+        self.database_url = database_url or SQLALCHEMY_DATABASE_URL
+        self.engine = create_sqlite_engine(self.database_url)
+        database_path = self.engine.url.database or "day_tracker.db"
+        self.lock_dir = f"{database_path}.locks"
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.TrackerUser = TrackerUser
+        self.TrackerRecord = TrackerRecord
+        self.TrackerState = TrackerState
+        Base.metadata.create_all(
+            bind=self.engine,
+            tables=[TrackerUser.__table__, TrackerRecord.__table__, TrackerState.__table__]
+        )
+
+    # Поля словаря пользователя, которые хранятся в отдельных колонках
+    USER_FIELDS = ["user_id", "username", "password_hash", "email",
+                   "created_at", "last_login", "data_file"]
+
+    def _to_dict(self, row) -> Dict:
+        return {field: getattr(row, field) for field in self.USER_FIELDS}
+
+    def _get_row(self, session, user: Dict):
+        return session.query(self.TrackerUser).filter(
+            self.TrackerUser.user_id == user["user_id"]
+        ).one_or_none()
+
+    def load_users(self) -> Dict[str, Dict]:
+        with self.SessionLocal() as session:
+            rows = session.query(self.TrackerUser).all()
+            return {row.username: self._to_dict(row) for row in rows}
+
+    def load_user(self, username: str) -> Optional[Dict]:
+        with self.SessionLocal() as session:
+            row = session.query(self.TrackerUser).filter(
+                self.TrackerUser.username == username
+            ).one_or_none()
+            return self._to_dict(row) if row is not None else None
+
+    def load_user_by_id(self, user_id: str) -> Optional[Dict]:
+        with self.SessionLocal() as session:
+            row = self._get_row(session, {"user_id": user_id})
+            return self._to_dict(row) if row is not None else None
+
+    def add_user(self, user: Dict) -> bool:
+        from sqlalchemy.exc import IntegrityError
+
+        with self.SessionLocal() as session:
+            row = self.TrackerUser(columns="[]", data_version=0)
+            for field in self.USER_FIELDS:
+                setattr(row, field, user.get(field))
+            session.add(row)
+            try:
+                session.commit()
+            except IntegrityError:
+                # Уникальный индекс по username защищает от гонки регистраций
+                session.rollback()
+                return False
+            return True
+
+    def save_users(self, users: Dict[str, Dict], usernames: Optional[Iterable[str]] = None):
+        names = list(users.keys()) if usernames is None else [n for n in usernames if n in users]
+        if not names:
+            return
+
+        with self.SessionLocal() as session:
+            for username in names:
+                user = users[username]
+                row = self._get_row(session, user)
+                if row is None:
+                    row = self.TrackerUser(columns="[]", data_version=0)
+                    session.add(row)
+                for field in self.USER_FIELDS:
+                    setattr(row, field, user.get(field))
+            session.commit()
+
+    def delete_user(self, user: Dict):
+        with self.SessionLocal() as session:
+            row = self._get_row(session, user)
+            if row is not None:
+                for model in (self.TrackerRecord, self.TrackerState):
+                    session.query(model).filter(
+                        model.user_pk == row.id
+                    ).delete(synchronize_session=False)
+                session.delete(row)
+                session.commit()
+
+    def create_table(self, user: Dict, columns: List[str]):
+        with self.SessionLocal() as session:
+            row = self._get_row(session, user)
+            if row is None:
+                return
+            session.query(self.TrackerRecord).filter(
+                self.TrackerRecord.user_pk == row.id
+            ).delete(synchronize_session=False)
+            row.columns = json.dumps(columns, ensure_ascii=False)
+            row.data_version += 1
+            session.commit()
+
+    def data_signature(self, user: Dict) -> Optional[Tuple]:
+        with self.SessionLocal() as session:
+            row = self._get_row(session, user)
+            if row is None or not json.loads(row.columns):
+                return None
+            return (row.data_version,)
+
+    def columns(self, user: Dict) -> List[str]:
+        with self.SessionLocal() as session:
+            row = self._get_row(session, user)
+            return json.loads(row.columns) if row is not None else []
+
+    def read_records(self, user: Dict, columns: Optional[List[str]] = None,
+                     dtypes: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+        with self.SessionLocal() as session:
+            row = self._get_row(session, user)
+            if row is None:
+                return pd.DataFrame()
+            selected = columns
+            columns = json.loads(row.columns)
+            if selected is not None:
+                columns = [column for column in columns if column in selected]
+            records = session.query(
+                self.TrackerRecord.date, self.TrackerRecord.data
+            ).filter(
+                self.TrackerRecord.user_pk == row.id
+            ).order_by(self.TrackerRecord.id).all()
+
+        data = [{"date": date, **json.loads(values)} for date, values in records]
+        return apply_dtypes(pd.DataFrame(data, columns=columns), dtypes)
+
+    def _record_row(self, user_pk: int, record: Dict):
+        values = {key: value for key, value in record.items() if key != "date"}
+        return self.TrackerRecord(
+            user_pk=user_pk,
+            date=record.get("date"),
+            data=json.dumps(values, ensure_ascii=False, default=_json_default)
+        )
+
+    def _extend_columns(self, row, records: Iterable[Dict]):
+        columns = json.loads(row.columns)
+        for record in records:
+            for key in record:
+                if key not in columns:
+                    columns.append(key)
+        row.columns = json.dumps(columns, ensure_ascii=False)
+
+    def write_records(self, user: Dict, data: pd.DataFrame):
+        # NaN из DataFrame сохраняем как отсутствующие значения
+        records = [
+            {key: value for key, value in record.items() if not pd.isna(value)}
+            for record in data.to_dict('records')
+        ]
+        with self.SessionLocal() as session:
+            row = self._get_row(session, user)
+            if row is None:
+                raise KeyError(f"Пользователь {user['username']} не найден")
+            session.query(self.TrackerRecord).filter(
+                self.TrackerRecord.user_pk == row.id
+            ).delete(synchronize_session=False)
+            row.columns = json.dumps([str(column) for column in data.columns], ensure_ascii=False)
+            session.add_all([self._record_row(row.id, record) for record in records])
+            row.data_version += 1
+            session.commit()
+
+    def append_records(self, user: Dict, records: List[Dict]):
+        with self.SessionLocal() as session:
+            row = self._get_row(session, user)
+            if row is None:
+                raise KeyError(f"Пользователь {user['username']} не найден")
+            self._extend_columns(row, [{"date": None}] + records)
+            session.add_all([self._record_row(row.id, record) for record in records])
+            row.data_version += 1
+            session.commit()
+
+    def iter_records(self, user: Dict, since: Optional[str] = None, until: Optional[str] = None,
+                     after: Optional[int] = None, chunk_size: int = 1000) -> Iterator[pd.DataFrame]:
+        session = self.SessionLocal()
+        row = self._get_row(session, user)
+        if row is None:
+            session.close()
+            return iter(())
+
+        columns = json.loads(row.columns)
+        query = session.query(
+            self.TrackerRecord.id, self.TrackerRecord.date, self.TrackerRecord.data
+        ).filter(self.TrackerRecord.user_pk == row.id)
+        if after is not None:
+            query = query.filter(self.TrackerRecord.id > after)
+        if since is not None:
+            query = query.filter(self.TrackerRecord.date >= since)
+        if until is not None:
+            query = query.filter(self.TrackerRecord.date <= until)
+        query = query.order_by(self.TrackerRecord.id)
+
+        def chunks():
+            try:
+                ids, data = [], []
+                for record_id, date, values in query.yield_per(chunk_size):
+                    ids.append(record_id)
+                    data.append({"date": date, **json.loads(values)})
+                    if len(data) == chunk_size:
+                        yield pd.DataFrame(data, index=ids, columns=columns)
+                        ids, data = [], []
+                if data:
+                    yield pd.DataFrame(data, index=ids, columns=columns)
+            finally:
+                session.close()
+
+        return chunks()
+
+    def load_state(self, user: Dict, name: str) -> Optional[Dict]:
+        with self.SessionLocal() as session:
+            row = self._get_row(session, user)
+            if row is None:
+                return None
+            state = session.query(self.TrackerState).filter(
+                self.TrackerState.user_pk == row.id,
+                self.TrackerState.name == name
+            ).one_or_none()
+            return json.loads(state.data) if state is not None else None
+
+    def save_state(self, user: Dict, name: str, state: Optional[Dict]):
+        with self.SessionLocal() as session:
+            row = self._get_row(session, user)
+            if row is None:
+                return
+            stored = session.query(self.TrackerState).filter(
+                self.TrackerState.user_pk == row.id,
+                self.TrackerState.name == name
+            ).one_or_none()
+            if state is None:
+                if stored is not None:
+                    session.delete(stored)
+            else:
+                if stored is None:
+                    stored = self.TrackerState(user_pk=row.id, name=name)
+                    session.add(stored)
+                stored.data = json.dumps(state, ensure_ascii=False)
+            session.commit()
+
+
+def _json_default(value):
+    """Приводит numpy скаляры к обычным типам Python для JSON"""
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"Тип {type(value).__name__} не сериализуется в JSON")
+
+
+def create_storage(backend: Optional[str] = None, users_file: str = "users.json",
+                   data_dir: str = "user_data", database_url: Optional[str] = None) -> StorageBackend:
+    """Создает хранилище по имени или по переменной окружения STORAGE_BACKEND"""
+    backend = backend or os.environ.get("STORAGE_BACKEND", "files")
+
+    if backend == "files":
+        data_format = os.environ.get("DATA_FORMAT", "csv")
+        if data_format == "columnar":
+            from columnar_storage import ColumnarStorage
+            return ColumnarStorage(users_file, data_dir)
+        if data_format != "csv":
+            raise ValueError(f"Неизвестный формат данных: {data_format}")
+        return FileStorage(users_file, data_dir)
+    if backend == "sqlite":
+        return SQLiteStorage(database_url or os.environ.get("DATABASE_URL"))
+
+    raise ValueError(f"Неизвестное хранилище: {backend}")
@@ -0,0 +1,488 @@
+"""
+Фоновое обучение моделей оценки дня в пуле процессов.
+
+TrainingScheduler ставит задачу обучения пользователя, когда у него накопилось
+достаточно новых записей (TRAINING_MIN_NEW_RECORDS), и выполняет ее в
+отдельном процессе, поэтому обучение случайного леса не занимает воркеры
+веб-сервера и не упирается в GIL. На пользователя приходится не больше одной
+ожидающей задачи: повторные запросы возвращают уже поставленную, а записи,
+пришедшие во время обучения, запускают еще одно обучение после него.
+Число одновременно обучаемых моделей ограничено TRAINING_WORKERS.
+Общая модель всех пользователей переобучается так же в фоне, когда у всех
+вместе накопилось POPULATION_MIN_NEW_RECORDS новых записей.
+
+train_all_users переобучает модели всех пользователей и общую модель
+(например, после изменения схемы полей), распределяя их по процессам:
+
+    python training_jobs.py --workers 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+from mood_models import POPULATION_MODE, MoodModelService
+
+# Процессов для обучения (по умолчанию половина ядер)
+TRAINING_WORKERS = int(os.environ.get("TRAINING_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Сколько новых записей нужно, чтобы переобучить модель пользователя
+TRAINING_MIN_NEW_RECORDS = int(os.environ.get("TRAINING_MIN_NEW_RECORDS", "5"))
+# Сколько новых записей всех пользователей нужно, чтобы переобучить общую модель
+POPULATION_MIN_NEW_RECORDS = int(os.environ.get("POPULATION_MIN_NEW_RECORDS", "100"))
+
+# UserManager дочернего процесса по (users_file, data_dir)
+_worker_managers: Dict[Tuple[str, str], "UserManager"] = {}
+
+def threads_per_worker(workers: int) -> int:
+    """Потоков на процесс, чтобы процессы вместе не занимали больше ядер, чем есть"""
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+def storage_config(user_manager) -> Dict:
+    """Где дочерний процесс найдет таблицы пользователей
+
+    Вид хранилища (STORAGE_BACKEND, DATA_FORMAT, DATABASE_URL) дочерние
+    процессы берут из тех же переменных окружения.
+    """
+    return {"users_file": user_manager.users_file, "data_dir": user_manager.data_dir}
+
+def _worker_user_manager(storage: Dict) -> "UserManager":
+    """UserManager для чтения таблиц в дочернем процессе (без кэша таблиц)"""
+    from user_manager import UserManager
+
+    key = (storage["users_file"], storage["data_dir"])
+    manager = _worker_managers.get(key)
+    if manager is None:
+        manager = _worker_managers[key] = UserManager(*key, cache_size=0)
+    return manager
+
+def train_user_model(models_dir: str, user_id: str, df: pd.DataFrame,
+                     feature_columns: List[str], target: str, n_jobs: int = 1,
+                     mode: str = "full") -> Dict:
+    """Обучает и сохраняет модель пользователя (выполняется в дочернем процессе)"""
+    from analyzer import DayAnalyzer
+    from model_registry import ModelRegistry
+
+    analyzer = DayAnalyzer(registry=ModelRegistry(models_dir), user_id=user_id,
+                           feature_columns=feature_columns, target=target, n_jobs=n_jobs)
+    started = time.perf_counter()
+    if threadpool_limits is not None:
+        # BLAS/OpenMP внутри процесса тоже ограничиваем его долей ядер
+        with threadpool_limits(limits=n_jobs):
+            result = analyzer.train_mood_prediction_model(df, mode)
+    else:
+        result = analyzer.train_mood_prediction_model(df, mode)
+    result["duration_seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+def train_stored_user_model(models_dir: str, storage: Dict, username: str,
+                            feature_columns: List[str], target: str, n_jobs: int = 1,
+                            mode: str = "full") -> Dict:
+    """Читает таблицу пользователя и обучает его модель (выполняется в дочернем процессе)"""
+    manager = _worker_user_manager(storage)
+    user_id = manager.get_user_id(username)
+    df = manager.get_user_data(username) if user_id is not None else None
+    if df is None:
+        return {"error": "Нет данных", "records": 0}
+    result = train_user_model(models_dir, user_id, df, feature_columns, target, n_jobs, mode)
+    result["records"] = len(df)
+    return result
+
+def train_population_model(models_dir: str, storage: Dict, feature_columns: List[str],
+                           target: str, n_jobs: int = 1) -> Dict:
+    """Обучает и сохраняет общую модель (выполняется в дочернем процессе)
+
+    Таблицы всех пользователей читаются здесь же, а не в процессе
+    веб-сервера: запрос, поставивший обучение, их не загружает и не
+    передает в пул.
+    """
+    from model_registry import ModelRegistry
+    from mood_models import population_frames
+    from population_model import PopulationModel
+
+    population = PopulationModel(ModelRegistry(models_dir), feature_columns, target, n_jobs=n_jobs)
+    started = time.perf_counter()
+    frames = population_frames(_worker_user_manager(storage))
+    if threadpool_limits is not None:
+        with threadpool_limits(limits=n_jobs):
+            result = population.train(frames)
+    else:
+        result = population.train(frames)
+    result["records"] = sum(len(df) for df in frames.values())
+    result["duration_seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+class TrainingScheduler:
+    """Очередь задач обучения с дедупликацией по пользователю"""
+
+    def __init__(self, service: MoodModelService, max_workers: int = TRAINING_WORKERS,
+                 min_new_records: int = TRAINING_MIN_NEW_RECORDS,
+                 population_min_new_records: int = POPULATION_MIN_NEW_RECORDS):
+        self.service = service
+        self.max_workers = max_workers
+        self.min_new_records = min_new_records
+        self.population_min_new_records = population_min_new_records
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # username -> описание последней задачи
+        self._jobs: Dict[str, Dict] = {}
+        # username -> число записей, добавленных после постановки последней задачи
+        self._new_records: Dict[str, int] = {}
+        # Последнее обучение общей модели и записи всех пользователей после него
+        self._population_job: Optional[Dict] = None
+        self._population_new_records = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: дочерние процессы не наследуют потоки и блокировки веб-сервера
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def _submit(self, fn, *args) -> Future:
+        """Отправляет задачу в пул (вызывается под self._lock)
+
+        Если дочерний процесс упал (OOM, ошибка импорта), пул становится
+        непригодным навсегда: такой пул закрывается и задача отправляется в
+        новый. Если не удалось и это, возвращается завершенный с ошибкой
+        Future, и задача учитывается как failed, а не роняет запрос.
+        """
+        for _ in range(2):
+            try:
+                return self._get_executor().submit(fn, *args)
+            except BrokenProcessPool as e:
+                print(f"Пул обучения сломан, создается заново: {e}")
+                error = e
+                executor, self._executor = self._executor, None
+                if executor is not None:
+                    executor.shutdown(wait=False, cancel_futures=True)
+        future = Future()
+        future.set_exception(error)
+        return future
+
+    def _is_active(self, job: Optional[Dict]) -> bool:
+        return job is not None and not job["future"].done()
+
+    def record_added(self, username: str, count: int = 1) -> Optional[Dict]:
+        """Учитывает новые записи и ставит обучение, если их накопилось достаточно"""
+        with self._lock:
+            pending = self._new_records.get(username, 0) + count
+            self._new_records[username] = pending
+            self._population_new_records += count
+            population_pending = self._population_new_records
+        if population_pending >= self.population_min_new_records:
+            self.schedule_population()
+        if pending >= self.min_new_records:
+            return self.schedule(username, rerun_if_active=True)
+        return None
+
+    def schedule(self, username: str, rerun_if_active: bool = False) -> Optional[Dict]:
+        """Ставит обучение модели пользователя (или возвращает уже поставленное)
+
+        rerun_if_active: данные изменились после постановки активной задачи,
+        поэтому после нее нужно обучить модель еще раз.
+        """
+        with self._lock:
+            job = self._jobs.get(username)
+            if self._is_active(job):
+                if rerun_if_active:
+                    job["rerun"] = True
+                return self._describe(job)
+
+        user_id = self.service.user_manager.get_user_id(username)
+        df = self.service.user_manager.get_user_data(username)
+        if user_id is None or df is None:
+            return None
+        mode = self.service.get_training_mode(username)
+        if mode == POPULATION_MODE:
+            # Своей модели нет: предсказания дает общая модель
+            with self._lock:
+                self._new_records[username] = 0
+            return {"username": username, "status": "population", "mode": mode, "error": None}
+
+        with self._lock:
+            job = self._jobs.get(username)
+            if self._is_active(job):
+                return self._describe(job)
+
+            future = self._submit(
+                train_user_model, self.service.registry.models_dir, user_id, df,
+                self.service.feature_columns(), self.service.target,
+                threads_per_worker(self.max_workers), mode
+            )
+            job = {
+                "username": username,
+                "future": future,
+                "mode": mode,
+                "records": len(df),
+                "queued_at": datetime.now().isoformat(),
+                "finished_at": None,
+                "result": None,
+                "error": None,
+                "rerun": False
+            }
+            self._jobs[username] = job
+            self._new_records[username] = 0
+
+        future.add_done_callback(lambda done: self._finished(username, done))
+        return self._describe(job)
+
+    def schedule_population(self) -> Dict:
+        """Ставит обучение общей модели (или возвращает уже поставленное)
+
+        Если прошлое обучение не удалось (например, не хватило данных), а
+        новых записей с тех пор не было, оно не повторяется: предсказания
+        без общей модели не перечитывают таблицы всех пользователей.
+        """
+        with self._lock:
+            job = self._population_job
+            if self._is_active(job):
+                return self._describe(job)
+            if job is not None and self._population_new_records == 0:
+                description = self._describe(job)
+                if description["status"] == "failed":
+                    return description
+
+            future = self._submit(
+                train_population_model, self.service.registry.models_dir,
+                storage_config(self.service.user_manager), self.service.feature_columns(),
+                self.service.target, threads_per_worker(self.max_workers)
+            )
+            job = {
+                "username": None,
+                "future": future,
+                "mode": POPULATION_MODE,
+                # Число записей становится известно, когда процесс их прочитает
+                "records": None,
+                "queued_at": datetime.now().isoformat(),
+                "finished_at": None,
+                "result": None,
+                "error": None,
+                "rerun": False
+            }
+            self._population_job = job
+            self._population_new_records = 0
+
+        future.add_done_callback(lambda done: self._population_finished(done))
+        return self._describe(job)
+
+    def _population_finished(self, future: Future):
+        with self._lock:
+            job = self._population_job
+            if job is None or job["future"] is not future:
+                return
+            job["finished_at"] = datetime.now().isoformat()
+            try:
+                job["result"] = future.result()
+                job["records"] = job["result"].get("records")
+            except Exception as e:
+                print(f"Ошибка обучения общей модели: {e}")
+                job["error"] = str(e)
+
+    def get_population_status(self) -> Dict:
+        """Состояние обучения общей модели"""
+        with self._lock:
+            new_records = self._population_new_records
+            if self._population_job is None:
+                return {"status": "idle", "new_records": new_records}
+            description = self._describe(self._population_job)
+        del description["username"]
+        description["new_records"] = new_records
+        return description
+
+    def _finished(self, username: str, future: Future):
+        with self._lock:
+            job = self._jobs.get(username)
+            if job is None or job["future"] is not future:
+                return
+            job["finished_at"] = datetime.now().isoformat()
+            try:
+                job["result"] = future.result()
+            except Exception as e:
+                print(f"Ошибка обучения модели {username}: {e}")
+                job["error"] = str(e)
+            rerun = job["rerun"]
+
+        # Следующий запрос возьмет новую модель из реестра
+        self.service.model_updated(username)
+        if rerun:
+            self.schedule(username)
+
+    def _describe(self, job: Dict) -> Dict:
+        future = job["future"]
+        if not future.done():
+            status = "running" if future.running() else "queued"
+        elif job["error"] is not None or (job["result"] or {}).get("error"):
+            status = "failed"
+        else:
+            status = "done"
+
+        return {
+            "username": job["username"],
+            "status": status,
+            "mode": job["mode"],
+            "records": job["records"],
+            "queued_at": job["queued_at"],
+            "finished_at": job["finished_at"],
+            "result": job["result"],
+            "error": job["error"] or (job["result"] or {}).get("error")
+        }
+
+    def get_status(self, username: str) -> Dict:
+        """Состояние обучения модели пользователя"""
+        with self._lock:
+            job = self._jobs.get(username)
+            new_records = self._new_records.get(username, 0)
+            if job is None:
+                return {"username": username, "status": "idle", "new_records": new_records}
+            description = self._describe(job)
+        description["new_records"] = new_records
+        return description
+
+    def info(self) -> Dict:
+        """Сводка очереди для /health"""
+        with self._lock:
+            active = [job for job in self._jobs.values() if self._is_active(job)]
+            if self._is_active(self._population_job):
+                active.append(self._population_job)
+            return {
+                "workers": self.max_workers,
+                "running": sum(1 for job in active if job["future"].running()),
+                "queued": sum(1 for job in active if not job["future"].running())
+            }
+
+    def shutdown(self):
+        """Останавливает пул процессов (ожидающие задачи отменяются)"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+def train_all_users(service: MoodModelService, workers: int = TRAINING_WORKERS) -> Dict:
+    """Обучает модели всех пользователей параллельно в workers процессах
+
+    Каждый процесс обучает лес в threads_per_worker(workers) потоков. Вместе с
+    моделями пользователей обучается общая модель; пользователи в режиме
+    population своей модели не получают. Модели, данные которых не
+    изменились, не переобучаются (проверка по отпечатку в ModelRegistry).
+    Таблицы читают сами дочерние процессы, а в пул одновременно передано не
+    больше 2 * workers пользователей, поэтому история всех пользователей не
+    оказывается в памяти сразу. Возвращает время и метрики по каждому
+    пользователю и общей модели.
+    """
+    n_jobs = threads_per_worker(workers)
+    features = service.feature_columns()
+    storage = storage_config(service.user_manager)
+    max_in_flight = 2 * workers
+    started = time.perf_counter()
+    results = []
+
+    def collect(future: Future, username: str):
+        report = {"username": username}
+        try:
+            result = future.result()
+        except Exception as e:
+            report.update(status="failed", error=str(e))
+        else:
+            report["records"] = result.get("records", 0)
+            if "error" in result:
+                report.update(status="skipped", error=result["error"])
+            else:
+                report.update(
+                    status="trained" if result.get("retrained") else "unchanged",
+                    incremental=result.get("incremental", False),
+                    duration_seconds=result["duration_seconds"],
+                    metrics=result["model_performance"]
+                )
+        results.append(report)
+        service.model_updated(username)
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        # Таблицы для общей модели читает ее собственный процесс
+        population_future = executor.submit(train_population_model, service.registry.models_dir,
+                                            storage, features, service.target, n_jobs)
+
+        futures = {}
+        for user in service.user_manager.list_users():
+            username = user["username"]
+            mode = service.get_training_mode(username)
+            if mode == POPULATION_MODE:
+                results.append({"username": username, "status": "population"})
+                continue
+            if len(futures) >= max_in_flight:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future, futures.pop(future))
+            future = executor.submit(train_stored_user_model, service.registry.models_dir, storage,
+                                     username, features, service.target, n_jobs, mode)
+            futures[future] = username
+
+        for future in as_completed(futures):
+            collect(future, futures[future])
+
+        population = {}
+        try:
+            result = population_future.result()
+        except Exception as e:
+            population.update(status="failed", error=str(e))
+        else:
+            population["records"] = result["records"]
+            if "error" in result:
+                population.update(status="skipped", error=result["error"])
+            else:
+                population.update(
+                    status="trained" if result["retrained"] else "unchanged",
+                    users=result["users"],
+                    duration_seconds=result["duration_seconds"],
+                    metrics=result["model_performance"]
+                )
+
+    return {
+        "workers": workers,
+        "threads_per_worker": n_jobs,
+        "duration_seconds": round(time.perf_counter() - started, 3),
+        "users": sorted(results, key=lambda report: report["username"]),
+        "population": population
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Переобучение моделей оценки дня всех пользователей")
+    parser.add_argument("--workers", type=int, default=TRAINING_WORKERS, help="Процессов обучения")
+    args = parser.parse_args()
+
+    from user_manager import UserManager
+
+    service = MoodModelService(UserManager())
+    print(f"🧠 Обучение моделей: {args.workers} процессов по {threads_per_worker(args.workers)} потоков")
+    report = train_all_users(service, args.workers)
+
+    print(f"\n{'Пользователь':<24}{'записей':>9}{'статус':>12}{'время, с':>10}{'R²':>8}{'RMSE':>8}")
+    population = dict(report["population"], username="* общая модель")
+    for user in report["users"] + [population]:
+        metrics = user.get("metrics") or {}
+        # r2_score None: в фолдах time_series_cv было не больше одной проверочной строки
+        r2 = f"{metrics['r2_score']:.2f}" if metrics.get("r2_score") is not None else "-"
+        rmse = f"{metrics['rmse']:.2f}" if metrics.get("rmse") is not None else "-"
+        duration = f"{user['duration_seconds']:.2f}" if "duration_seconds" in user else "-"
+        print(f"{user['username']:<24}{user.get('records', 0):>9}{user['status']:>12}{duration:>10}{r2:>8}{rmse:>8}")
+        if user["status"] in ("failed", "skipped"):
+            print(f"    ⚠️ {user['error']}")
+    print(f"\n⏱️ Всего: {report['duration_seconds']:.1f} с")
+
+if __name__ == "__main__":
+    main()
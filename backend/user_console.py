@@ -282,9 +282,10 @@ class UserConsole:
         
         import numpy as np
         
-        # Создаем тестовые данные
+        # Создаем тестовые данные и сохраняем их одной записью
+        records = []
         for i in range(num_records):
-            record = {
+            records.append({
                 'kol_sna': np.random.normal(7.5, 1.5).clip(4, 12),
                 'kolichestvo_sna_0': np.random.randint(0, 11),
                 'nalichee_zarydki': np.random.choice([0, 1]),
@@ -294,15 +295,13 @@ class UserConsole:
                 'sostavlenye_rasporydka': np.random.choice([0, 1]),
                 'ocenka_dny': np.random.randint(1, 11),
                 'date': (datetime.now() - pd.Timedelta(days=i)).strftime('%Y-%m-%d')
-            }
-            
-            success = self.user_manager.add_user_record(self.current_user, record)
-            if success:
-                print(f"✅ Запись {i+1}/{num_records} добавлена")
-            else:
-                print(f"❌ Ошибка при добавлении записи {i+1}")
+            })
         
-        print(f"\n✅ Создано {num_records} тестовых записей!")
+        success = self.user_manager.add_user_records(self.current_user, records)
+        if success:
+            print(f"\n✅ Создано {num_records} тестовых записей!")
+        else:
+            print("❌ Ошибка при добавлении тестовых записей")
     
     def list_users(self):
         """Показать список пользователей"""
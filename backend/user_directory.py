@@ -0,0 +1,236 @@
+"""
+Каталог пользователей FileStorage: снимок, журнал изменений и индексы в памяти.
+
+users.json остается снимком каталога в прежнем формате (username ->
+пользователь), а каждое изменение одного пользователя дописывается строкой
+JSON в журнал users.json.log. В памяти держатся индексы по username и
+user_id, поэтому поиск стоит O(1), а регистрация, вход и удаление дописывают
+одну строку вместо перезаписи всего файла. Когда в журнале накапливается
+USERS_SNAPSHOT_EVERY строк, каталог записывается новым снимком, а журнал
+начинается заново.
+
+Процессы (воркеры uvicorn, user_console.py) пишут журнал под общей
+блокировкой users.json.lock. Изменения других процессов подхватываются
+дочитыванием хвоста журнала (refresh); первая строка журнала — метка снимка,
+и если она сменилась, снимок и журнал перечитываются целиком. Операции
+журнала идемпотентны, поэтому повторное применение строк, уже попавших в
+снимок (например, после сбоя между записью снимка и журнала), безопасно.
+"""
+
+import json
+import os
+import secrets
+import threading
+from typing import Dict, Iterable, Optional
+
+from file_lock import FileLock, atomic_write
+
+# Строк журнала, после которых каталог записывается новым снимком
+USERS_SNAPSHOT_EVERY = int(os.environ.get("USERS_SNAPSHOT_EVERY", "1000"))
+
+class UserDirectory:
+    """Пользователи с поиском по username и user_id и журналом изменений"""
+
+    def __init__(self, snapshot_file: str = "users.json", snapshot_every: int = USERS_SNAPSHOT_EVERY):
+        self.snapshot_file = snapshot_file
+        self.log_file = snapshot_file + ".log"
+        self.snapshot_every = snapshot_every
+        self._lock = threading.RLock()
+        # username -> пользователь (None, пока каталог не загружен)
+        self._users: Optional[Dict[str, Dict]] = None
+        # user_id -> username
+        self._ids: Dict[str, str] = {}
+        # Метка журнала, позиция, до которой он прочитан, и число строк в нем
+        self._log_token: Optional[str] = None
+        self._log_offset = 0
+        self._log_entries = 0
+
+    def file_lock(self) -> FileLock:
+        """Межпроцессная блокировка изменений каталога"""
+        return FileLock(self.snapshot_file + ".lock")
+
+    def _apply(self, entry: Dict):
+        """Применяет строку журнала к индексам"""
+        if entry["op"] == "put":
+            user = entry["user"]
+            previous = self._users.get(user["username"])
+            if previous is not None and previous["user_id"] != user["user_id"]:
+                self._ids.pop(previous["user_id"], None)
+            self._users[user["username"]] = user
+            self._ids[user["user_id"]] = user["username"]
+        elif entry["op"] == "delete":
+            previous = self._users.pop(entry["username"], None)
+            if previous is not None:
+                self._ids.pop(previous["user_id"], None)
+
+    def _reload(self):
+        """Перечитывает снимок и журнал целиком"""
+        with self.file_lock():
+            self._reload_locked()
+
+    def _reload_locked(self):
+        """То же, что _reload, когда межпроцессная блокировка уже взята"""
+        users = {}
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                users = json.load(f)
+        self._users = users
+        self._ids = {user["user_id"]: username for username, user in users.items()}
+        self._log_token = None
+        self._log_offset = 0
+        self._log_entries = 0
+        self._read_log()
+
+    def _read_log(self) -> bool:
+        """Дочитывает журнал с последней прочитанной позиции
+
+        Возвращает False, если журнал заменен новым снимком и каталог нужно
+        перечитать целиком.
+        """
+        try:
+            f = open(self.log_file, 'rb')
+        except FileNotFoundError:
+            return self._log_token is None
+
+        with f:
+            header = f.readline()
+            if not header.endswith(b"\n"):
+                # Журнал без метки: его создание не закончено
+                return self._log_token is None
+            token = json.loads(header)["snapshot"]
+            if self._log_token is None:
+                self._log_token = token
+                self._log_offset = len(header)
+            elif token != self._log_token:
+                return False
+            f.seek(self._log_offset)
+            data = f.read()
+
+        # Неполную последнюю строку (ее как раз дописывают) дочитаем в следующий раз
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            if line.strip():
+                self._apply(json.loads(line))
+                self._log_entries += 1
+        self._log_offset += end
+        return True
+
+    def refresh(self):
+        """Подхватывает изменения, сделанные другими процессами"""
+        with self._lock:
+            if self._users is None or not self._read_log():
+                self._reload()
+
+    def _refresh_locked(self):
+        """refresh под уже взятой межпроцессной блокировкой"""
+        if self._users is None or not self._read_log():
+            self._reload_locked()
+
+    def _ensure_loaded(self):
+        if self._users is None:
+            self._reload()
+
+    def get(self, username: str) -> Optional[Dict]:
+        """Пользователь по имени (копия записи каталога)
+
+        Перед поиском дочитывается хвост журнала, чтобы видеть изменения
+        других процессов: обычно это одно чтение метки журнала.
+        """
+        with self._lock:
+            self.refresh()
+            user = self._users.get(username)
+            return dict(user) if user is not None else None
+
+    def get_by_id(self, user_id: str) -> Optional[Dict]:
+        """Пользователь по user_id (копия записи каталога)"""
+        with self._lock:
+            self.refresh()
+            username = self._ids.get(user_id)
+            return dict(self._users[username]) if username is not None else None
+
+    def all(self) -> Dict[str, Dict]:
+        """Все пользователи: username -> копия записи"""
+        with self._lock:
+            self.refresh()
+            return {username: dict(user) for username, user in self._users.items()}
+
+    def _append(self, entries: Iterable[Dict]):
+        """Дописывает строки в журнал (под межпроцессной блокировкой, после refresh)"""
+        lines = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+        if not lines:
+            return
+        if self._log_token is None:
+            self._start_log()
+        data = lines.encode("utf-8")
+        with open(self.log_file, 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        for line in lines.splitlines():
+            self._apply(json.loads(line))
+            self._log_entries += 1
+        self._log_offset += len(data)
+
+        if self._log_entries >= self.snapshot_every:
+            self._snapshot()
+
+    def _start_log(self):
+        """Начинает новый пустой журнал с новой меткой"""
+        token = secrets.token_hex(8)
+        header = json.dumps({"snapshot": token}) + "\n"
+        with atomic_write(self.log_file) as f:
+            f.write(header)
+        self._log_token = token
+        self._log_offset = len(header.encode("utf-8"))
+        self._log_entries = 0
+
+    def _snapshot(self):
+        """Записывает каталог новым снимком и начинает журнал заново"""
+        with atomic_write(self.snapshot_file) as f:
+            json.dump(self._users, f, ensure_ascii=False, indent=2)
+        self._start_log()
+
+    def add(self, user: Dict) -> bool:
+        """Добавляет пользователя; False, если имя уже занято"""
+        with self._lock, self.file_lock():
+            self._refresh_locked()
+            if user["username"] in self._users:
+                return False
+            self._append([{"op": "put", "user": dict(user)}])
+            return True
+
+    def update(self, users: Iterable[Dict]):
+        """Сохраняет изменения существующих пользователей одной записью в журнал"""
+        with self._lock, self.file_lock():
+            self._refresh_locked()
+            entries = []
+            for user in users:
+                stored = self._users.get(user["username"])
+                # Пользователя могли удалить (или пересоздать) в другом процессе
+                if stored is not None and stored["user_id"] == user["user_id"]:
+                    entries.append({"op": "put", "user": dict(user)})
+            self._append(entries)
+
+    def remove(self, username: str, user_id: Optional[str] = None) -> bool:
+        """Удаляет пользователя (только с этим user_id, если он задан)"""
+        with self._lock, self.file_lock():
+            self._refresh_locked()
+            stored = self._users.get(username)
+            if stored is None or (user_id is not None and stored["user_id"] != user_id):
+                return False
+            self._append([{"op": "delete", "username": username}])
+            return True
+
+    def replace_all(self, users: Dict[str, Dict]):
+        """Заменяет весь каталог (сразу новым снимком)"""
+        with self._lock, self.file_lock():
+            self._users = {username: dict(user) for username, user in users.items()}
+            self._ids = {user["user_id"]: username for username, user in self._users.items()}
+            self._snapshot()
+
+    def info(self) -> Dict:
+        """Размер каталога и журнала"""
+        with self._lock:
+            self._ensure_loaded()
+            return {"users": len(self._users), "log_entries": self._log_entries,
+                    "snapshot_every": self.snapshot_every}
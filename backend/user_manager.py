@@ -1,48 +1,183 @@
-import os
-import json
 import pandas as pd
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
+import atexit
 import hashlib
 import secrets
+import threading
+import time
+
+from auth_tokens import TokenSigner
+from correlations import CorrelationAccumulator
+from fields_registry import FieldRegistry, fields_registry
+from passwords import hash_password, needs_rehash, verify_password
+from storage import StorageBackend, apply_dtypes, create_storage
+
+# Время жизни проверенных учетных данных в кэше (секунды)
+AUTH_CACHE_TTL = 300
+# Как часто сбрасывать накопленные last_login на диск (секунды)
+LAST_LOGIN_FLUSH_INTERVAL = 60
+# Поле, с которым считаются корреляции остальных полей
+CORRELATION_TARGET = "ocenka_dny"
+# Служебное состояние с версией схемы полей, при которой записана таблица
+SCHEMA_STATE = "schema"
 
 class UserManager:
-    """Менеджер пользователей с индивидуальными CSV таблицами"""
+    """Менеджер пользователей с индивидуальными таблицами данных
+    
+    Где лежат пользователи и их записи, определяет хранилище (storage.py):
+    по умолчанию users.json и CSV файлы, либо SQLite при STORAGE_BACKEND=sqlite.
+    Пароли хранятся соленым медленным хешем (passwords.py); после входа
+    запросы подтверждаются подписанным токеном (auth_tokens.py).
+    """
     
-    def __init__(self, users_file: str = "users.json", data_dir: str = "user_data"):
+    def __init__(self, users_file: str = "users.json", data_dir: str = "user_data",
+                 cache_size: int = 128, storage: Optional[StorageBackend] = None,
+                 fields: Optional[FieldRegistry] = None, tokens: Optional[TokenSigner] = None):
         self.users_file = users_file
         self.data_dir = data_dir
-        self.users = self._load_users()
-        self._ensure_data_dir()
-    
-    def _ensure_data_dir(self):
-        """Создает папку для данных пользователей если её нет"""
-        if not os.path.exists(self.data_dir):
-            os.makedirs(self.data_dir)
-            print(f"Создана папка: {self.data_dir}")
-    
-    def _load_users(self) -> Dict:
-        """Загружает список пользователей из JSON файла"""
-        if os.path.exists(self.users_file):
+        self.storage = storage or create_storage(users_file=users_file, data_dir=data_dir)
+        self.fields = fields or fields_registry
+        self.tokens = tokens or TokenSigner()
+        
+        # Защищает кэши и отложенные изменения при вызовах из нескольких потоков
+        self._lock = threading.RLock()
+        
+        # Блокировки пользователей: записи разных пользователей идут параллельно
+        self._user_locks: Dict[str, threading.RLock] = {}
+        self._user_lock_depth: Dict[str, int] = {}
+        
+        # LRU кэш разобранных таблиц: username -> (отпечаток версии, DataFrame)
+        self.cache_size = cache_size
+        self._data_cache: "OrderedDict[str, Tuple[Tuple, pd.DataFrame]]" = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        
+        # Накопители корреляций: username -> CorrelationAccumulator
+        self._correlations: Dict[str, CorrelationAccumulator] = {}
+        
+        # Кэш проверенных паролей: username -> (отпечаток, password_hash, истекает)
+        self._auth_cache: Dict[str, Tuple[str, str, float]] = {}
+        self._auth_cache_key = secrets.token_bytes(16)
+        
+        # Отложенное сохранение last_login: пользователи читаются из хранилища
+        # при каждом обращении, а в памяти остаются только их несохраненные
+        # изменения: username -> (user_id, {поле: значение})
+        self._dirty_users: Dict[str, Tuple[str, Dict]] = {}
+        self._last_users_save = time.monotonic()
+        atexit.register(self.flush)
+    
+    def _save_users(self, usernames: Optional[List[str]] = None):
+        """Сохраняет отложенные изменения пользователей (всех или только указанных)
+        
+        Изменения накладываются на свежую запись из хранилища, чтобы не
+        затереть то, что поменяли другие процессы, а пользователи, удаленные
+        (или пересозданные) за это время, пропускаются.
+        """
+        with self._lock:
+            if usernames is None:
+                usernames = list(self._dirty_users)
+            usernames = [username for username in usernames if username in self._dirty_users]
+            if not usernames:
+                return
             try:
-                with open(self.users_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                users = {}
+                for username in usernames:
+                    user_id, changes = self._dirty_users[username]
+                    user = self.storage.load_user(username)
+                    if user is not None and user["user_id"] == user_id:
+                        user.update(changes)
+                        users[username] = user
+                if users:
+                    self.storage.save_users(users, list(users))
+                for username in usernames:
+                    self._dirty_users.pop(username, None)
+                self._last_users_save = time.monotonic()
             except Exception as e:
-                print(f"Ошибка загрузки пользователей: {e}")
-                return {}
-        return {}
+                print(f"Ошибка сохранения пользователей: {e}")
+    
+    def flush(self):
+        """Сохраняет отложенные изменения пользователей (например, last_login)"""
+        with self._lock:
+            if self._dirty_users:
+                self._save_users()
+    
+    def _update_user(self, user: Dict, **changes):
+        """Меняет поля пользователя; на диск они попадут при следующем flush"""
+        with self._lock:
+            user.update(changes)
+            pending = self._dirty_users.get(user["username"])
+            if pending is None or pending[0] != user["user_id"]:
+                pending = self._dirty_users[user["username"]] = (user["user_id"], {})
+            pending[1].update(changes)
     
-    def _save_users(self):
-        """Сохраняет список пользователей в JSON файл"""
+    def _with_changes(self, user: Optional[Dict], username: str) -> Optional[Dict]:
+        """Накладывает на запись из хранилища несохраненные изменения этого процесса"""
+        with self._lock:
+            pending = self._dirty_users.get(username)
+            if pending is None:
+                return user
+            if user is None or user["user_id"] != pending[0]:
+                # Пользователя удалили (или пересоздали) в другом процессе
+                self._dirty_users.pop(username, None)
+                return user
+            user.update(pending[1])
+            return user
+    
+    def _get_user(self, username: str) -> Optional[Dict]:
+        """Возвращает пользователя из хранилища (None, если его нет)
+        
+        Пользователи не кэшируются: хранилище ищет их по индексу, поэтому
+        регистрация и удаление в других процессах видны сразу.
+        """
         try:
-            with open(self.users_file, 'w', encoding='utf-8') as f:
-                json.dump(self.users, f, ensure_ascii=False, indent=2)
+            user = self.storage.load_user(username)
         except Exception as e:
-            print(f"Ошибка сохранения пользователей: {e}")
+            print(f"Ошибка загрузки пользователя: {e}")
+            return None
+        return self._with_changes(user, username)
+    
+    def get_user_by_id(self, user_id: str) -> Optional[Dict]:
+        """Пользователь по user_id (без пароля; None, если пользователя нет)"""
+        try:
+            user = self.storage.load_user_by_id(user_id)
+        except Exception as e:
+            print(f"Ошибка загрузки пользователя: {e}")
+            return None
+        if user is None:
+            return None
+        return self._public_info(self._with_changes(user, user["username"]))
+    
+    def get_user_id(self, username: str) -> Optional[str]:
+        """Идентификатор пользователя (None, если пользователя нет)"""
+        user = self._get_user(username)
+        return user["user_id"] if user is not None else None
+    
+    @contextmanager
+    def _user_lock(self, user: Dict):
+        """Блокирует данные пользователя в этом потоке и в других процессах
+        
+        Блокировка реентерабельна: вложенные вызовы (например, get_user_data
+        внутри get_correlations) не берут файловую блокировку повторно.
+        """
+        username = user["username"]
+        with self._lock:
+            lock = self._user_locks.setdefault(username, threading.RLock())
+        
+        with lock:
+            depth = self._user_lock_depth.get(username, 0)
+            self._user_lock_depth[username] = depth + 1
+            try:
+                with self.storage.user_lock(user) if depth == 0 else nullcontext():
+                    yield
+            finally:
+                self._user_lock_depth[username] = depth
     
     def _hash_password(self, password: str) -> str:
-        """Хеширует пароль"""
-        return hashlib.sha256(password.encode()).hexdigest()
+        """Хеширует пароль (bcrypt или scrypt, см. passwords.py)"""
+        return hash_password(password)
     
     def _generate_user_id(self) -> str:
         """Генерирует уникальный ID пользователя"""
@@ -52,7 +187,7 @@ class UserManager:
         """Регистрирует нового пользователя"""
         
         # Проверяем, что пользователь не существует
-        if username in self.users:
+        if self._get_user(username) is not None:
             return {"success": False, "message": "Пользователь уже существует"}
         
         # Создаем нового пользователя
@@ -69,12 +204,18 @@ class UserManager:
             "data_file": f"{user_id}_data.csv"
         }
         
-        # Добавляем пользователя
-        self.users[username] = user_data
-        self._save_users()
+        # Добавляем пользователя; хранилище атомарно проверяет, что имя
+        # не заняли параллельно (в том числе другим воркером)
+        try:
+            if not self.storage.add_user(user_data):
+                return {"success": False, "message": "Пользователь уже существует"}
+        except Exception as e:
+            print(f"Ошибка сохранения пользователей: {e}")
+            return {"success": False, "message": "Ошибка сохранения пользователя"}
         
         # Создаем пустую таблицу данных для пользователя
-        self._create_user_data_table(user_id)
+        with self._user_lock(user_data):
+            self._create_user_data_table(user_data)
         
         return {
             "success": True, 
@@ -82,57 +223,113 @@ class UserManager:
             "user_id": user_id
         }
     
-    def _create_user_data_table(self, user_id: str):
+    def _create_user_data_table(self, user: Dict):
         """Создает пустую таблицу данных для пользователя"""
-        filename = os.path.join(self.data_dir, f"{user_id}_data.csv")
-        
         # Загружаем конфигурацию полей
         fields_config = self._load_fields_config()
         columns = ['date'] + [field['name'] for field in fields_config['fields']]
         
-        df = pd.DataFrame(columns=columns)
-        df.to_csv(filename, index=False)
-        print(f"Создана таблица данных: {filename}")
+        self.storage.create_table(user, columns)
+        self._mark_schema(user)
+        print(f"Создана таблица данных: {user['data_file']}")
+    
+    def _table_schema_version(self, user: Dict) -> int:
+        """Версия схемы полей, при которой записана таблица (0 — до версионирования)"""
+        try:
+            state = self.storage.load_state(user, SCHEMA_STATE)
+        except Exception as e:
+            print(f"Ошибка загрузки версии схемы: {e}")
+            state = None
+        return (state or {}).get("version", 0)
+    
+    def _mark_schema(self, user: Dict):
+        """Отмечает, что таблица записана в текущей схеме полей"""
+        self.storage.save_state(user, SCHEMA_STATE, {"version": self.fields.get_schema_version()})
+    
+    def _migrate_table(self, user: Dict):
+        """Переписывает таблицу в текущей схеме полей (под блокировкой пользователя)
+        
+        Читается без типов схемы, чтобы значения записались без потерь точности.
+        """
+        df = self.storage.read_records(user)
+        df = self.fields.project(df, self._table_schema_version(user))
+        self.storage.write_records(user, df)
+        self._mark_schema(user)
+    
+    def migrate_user(self, username: str) -> bool:
+        """Переписывает таблицу пользователя в текущей схеме полей
+        
+        Возвращает True, если таблица была записана в старой схеме и переписана.
+        Чтения дают одинаковый результат до и после: разница только в том,
+        что проекцию при чтении больше не нужно делать.
+        """
+        user = self._get_user(username)
+        if user is None:
+            return False
+        
+        with self._user_lock(user):
+            if self.storage.data_signature(user) is None:
+                return False
+            if self._table_schema_version(user) >= self.fields.get_schema_version():
+                return False
+            try:
+                self._migrate_table(user)
+            finally:
+                self.invalidate_cache(username)
+        return True
     
     def _load_fields_config(self) -> Dict:
         """Загружает конфигурацию полей"""
-        fields_config_file = "fields_config.json"
-        if os.path.exists(fields_config_file):
-            try:
-                with open(fields_config_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"Ошибка загрузки конфигурации полей: {e}")
+        return self.fields.get_config()
+    
+    def _credentials_fingerprint(self, username: str, password: str) -> str:
+        """Отпечаток учетных данных для кэша (пароль в открытом виде не хранится)"""
+        message = f"{username}\0{password}".encode()
+        return hashlib.blake2b(message, key=self._auth_cache_key, digest_size=32).hexdigest()
+    
+    def _verify_password(self, user: Dict, password: str) -> bool:
+        """Проверяет пароль, используя кэш недавно проверенных учетных данных
         
-        # Возвращаем стандартные поля если файл не найден
-        return {
-            "fields": [
-                {"name": "kol_sna"},
-                {"name": "kolichestvo_sna_0"},
-                {"name": "nalichee_zarydki"},
-                {"name": "zavrrak_koloriy"},
-                {"name": "obed_koloriy"},
-                {"name": "chteniy"},
-                {"name": "sostavlenye_rasporydka"},
-                {"name": "ocenka_dny"}
-            ]
-        }
+        Хеш старого формата (SHA-256) после успешной проверки заменяется новым.
+        """
+        username = user["username"]
+        fingerprint = self._credentials_fingerprint(username, password)
+        now = time.monotonic()
+        
+        with self._lock:
+            cached = self._auth_cache.get(username)
+        if (cached is not None and cached[0] == fingerprint
+                and cached[1] == user["password_hash"] and cached[2] > now):
+            return True
+        
+        if not verify_password(password, user["password_hash"]):
+            return False
+        
+        if needs_rehash(user["password_hash"]):
+            self._update_user(user, password_hash=self._hash_password(password))
+            self.flush()
+        
+        with self._lock:
+            self._auth_cache[username] = (fingerprint, user["password_hash"], now + AUTH_CACHE_TTL)
+        return True
     
     def authenticate_user(self, username: str, password: str) -> Dict:
         """Аутентифицирует пользователя"""
         
-        if username not in self.users:
+        user = self._get_user(username)
+        if user is None:
             return {"success": False, "message": "Пользователь не найден"}
         
-        user = self.users[username]
-        hashed_password = self._hash_password(password)
-        
-        if user["password_hash"] != hashed_password:
+        if not self._verify_password(user, password):
             return {"success": False, "message": "Неверный пароль"}
         
-        # Обновляем время последнего входа
-        user["last_login"] = datetime.now().isoformat()
-        self._save_users()
+        # Обновляем время последнего входа; на диск изменения
+        # сбрасываются не чаще раза в LAST_LOGIN_FLUSH_INTERVAL секунд
+        self._update_user(user, last_login=datetime.now().isoformat())
+        with self._lock:
+            flush_due = time.monotonic() - self._last_users_save >= LAST_LOGIN_FLUSH_INTERVAL
+        if flush_due:
+            self.flush()
         
         return {
             "success": True,
@@ -141,100 +338,495 @@ class UserManager:
             "username": username
         }
     
-    def get_user_data(self, username: str) -> Optional[pd.DataFrame]:
-        """Получает данные пользователя"""
-        if username not in self.users:
+    def issue_token(self, username: str, password: str) -> Dict:
+        """Проверяет пароль и выдает подписанный токен доступа"""
+        result = self.authenticate_user(username, password)
+        if result["success"]:
+            result.update(self.tokens.issue(username, result["user_id"]))
+        return result
+    
+    def authenticate_token(self, token: str) -> Optional[str]:
+        """Имя пользователя из действующего токена (None, если токен неверен)
+        
+        Проверяется подпись, срок действия и то, что пользователь еще есть в
+        хранилище; хеш пароля не нужен.
+        """
+        claims = self.tokens.verify(token)
+        if claims is None:
             return None
+        return self.authenticate_claims(claims)
+    
+    def authenticate_claims(self, claims: Dict) -> Optional[str]:
+        """Имя пользователя из проверенного содержимого токена
         
-        user = self.users[username]
-        filename = os.path.join(self.data_dir, user["data_file"])
+        Пользователь ищется в хранилище, поэтому токены пользователя,
+        удаленного любым процессом, сразу перестают действовать, а токен
+        удаленного пользователя не подходит новому с тем же именем.
+        """
+        username = claims.get("sub")
+        user = self._get_user(username) if isinstance(username, str) else None
+        if user is None or user["user_id"] != claims.get("uid"):
+            return None
+        return username
+    
+    def invalidate_cache(self, username: str):
+        """Удаляет таблицу пользователя из кэша"""
+        with self._lock:
+            self._data_cache.pop(username, None)
+    
+    def cache_info(self) -> Dict:
+        """Возвращает статистику кэша таблиц пользователей"""
+        with self._lock:
+            return {
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "size": len(self._data_cache),
+                "max_size": self.cache_size,
+                "bytes": int(sum(df.memory_usage(index=True, deep=True).sum()
+                                 for _, df in self._data_cache.values()))
+            }
+    
+    def _data_signature(self, user: Dict) -> Optional[Tuple]:
+        """Версия таблицы пользователя вместе с версией схемы полей (от нее зависят типы)"""
+        signature = self.storage.data_signature(user)
+        if signature is None:
+            return None
+        return signature, self.fields.get_version()
+    
+    def _correlation_signature(self, user: Dict) -> Optional[Tuple]:
+        """Версия таблицы и схемы полей, по которой посчитан накопитель корреляций
         
-        if os.path.exists(filename):
-            return pd.read_csv(filename)
-        else:
-            # Создаем таблицу если её нет
-            self._create_user_data_table(user["user_id"])
-            return pd.DataFrame()
+        Изменение схемы полей не переписывает таблицу, поэтому без версии
+        схемы накопитель продолжал бы выдавать удаленные поля.
+        """
+        signature = self.storage.data_signature(user)
+        if signature is None:
+            return None
+        return tuple(signature) + (self.fields.get_schema_version(),)
     
-    def save_user_data(self, username: str, data: pd.DataFrame) -> bool:
-        """Сохраняет данные пользователя"""
-        if username not in self.users:
-            return False
+    def get_user_data(self, username: str, columns: Optional[List[str]] = None) -> Optional[pd.DataFrame]:
+        """Получает данные пользователя
+        
+        Колонки и типы задаются текущей схемой полей (FieldRegistry.project и
+        get_dtypes): целые и булевы поля — nullable Int8/Int16/..., числа —
+        float32, date — datetime64; поля, добавленные после записи таблицы,
+        заполняются значением по умолчанию.
+        columns — читать только эти колонки (в колоночном формате остальные
+        колонки не читаются с диска); такие выборки не кэшируются.
+        """
+        user = self._get_user(username)
+        if user is None:
+            return None
+        
+        signature = self._data_signature(user)
         
-        user = self.users[username]
-        filename = os.path.join(self.data_dir, user["data_file"])
+        # Данные могли изменить из другого процесса (например, user_console.py),
+        # поэтому запись в кэше действительна только при совпадении отпечатка
+        if signature is not None:
+            with self._lock:
+                cached = self._data_cache.get(username)
+                if cached is not None and cached[0] == signature:
+                    self._data_cache.move_to_end(username)
+                    self.cache_hits += 1
+                    df = cached[1]
+                    if columns is not None:
+                        return df[[column for column in df.columns if column in columns]].copy()
+                    return df.copy()
         
+        # Читаем под блокировкой пользователя, чтобы не увидеть недописанную запись
+        with self._user_lock(user):
+            signature = self._data_signature(user)
+            if signature is None:
+                # Создаем таблицу если её нет
+                self.invalidate_cache(username)
+                self._create_user_data_table(user)
+                return pd.DataFrame()
+            
+            dtypes = self.fields.get_dtypes()
+            schema_version = self._table_schema_version(user)
+            if columns is not None:
+                df = self.storage.read_records(user, columns, dtypes)
+                return apply_dtypes(self.fields.project(df, schema_version, columns), dtypes)
+            
+            with self._lock:
+                self.cache_misses += 1
+            df = self.storage.read_records(user, dtypes=dtypes)
+            df = apply_dtypes(self.fields.project(df, schema_version), dtypes)
+        
+        if self.cache_size > 0:
+            with self._lock:
+                self._data_cache[username] = (signature, df)
+                self._data_cache.move_to_end(username)
+                while len(self._data_cache) > self.cache_size:
+                    self._data_cache.popitem(last=False)
+        
+        return df.copy()
+    
+    def iter_user_records(self, username: str, since: Optional[str] = None,
+                          until: Optional[str] = None, cursor: Optional[int] = None,
+                          limit: Optional[int] = None,
+                          chunk_size: int = 1000) -> Optional[Iterator[pd.DataFrame]]:
+        """Читает записи пользователя частями, не загружая всю историю в память
+        
+        Индекс каждой части — позиция записи (курсор для следующей страницы).
+        since/until ограничивают даты, cursor — позиция последней прочитанной
+        записи, limit — максимальное число записей.
+        """
+        user = self._get_user(username)
+        if user is None:
+            return None
+        
+        # Снимок таблицы берем под блокировкой, читаем уже без неё
+        with self._user_lock(user):
+            if self.storage.data_signature(user) is None:
+                return iter(())
+            schema_version = self._table_schema_version(user)
+            chunks = self.storage.iter_records(user, since, until, cursor, chunk_size)
+        
+        return self._limit_chunks(chunks, limit, schema_version, self.fields.get_dtypes())
+    
+    def _limit_chunks(self, chunks: Iterator[pd.DataFrame], limit: Optional[int],
+                      schema_version: int, dtypes: Dict[str, str]) -> Iterator[pd.DataFrame]:
+        """Приводит части к текущей схеме полей и ее типам (как get_user_data)
+        и обрезает поток до limit записей"""
+        remaining = limit
         try:
-            data.to_csv(filename, index=False)
-            return True
-        except Exception as e:
-            print(f"Ошибка сохранения данных: {e}")
+            for chunk in chunks:
+                chunk = apply_dtypes(self.fields.project(chunk, schema_version), dtypes)
+                if remaining is not None:
+                    chunk = chunk.iloc[:remaining]
+                    remaining -= len(chunk)
+                yield chunk
+                if remaining is not None and remaining <= 0:
+                    break
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+    
+    def save_user_data(self, username: str, data: pd.DataFrame) -> bool:
+        """Сохраняет данные пользователя"""
+        user = self._get_user(username)
+        if user is None:
             return False
+        
+        with self._user_lock(user):
+            try:
+                self.storage.write_records(user, data)
+                self._mark_schema(user)
+                return True
+            except Exception as e:
+                print(f"Ошибка сохранения данных: {e}")
+                return False
+            finally:
+                self.invalidate_cache(username)
     
     def add_user_record(self, username: str, record: Dict) -> bool:
         """Добавляет новую запись пользователю"""
-        if username not in self.users:
+        return self.add_user_records(username, [record])
+    
+    def add_user_records(self, username: str, records: List[Dict]) -> bool:
+        """Добавляет пачку записей пользователю одной записью в хранилище"""
+        user = self._get_user(username)
+        if user is None:
             return False
-        
-        # Получаем текущие данные
-        df = self.get_user_data(username)
-        if df is None:
-            df = pd.DataFrame()
+        if not records:
+            return True
         
         # Добавляем дату если её нет
-        if 'date' not in record:
-            record['date'] = datetime.now().strftime('%Y-%m-%d')
+        today = datetime.now().strftime('%Y-%m-%d')
+        for record in records:
+            if 'date' not in record or record['date'] is None:
+                record['date'] = today
+        
+        # Запись и обновление корреляций выполняются атомарно
+        # относительно других потоков и процессов
+        with self._user_lock(user):
+            # Записи с полями, измененными после записи таблицы, нельзя просто
+            # дописать: сначала таблица переписывается в текущей схеме
+            schema_version = self._table_schema_version(user)
+            if schema_version < self.fields.get_schema_version():
+                changed = self.fields.changed_since(schema_version)
+                if any(key in changed for record in records for key in record):
+                    try:
+                        self._migrate_table(user)
+                    except Exception as e:
+                        print(f"Ошибка перевода таблицы в новую схему: {e}")
+                        return False
+                    finally:
+                        self.invalidate_cache(username)
+            
+            signature_before = self._correlation_signature(user)
+            
+            # Хранилище дописывает записи в конец таблицы без чтения истории
+            try:
+                self.storage.append_records(user, records)
+            except Exception as e:
+                print(f"Ошибка добавления записи: {e}")
+                return False
+            finally:
+                self.invalidate_cache(username)
+            
+            self._update_correlations(username, signature_before, records)
+        return True
+    
+    def _normalize_value(self, field: Dict, value):
+        """Приводит значение к типу поля; возвращает (значение, ошибка)"""
+        field_type = field.get("field_type", "number")
+        
+        if field_type == "boolean":
+            if isinstance(value, str):
+                value = value.strip().lower()
+                if value in ("1", "true", "да", "yes"):
+                    return 1, None
+                if value in ("0", "false", "нет", "no"):
+                    return 0, None
+                return None, "ожидается 0/1"
+            if value in (0, 1):
+                return int(value), None
+            return None, "ожидается 0/1"
+        
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return None, "ожидается число"
+        if number != number:
+            return None, "значение не заполнено"
+        
+        if field_type == "integer":
+            if not number.is_integer():
+                return None, "ожидается целое число"
+            number = int(number)
+        
+        if field.get("min_value") is not None and number < field["min_value"]:
+            return None, f"меньше минимума {field['min_value']}"
+        if field.get("max_value") is not None and number > field["max_value"]:
+            return None, f"больше максимума {field['max_value']}"
+        return number, None
+    
+    def validate_records(self, records: List[Dict]) -> Tuple[List[Dict], List[str]]:
+        """Проверяет записи по конфигурации полей за один проход
+        
+        Возвращает записи с приведенными типами и список ошибок вида
+        "запись N, поле X: причина".
+        """
+        fields = self._load_fields_config()["fields"]
+        known = {field["name"] for field in fields} | {"date"}
+        normalized = []
+        errors = []
         
-        # Добавляем новую запись
-        new_df = pd.concat([df, pd.DataFrame([record])], ignore_index=True)
+        for index, record in enumerate(records, 1):
+            if not isinstance(record, dict):
+                errors.append(f"запись {index}: ожидается объект")
+                continue
+            
+            clean = {}
+            for key in record:
+                if key not in known:
+                    errors.append(f"запись {index}, поле {key}: неизвестное поле")
+            
+            for field in fields:
+                name = field["name"]
+                if name not in record or record[name] is None:
+                    errors.append(f"запись {index}, поле {name}: значение не заполнено")
+                    continue
+                value, error = self._normalize_value(field, record[name])
+                if error:
+                    errors.append(f"запись {index}, поле {name}: {error}")
+                else:
+                    clean[name] = value
+            
+            date = record.get("date")
+            if date is not None:
+                try:
+                    clean["date"] = datetime.strptime(str(date), '%Y-%m-%d').strftime('%Y-%m-%d')
+                except ValueError:
+                    errors.append(f"запись {index}, поле date: ожидается дата ГГГГ-ММ-ДД")
+            normalized.append(clean)
         
-        # Сохраняем
-        return self.save_user_data(username, new_df)
+        return normalized, errors
+    
+    def load_user_state(self, username: str, name: str) -> Optional[Dict]:
+        """Служебное состояние пользователя (например, настройки обучения модели)"""
+        user = self._get_user(username)
+        if user is None:
+            return None
+        try:
+            return self.storage.load_state(user, name)
+        except Exception as e:
+            print(f"Ошибка загрузки состояния {name}: {e}")
+            return None
+    
+    def save_user_state(self, username: str, name: str, state: Optional[Dict]) -> bool:
+        """Сохраняет служебное состояние пользователя (None удаляет его)"""
+        user = self._get_user(username)
+        if user is None:
+            return False
+        with self._user_lock(user):
+            try:
+                self.storage.save_state(user, name, state)
+                return True
+            except Exception as e:
+                print(f"Ошибка сохранения состояния {name}: {e}")
+                return False
+    
+    def _load_correlations(self, username: str) -> Optional[CorrelationAccumulator]:
+        """Возвращает сохраненный накопитель корреляций пользователя"""
+        accumulator = self._correlations.get(username)
+        if accumulator is None:
+            try:
+                state = self.storage.load_state(self._get_user(username), "correlations")
+            except Exception as e:
+                # Поврежденное состояние просто пересчитываем по таблице
+                print(f"Ошибка загрузки корреляций: {e}")
+                state = None
+            if state is not None:
+                accumulator = CorrelationAccumulator.from_dict(state)
+        return accumulator
+    
+    def _update_correlations(self, username: str, signature_before: Optional[Tuple],
+                             records: List[Dict]):
+        """Учитывает новые записи в накопителе корреляций за O(полей²)"""
+        user = self._get_user(username)
+        try:
+            accumulator = self._load_correlations(username)
+            if (accumulator is None or accumulator.signature != signature_before
+                    or not all(accumulator.covers(record) for record in records)):
+                # Накопитель устарел (изменения извне или новые поля) —
+                # он будет пересчитан по всей таблице при следующем запросе
+                self._correlations.pop(username, None)
+                self.storage.save_state(user, "correlations", None)
+                return
+            
+            accumulator.update_many(records)
+            accumulator.signature = self._correlation_signature(user)
+            self._correlations[username] = accumulator
+            self.storage.save_state(user, "correlations", accumulator.to_dict())
+        except Exception as e:
+            print(f"Ошибка обновления корреляций: {e}")
+            self._correlations.pop(username, None)
+    
+    def get_correlations(self, username: str,
+                         target: str = CORRELATION_TARGET) -> Optional[pd.Series]:
+        """Корреляции полей пользователя с целевым полем (по умолчанию оценкой дня)"""
+        user = self._get_user(username)
+        if user is None:
+            return None
+        
+        with self._user_lock(user):
+            signature = self._correlation_signature(user)
+            if signature is None:
+                return None
+            
+            accumulator = self._load_correlations(username)
+            if accumulator is None or accumulator.signature != signature:
+                df = self.get_user_data(username)
+                accumulator = CorrelationAccumulator.from_dataframe(df, signature)
+                try:
+                    self.storage.save_state(user, "correlations", accumulator.to_dict())
+                except Exception as e:
+                    print(f"Ошибка сохранения корреляций: {e}")
+            
+            self._correlations[username] = accumulator
+        return accumulator.correlations_with(target)
     
     def get_user_stats(self, username: str) -> Dict:
         """Получает статистику пользователя"""
-        df = self.get_user_data(username)
+        # Статистике нужны только три колонки
+        df = self.get_user_data(username, ['date', 'kol_sna', 'ocenka_dny'])
         if df is None or df.empty:
             return {"message": "Нет данных"}
         
+        # Колонки таблицы такие, какими их видят чтения: в текущей схеме полей
+        columns = ['date'] + self.fields.get_field_names()
+        
+        last_record = df['date'].iloc[-1] if 'date' in df.columns else None
+        if isinstance(last_record, pd.Timestamp):
+            last_record = last_record.strftime('%Y-%m-%d')
+        elif pd.isna(last_record):
+            last_record = None
+        
         stats = {
             "total_records": len(df),
-            "average_sleep": df['kol_sna'].mean() if 'kol_sna' in df.columns else 0,
-            "average_rating": df['ocenka_dny'].mean() if 'ocenka_dny' in df.columns else 0,
-            "last_record": df['date'].iloc[-1] if 'date' in df.columns else None,
-            "columns": list(df.columns)
+            "average_sleep": float(df['kol_sna'].mean()) if 'kol_sna' in df.columns else 0,
+            "average_rating": float(df['ocenka_dny'].mean()) if 'ocenka_dny' in df.columns else 0,
+            "last_record": last_record,
+            "columns": columns
         }
         
         return stats
     
+    def get_memory_report(self, username: str) -> Optional[Dict]:
+        """Память таблицы пользователя по колонкам: с типами схемы и с выводом типов"""
+        df = self.get_user_data(username)
+        if df is None:
+            return None
+        
+        user = self._get_user(username)
+        with self._user_lock(user):
+            inferred = self.storage.read_records(user) if self.storage.data_signature(user) else pd.DataFrame()
+        
+        typed_usage = df.memory_usage(index=False, deep=True)
+        inferred_usage = inferred.memory_usage(index=False, deep=True)
+        return {
+            "username": username,
+            "rows": len(df),
+            "bytes": int(typed_usage.sum()),
+            "inferred_bytes": int(inferred_usage.sum()),
+            "columns": {
+                column: {
+                    "dtype": str(df[column].dtype),
+                    "bytes": int(typed_usage[column]),
+                    "inferred_dtype": str(inferred[column].dtype) if column in inferred.columns else None,
+                    "inferred_bytes": int(inferred_usage.get(column, 0))
+                }
+                for column in df.columns
+            }
+        }
+    
     def list_users(self) -> List[Dict]:
         """Возвращает список всех пользователей (без паролей)"""
-        user_list = []
-        for username, user_data in self.users.items():
-            user_list.append({
-                "username": username,
-                "user_id": user_data["user_id"],
-                "email": user_data["email"],
-                "created_at": user_data["created_at"],
-                "last_login": user_data["last_login"]
-            })
-        return user_list
+        # Перечитываем хранилище, чтобы видеть пользователей других воркеров;
+        # несохраненные изменения (last_login) берем из памяти
+        try:
+            users = self.storage.load_users()
+        except Exception as e:
+            print(f"Ошибка загрузки пользователей: {e}")
+            return []
+        
+        return [self._public_info(self._with_changes(user_data, username))
+                for username, user_data in users.items()]
+    
+    def _public_info(self, user: Dict) -> Dict:
+        """Данные пользователя без хеша пароля"""
+        return {
+            "username": user["username"],
+            "user_id": user["user_id"],
+            "email": user["email"],
+            "created_at": user["created_at"],
+            "last_login": user["last_login"]
+        }
     
     def delete_user(self, username: str) -> bool:
         """Удаляет пользователя и его данные"""
-        if username not in self.users:
+        user = self._get_user(username)
+        if user is None:
             return False
         
-        user = self.users[username]
-        
-        # Удаляем файл данных
-        filename = os.path.join(self.data_dir, user["data_file"])
-        if os.path.exists(filename):
-            os.remove(filename)
+        # Удаляем пользователя и его данные
+        with self._user_lock(user):
+            try:
+                self.storage.delete_user(user)
+            except Exception as e:
+                print(f"Ошибка удаления данных: {e}")
+                return False
         
         # Удаляем из списка пользователей
-        del self.users[username]
-        self._save_users()
+        with self._lock:
+            self.invalidate_cache(username)
+            self._auth_cache.pop(username, None)
+            self._correlations.pop(username, None)
+            self._dirty_users.pop(username, None)
         
         return True
 
@@ -3,10 +3,10 @@
 FastAPI веб-сервер для системы управления пользователями
 """
 
-from fastapi import FastAPI, HTTPException, Depends, status
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBasic, HTTPBasicCredentials, HTTPBearer
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
 import pandas as pd
@@ -15,10 +15,17 @@ from typing import Dict, List, Optional, Any
 from datetime import datetime
 import json
 import os
+import io
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from pydantic import BaseModel
 
 # Импортируем наш менеджер пользователей
 from user_manager import UserManager
+from fields_registry import fields_registry
+from mood_models import ML_AVAILABLE, ModelNotReadyError
+from schema_migration import SCHEMA_COMPACTION, SchemaCompactor
 
 # Создаем FastAPI приложение
 app = FastAPI(title="Система оценки дня", version="1.0.0")
@@ -32,14 +39,51 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Подключаем статические файлы
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Аутентификация: токен из /login (Authorization: Bearer) или логин и пароль (Basic)
+basic_security = HTTPBasic(auto_error=False)
+bearer_security = HTTPBearer(auto_error=False)
 
-# Базовое аутентификация
-security = HTTPBasic()
+# Размер пула потоков для блокирующей работы (файлы, pandas)
+WORKER_THREADS = int(os.environ.get("WORKER_THREADS", "8"))
 
-# Инициализируем менеджер пользователей
-user_manager = UserManager()
+# Состояние сервера создается только там, где приложение обслуживает запросы.
+# При запуске `python web_server.py` этот файл выполняется еще как __main__
+# (он только запускает uvicorn, см. конец файла) и как __mp_main__ в каждом
+# дочернем процессе spawn (пул обучения моделей, перезапуск uvicorn reload):
+# им не нужны ни менеджер пользователей, ни фоновые задачи.
+SERVER_PROCESS = __name__ not in ("__main__", "__mp_main__")
+
+if SERVER_PROCESS:
+    # Подключаем статические файлы
+    app.mount("/static", StaticFiles(directory="static"), name="static")
+
+    # Инициализируем менеджер пользователей
+    user_manager = UserManager()
+
+    # Таблицы пользователей переводятся в новую схему полей в фоне (SCHEMA_COMPACTION=1);
+    # без этого — при первой записи пользователя с измененным полем
+    schema_compactor = SchemaCompactor(user_manager) if SCHEMA_COMPACTION else None
+
+    # Модели предсказания оценки дня (нужен scikit-learn из requirements-ml.txt)
+    # Модели обучаются в фоновом пуле процессов (TRAINING_WORKERS процессов)
+    if ML_AVAILABLE:
+        from mood_models import MoodModelService
+        from training_jobs import TrainingScheduler
+        mood_models = MoodModelService(user_manager)
+        training_scheduler = TrainingScheduler(mood_models)
+        mood_models.scheduler = training_scheduler
+    else:
+        mood_models = None
+        training_scheduler = None
+
+    # Пул потоков для блокирующей работы (файлы, pandas), чтобы не занимать event loop.
+    # Размер задается переменной окружения WORKER_THREADS
+    blocking_executor = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="blocking")
+
+async def run_blocking(func, *args, **kwargs):
+    """Выполняет синхронную функцию в пуле потоков и ждет результат"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, functools.partial(func, *args, **kwargs))
 
 # Модели данных
 class UserRegistration(BaseModel):
@@ -62,6 +106,16 @@ class DataRecord(BaseModel):
     ocenka_dny: int
     date: Optional[str] = None
 
+class PredictionBatch(BaseModel):
+    rows: List[Dict[str, Any]]
+
+class WhatIfRequest(BaseModel):
+    base: Dict[str, Any] = {}
+    grid: Dict[str, List[float]]
+
+class TrainingModeUpdate(BaseModel):
+    mode: str
+
 class FieldDefinition(BaseModel):
     name: str
     display_name: str
@@ -69,111 +123,166 @@ class FieldDefinition(BaseModel):
     min_value: Optional[float] = None
     max_value: Optional[float] = None
     description: str = ""
-
-# Файл для хранения определений полей
-FIELDS_CONFIG_FILE = "fields_config.json"
+    # Значение для записей, сделанных до добавления поля
+    default_value: Optional[float] = None
 
 def load_fields_config() -> Dict:
     """Загружает конфигурацию полей"""
-    if os.path.exists(FIELDS_CONFIG_FILE):
-        with open(FIELDS_CONFIG_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    else:
-        # Стандартные поля
-        default_fields = {
-            "fields": [
-                {
-                    "name": "kol_sna",
-                    "display_name": "Количество сна (часы)",
-                    "field_type": "number",
-                    "min_value": 4.0,
-                    "max_value": 12.0,
-                    "description": "Количество часов сна"
-                },
-                {
-                    "name": "kolichestvo_sna_0",
-                    "display_name": "Качество сна после 00:00",
-                    "field_type": "integer",
-                    "min_value": 0,
-                    "max_value": 10,
-                    "description": "Оценка качества сна после полуночи"
-                },
-                {
-                    "name": "nalichee_zarydki",
-                    "display_name": "Наличие зарядки",
-                    "field_type": "boolean",
-                    "description": "Делали ли зарядку"
-                },
-                {
-                    "name": "zavrrak_koloriy",
-                    "display_name": "Калорийный завтрак",
-                    "field_type": "boolean",
-                    "description": "Был ли калорийный завтрак"
-                },
-                {
-                    "name": "obed_koloriy",
-                    "display_name": "Калорийный обед",
-                    "field_type": "boolean",
-                    "description": "Был ли калорийный обед"
-                },
-                {
-                    "name": "chteniy",
-                    "display_name": "Чтение",
-                    "field_type": "boolean",
-                    "description": "Читали ли сегодня"
-                },
-                {
-                    "name": "sostavlenye_rasporydka",
-                    "display_name": "Составление распорядка",
-                    "field_type": "boolean",
-                    "description": "Составляли ли распорядок дня"
-                },
-                {
-                    "name": "ocenka_dny",
-                    "display_name": "Оценка дня",
-                    "field_type": "integer",
-                    "min_value": 1,
-                    "max_value": 10,
-                    "description": "Общая оценка дня"
-                }
-            ]
-        }
-        save_fields_config(default_fields)
-        return default_fields
-
-def save_fields_config(config: Dict):
-    """Сохраняет конфигурацию полей"""
-    with open(FIELDS_CONFIG_FILE, 'w', encoding='utf-8') as f:
-        json.dump(config, f, ensure_ascii=False, indent=2)
-
-def get_current_user(credentials: HTTPBasicCredentials = Depends(security)):
-    """Получает текущего пользователя"""
-    result = user_manager.authenticate_user(credentials.username, credentials.password)
-    if not result["success"]:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Неверные учетные данные",
-            headers={"WWW-Authenticate": "Basic"},
+    return fields_registry.get_config()
+
+@app.on_event("shutdown")
+def flush_user_manager():
+    """Сохраняет отложенные изменения пользователей при остановке сервера"""
+    blocking_executor.shutdown(wait=True)
+    if training_scheduler is not None:
+        training_scheduler.shutdown()
+    if schema_compactor is not None:
+        schema_compactor.shutdown()
+    user_manager.flush()
+
+async def get_current_user(
+    bearer: Optional[HTTPAuthorizationCredentials] = Depends(bearer_security),
+    credentials: Optional[HTTPBasicCredentials] = Depends(basic_security)
+):
+    """Получает текущего пользователя
+    
+    Подпись токена проверяется прямо в event loop (одна HMAC подпись), а
+    пользователь из токена ищется в хранилище в пуле потоков; пароль из Basic
+    проверяется медленным хешем в пуле потоков (с кэшем недавних проверок).
+    """
+    if bearer is not None:
+        claims = user_manager.tokens.verify(bearer.credentials)
+        if claims is not None:
+            username = await run_blocking(user_manager.authenticate_claims, claims)
+            if username is not None:
+                return username
+    elif credentials is not None:
+        result = await run_blocking(
+            user_manager.authenticate_user, credentials.username, credentials.password
         )
-    return credentials.username
+        if result["success"]:
+            return credentials.username
+    
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Неверные учетные данные",
+        headers={"WWW-Authenticate": "Bearer, Basic"},
+    )
 
-def calculate_correlations(df: pd.DataFrame) -> List[Dict]:
+def calculate_correlations(username: str) -> List[Dict]:
     """Вычисляет корреляции с оценкой дня"""
-    if df.empty or 'ocenka_dny' not in df.columns:
+    correlations = user_manager.get_correlations(username)
+    if correlations is None or correlations.empty:
         return []
     
-    correlations = df.corr()['ocenka_dny'].drop('ocenka_dny').sort_values(ascending=False)
+    correlations = correlations.dropna().sort_values(ascending=False)
     
     top_features = []
     for feature, corr in correlations.head(3).items():
         top_features.append({
             "feature": feature,
-            "correlation": round(corr, 3),
+            "correlation": round(float(corr), 3),
             "impact": "положительное" if corr > 0 else "отрицательное"
         })
     
     return top_features
 
+# Максимальный размер страницы GET /data
+MAX_PAGE_SIZE = 1000
+
+def frame_records(df: pd.DataFrame) -> List[Dict]:
+    """Преобразует DataFrame в список записей для JSON (NaN -> None)
+    
+    Даты отдаются строками ГГГГ-ММ-ДД, float32 — кратчайшей записью
+    (7.3, а не 7.300000190734863).
+    """
+    df = df.copy()
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            df[column] = values.dt.strftime('%Y-%m-%d')
+        elif values.dtype == "float32":
+            df[column] = pd.to_numeric(values.astype(str))
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+def build_user_data_response(username: str) -> Optional[Dict]:
+    """Собирает ответ GET /data (выполняется в пуле потоков)"""
+    df = user_manager.get_user_data(username)
+    if df is None:
+        return None
+    
+    return {
+        "username": username,
+        "data": frame_records(df),
+        "total_records": len(df)
+    }
+
+def build_user_data_page(username: str, since: Optional[str], until: Optional[str],
+                         cursor: Optional[int], limit: int) -> Optional[Dict]:
+    """Собирает страницу GET /data (выполняется в пуле потоков)"""
+    # Читаем на одну запись больше, чтобы понять, есть ли следующая страница
+    chunks = user_manager.iter_user_records(username, since, until, cursor, limit + 1)
+    if chunks is None:
+        return None
+    
+    records = []
+    positions = []
+    for chunk in chunks:
+        records.extend(frame_records(chunk))
+        positions.extend(chunk.index.tolist())
+    
+    has_more = len(records) > limit
+    records = records[:limit]
+    
+    return {
+        "username": username,
+        "data": records,
+        "count": len(records),
+        "next_cursor": str(positions[limit - 1]) if has_more else None
+    }
+
+def stream_ndjson(chunks) -> Any:
+    """Построчно отдает записи в формате NDJSON"""
+    for chunk in chunks:
+        for record in frame_records(chunk):
+            yield json.dumps(record, ensure_ascii=False, default=str) + "\n"
+
+def stream_csv(chunks) -> Any:
+    """Отдает записи в формате CSV по частям"""
+    header = True
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=header)
+        header = False
+
+def parse_date_param(value: Optional[str], name: str) -> Optional[str]:
+    """Проверяет параметр даты ГГГГ-ММ-ДД"""
+    if value is None:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Параметр {name}: ожидается дата ГГГГ-ММ-ДД")
+
+def build_user_stats_response(username: str) -> Dict:
+    """Собирает ответ GET /stats (выполняется в пуле потоков)"""
+    stats = user_manager.get_user_stats(username)
+    if "message" in stats:
+        return {"message": stats["message"]}
+    
+    # Добавляем анализ корреляций
+    correlations = calculate_correlations(username)
+    
+    return {
+        **stats,
+        "top_features": correlations
+    }
+
+def parse_csv_records(raw: bytes) -> List[Dict]:
+    """Разбирает CSV выгрузку в список записей"""
+    df = pd.read_csv(io.BytesIO(raw), dtype={"date": str})
+    df = df.astype(object).where(df.notna(), None)
+    return df.to_dict('records')
+
 # API endpoints
 
 @app.get("/", response_class=HTMLResponse)
@@ -227,10 +336,42 @@ async def root():
                         <span class="method">POST</span> <span class="url">/data</span> - Добавить запись
                     </div>
                     
+                    <div class="endpoint">
+                        <span class="method">POST</span> <span class="url">/data/bulk</span> - Добавить пачку записей (JSON или CSV)
+                    </div>
+                    
                     <div class="endpoint">
                         <span class="method">GET</span> <span class="url">/stats</span> - Статистика пользователя
                     </div>
                     
+                    <div class="endpoint">
+                        <span class="method">GET</span> <span class="url">/stats/memory</span> - Память таблицы пользователя по колонкам
+                    </div>
+                    
+                    <div class="endpoint">
+                        <span class="method">POST</span> <span class="url">/predict/batch</span> - Предсказать оценку дня для набора сценариев
+                    </div>
+                    
+                    <div class="endpoint">
+                        <span class="method">POST</span> <span class="url">/predict/what-if</span> - Предсказания по сетке значений признаков
+                    </div>
+                    
+                    <div class="endpoint">
+                        <span class="method">GET</span> <span class="url">/training</span> - Состояние обучения модели
+                    </div>
+                    
+                    <div class="endpoint">
+                        <span class="method">POST</span> <span class="url">/training</span> - Запустить обучение модели
+                    </div>
+                    
+                    <div class="endpoint">
+                        <span class="method">PUT</span> <span class="url">/training/mode</span> - Режим обучения: full, warm_start, online_linear, time_series_cv, population
+                    </div>
+                    
+                    <div class="endpoint">
+                        <span class="method">GET</span> <span class="url">/training/population</span> - Состояние общей модели
+                    </div>
+                    
                     <div class="endpoint">
                         <span class="method">GET</span> <span class="url">/fields</span> - Получить поля данных
                     </div>
@@ -242,6 +383,10 @@ async def root():
                     <div class="endpoint">
                         <span class="method">DELETE</span> <span class="url">/fields/{field_name}</span> - Удалить поле
                     </div>
+                    
+                    <div class="endpoint">
+                        <span class="method">GET</span> <span class="url">/fields/compaction</span> - Перевод таблиц в новую схему полей
+                    </div>
                 </div>
                 
                 <div class="api-section">
@@ -257,7 +402,9 @@ async def root():
 @app.post("/register")
 async def register_user(user_data: UserRegistration):
     """Регистрация нового пользователя"""
-    result = user_manager.register_user(user_data.username, user_data.password, user_data.email)
+    result = await run_blocking(
+        user_manager.register_user, user_data.username, user_data.password, user_data.email
+    )
     if result["success"]:
         return {"message": "Пользователь успешно зарегистрирован", "user_id": result["user_id"]}
     else:
@@ -265,30 +412,71 @@ async def register_user(user_data: UserRegistration):
 
 @app.post("/login")
 async def login_user(user_data: UserLogin):
-    """Вход в систему"""
-    result = user_manager.authenticate_user(user_data.username, user_data.password)
+    """Вход в систему: возвращает токен для заголовка Authorization: Bearer <токен>"""
+    result = await run_blocking(
+        user_manager.issue_token, user_data.username, user_data.password
+    )
     if result["success"]:
-        return {"message": "Успешная аутентификация", "user_id": result["user_id"]}
+        return {
+            "message": "Успешная аутентификация",
+            "user_id": result["user_id"],
+            "access_token": result["access_token"],
+            "token_type": result["token_type"],
+            "expires_in": result["expires_in"]
+        }
     else:
         raise HTTPException(status_code=401, detail=result["message"])
 
 @app.get("/users")
 async def list_users():
     """Список всех пользователей"""
-    return {"users": user_manager.list_users()}
+    return {"users": await run_blocking(user_manager.list_users)}
 
 @app.get("/data")
-async def get_user_data(username: str = Depends(get_current_user)):
-    """Получить данные пользователя"""
-    df = user_manager.get_user_data(username)
-    if df is None:
+async def get_user_data(
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson|csv)$"),
+    username: str = Depends(get_current_user)
+):
+    """Получить данные пользователя
+    
+    Без параметров возвращает всю таблицу. since/until (ГГГГ-ММ-ДД), limit и
+    cursor (next_cursor предыдущей страницы) включают постраничный режим.
+    format=ndjson или format=csv отдает записи потоком по мере чтения.
+    """
+    since = parse_date_param(since, "since")
+    until = parse_date_param(until, "until")
+    
+    position = None
+    if cursor is not None:
+        try:
+            position = int(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Неверный курсор")
+    
+    if format != "json":
+        chunks = await run_blocking(
+            user_manager.iter_user_records, username, since, until, position, limit
+        )
+        if chunks is None:
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
+        if format == "ndjson":
+            return StreamingResponse(stream_ndjson(chunks), media_type="application/x-ndjson")
+        return StreamingResponse(stream_csv(chunks), media_type="text/csv")
+    
+    if since is None and until is None and limit is None and position is None:
+        response = await run_blocking(build_user_data_response, username)
+    else:
+        response = await run_blocking(
+            build_user_data_page, username, since, until, position, limit or MAX_PAGE_SIZE
+        )
+    if response is None:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
-    return {
-        "username": username,
-        "data": df.to_dict('records'),
-        "total_records": len(df)
-    }
+    return response
 
 @app.post("/data")
 async def add_data_record(record: DataRecord, username: str = Depends(get_current_user)):
@@ -299,13 +487,14 @@ async def add_data_record(record: DataRecord, username: str = Depends(get_curren
         record_dict['date'] = datetime.now().strftime('%Y-%m-%d')
     
     # Добавляем запись
-    success = user_manager.add_user_record(username, record_dict)
+    success = await run_blocking(user_manager.add_user_record, username, record_dict)
     if not success:
         raise HTTPException(status_code=500, detail="Ошибка при добавлении записи")
     
-    # Получаем обновленные данные для анализа
-    df = user_manager.get_user_data(username)
-    correlations = calculate_correlations(df)
+    # Корреляции обновляются инкрементально при добавлении записи
+    correlations = await run_blocking(calculate_correlations, username)
+    if training_scheduler is not None:
+        await run_blocking(training_scheduler.record_added, username)
     
     return {
         "message": "Запись успешно добавлена",
@@ -313,55 +502,177 @@ async def add_data_record(record: DataRecord, username: str = Depends(get_curren
         "top_features": correlations
     }
 
-@app.get("/stats")
-async def get_user_stats(username: str = Depends(get_current_user)):
-    """Получить статистику пользователя"""
-    stats = user_manager.get_user_stats(username)
-    if "message" in stats:
-        return {"message": stats["message"]}
+@app.post("/data/bulk")
+async def add_data_records_bulk(request: Request, username: str = Depends(get_current_user)):
+    """Добавить пачку записей: JSON массив или CSV (тело text/csv либо файл в поле file)"""
+    content_type = request.headers.get("content-type", "")
     
-    # Добавляем анализ корреляций
-    df = user_manager.get_user_data(username)
-    correlations = calculate_correlations(df)
+    try:
+        if content_type.startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None:
+                raise HTTPException(status_code=400, detail="Не передан файл (поле file)")
+            records = await run_blocking(parse_csv_records, await upload.read())
+        elif content_type.startswith("text/csv"):
+            records = await run_blocking(parse_csv_records, await request.body())
+        else:
+            records = await request.json()
+    except HTTPException:
+        raise
+    except Exception:
+        raise HTTPException(status_code=400, detail="Не удалось разобрать данные")
+    
+    if not isinstance(records, list) or not records:
+        raise HTTPException(status_code=400, detail="Ожидается непустой список записей")
+    
+    # Проверяем все записи по схеме полей до записи
+    records, errors = await run_blocking(user_manager.validate_records, records)
+    if errors:
+        raise HTTPException(status_code=400, detail={"message": "Ошибки в данных", "errors": errors})
+    
+    success = await run_blocking(user_manager.add_user_records, username, records)
+    if not success:
+        raise HTTPException(status_code=500, detail="Ошибка при добавлении записей")
+    
+    # Корреляции пересчитываются один раз на всю пачку
+    correlations = await run_blocking(calculate_correlations, username)
+    if training_scheduler is not None:
+        await run_blocking(training_scheduler.record_added, username, len(records))
     
     return {
-        **stats,
+        "message": f"Добавлено записей: {len(records)}",
+        "added": len(records),
         "top_features": correlations
     }
 
+@app.get("/stats/memory")
+async def get_memory_report(username: str = Depends(get_current_user)):
+    """Память, занимаемая таблицей пользователя, по колонкам и типам"""
+    report = await run_blocking(user_manager.get_memory_report, username)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    return report
+
+@app.get("/stats")
+async def get_user_stats(username: str = Depends(get_current_user)):
+    """Получить статистику пользователя"""
+    return await run_blocking(build_user_stats_response, username)
+
+async def run_prediction(func, *args) -> Dict:
+    """Выполняет предсказание в пуле потоков и переводит ошибки в HTTP ответы"""
+    if mood_models is None:
+        raise HTTPException(status_code=503, detail="Модели недоступны: не установлены ML зависимости")
+    
+    try:
+        response = await run_blocking(func, *args)
+    except ModelNotReadyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if response is None:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    return response
+
+@app.post("/predict/batch")
+async def predict_batch(batch: PredictionBatch, username: str = Depends(get_current_user)):
+    """Предсказать оценку дня для нескольких наборов признаков одним вызовом модели"""
+    if not batch.rows:
+        raise HTTPException(status_code=400, detail="Пустой список сценариев")
+    return await run_prediction(mood_models.predict_batch, username, batch.rows)
+
+@app.post("/predict/what-if")
+async def predict_what_if(request: WhatIfRequest, username: str = Depends(get_current_user)):
+    """Предсказания для всех сочетаний значений выбранных признаков
+    
+    Например, {"base": {"chteniy": 1}, "grid": {"kol_sna": [6, 7, 8, 9]}}.
+    """
+    return await run_prediction(mood_models.what_if, username, request.base, request.grid)
+
+@app.get("/training")
+async def get_training_status(username: str = Depends(get_current_user)):
+    """Состояние фонового обучения модели пользователя"""
+    if training_scheduler is None:
+        raise HTTPException(status_code=503, detail="Модели недоступны: не установлены ML зависимости")
+    return training_scheduler.get_status(username)
+
+@app.post("/training")
+async def start_training(username: str = Depends(get_current_user)):
+    """Поставить обучение модели пользователя в очередь"""
+    if training_scheduler is None:
+        raise HTTPException(status_code=503, detail="Модели недоступны: не установлены ML зависимости")
+    job = await run_blocking(training_scheduler.schedule, username)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    return job
+
+@app.get("/training/population")
+async def get_population_status(username: str = Depends(get_current_user)):
+    """Состояние общей модели, которая отвечает за пользователей без своей модели"""
+    if training_scheduler is None:
+        raise HTTPException(status_code=503, detail="Модели недоступны: не установлены ML зависимости")
+    return training_scheduler.get_population_status()
+
+@app.get("/training/mode")
+async def get_training_mode(username: str = Depends(get_current_user)):
+    """Режим обучения модели пользователя"""
+    if mood_models is None:
+        raise HTTPException(status_code=503, detail="Модели недоступны: не установлены ML зависимости")
+    return {"mode": await run_blocking(mood_models.get_training_mode, username)}
+
+@app.put("/training/mode")
+async def set_training_mode(update: TrainingModeUpdate, username: str = Depends(get_current_user)):
+    """Выбрать режим обучения: full, warm_start, online_linear, time_series_cv или population"""
+    if mood_models is None:
+        raise HTTPException(status_code=503, detail="Модели недоступны: не установлены ML зависимости")
+    try:
+        success = await run_blocking(mood_models.set_training_mode, username, update.mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not success:
+        raise HTTPException(status_code=500, detail="Не удалось сохранить режим обучения")
+    return {"mode": update.mode}
+
 @app.get("/fields")
 async def get_fields():
     """Получить конфигурацию полей"""
-    return load_fields_config()
+    return await run_blocking(load_fields_config)
 
 @app.post("/fields")
 async def add_field(field: FieldDefinition):
-    """Добавить новое поле"""
-    config = load_fields_config()
+    """Добавить новое поле
     
-    # Проверяем, что поле не существует
-    existing_fields = [f["name"] for f in config["fields"]]
-    if field.name in existing_fields:
-        raise HTTPException(status_code=400, detail="Поле уже существует")
-    
-    # Добавляем новое поле
+    Таблицы пользователей не переписываются: в прежних записях поле
+    читается как default_value (или пусто).
+    """
     field_dict = field.dict()
-    config["fields"].append(field_dict)
-    save_fields_config(config)
+    if field.default_value is not None:
+        default = field.default_value
+        if ((field.min_value is not None and default < field.min_value)
+                or (field.max_value is not None and default > field.max_value)
+                or (field.field_type == "boolean" and default not in (0, 1))
+                or (field.field_type == "integer" and not float(default).is_integer())):
+            raise HTTPException(status_code=400, detail="Значение по умолчанию не подходит полю")
+        if field.field_type in ("integer", "boolean"):
+            field_dict["default_value"] = int(default)
+    
+    # Проверяем, что поле не существует, и добавляем его
+    if not await run_blocking(fields_registry.add_field, field_dict):
+        raise HTTPException(status_code=400, detail="Поле уже существует")
+    if schema_compactor is not None:
+        schema_compactor.schedule()
     
-    return {"message": f"Поле '{field.display_name}' успешно добавлено", "field": field_dict}
+    return {
+        "message": f"Поле '{field.display_name}' успешно добавлено",
+        "field": field_dict,
+        "schema_version": fields_registry.get_schema_version()
+    }
 
 @app.delete("/fields/{field_name}")
 async def delete_field(field_name: str):
     """Удалить поле"""
-    config = load_fields_config()
-    
-    # Находим и удаляем поле
-    field_to_remove = None
-    for field in config["fields"]:
-        if field["name"] == field_name:
-            field_to_remove = field
-            break
+    field_to_remove = fields_registry.get_field(field_name)
     
     if field_to_remove is None:
         raise HTTPException(status_code=404, detail="Поле не найдено")
@@ -371,17 +682,37 @@ async def delete_field(field_name: str):
     if field_name in required_fields:
         raise HTTPException(status_code=400, detail="Нельзя удалить обязательное поле")
     
-    config["fields"] = [f for f in config["fields"] if f["name"] != field_name]
-    save_fields_config(config)
+    field_to_remove = await run_blocking(fields_registry.delete_field, field_name)
+    if field_to_remove is None:
+        raise HTTPException(status_code=404, detail="Поле не найдено")
+    if schema_compactor is not None:
+        schema_compactor.schedule()
     
-    return {"message": f"Поле '{field_to_remove['display_name']}' успешно удалено"}
+    return {
+        "message": f"Поле '{field_to_remove['display_name']}' успешно удалено",
+        "schema_version": fields_registry.get_schema_version()
+    }
+
+@app.get("/fields/compaction")
+async def get_schema_compaction():
+    """Состояние фонового перевода таблиц в текущую схему полей"""
+    if schema_compactor is None:
+        return {"status": "disabled", "schema_version": fields_registry.get_schema_version()}
+    return schema_compactor.get_status()
 
 @app.get("/health")
 async def health_check():
     """Проверка состояния сервера"""
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "data_cache": user_manager.cache_info(),
+        "training": training_scheduler.info() if training_scheduler is not None else None,
+        "schema_compaction": schema_compactor.get_status()["status"] if schema_compactor is not None else None
+    }
 
 if __name__ == "__main__":
     print("🚀 Запуск веб-сервера на http://localhost:4000")
     print("📖 Документация: http://localhost:4000/docs")
-    uvicorn.run(app, host="0.0.0.0", port=4000, reload=True)
+    # reload работает только с приложением, заданным строкой импорта
+    uvicorn.run("web_server:app", host="0.0.0.0", port=4000, reload=True)
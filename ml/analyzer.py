@@ -5,19 +5,279 @@ from sklearn.ensemble import RandomForestRegressor
 from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error, r2_score
+from sklearn.model_selection import TimeSeriesSplit
+from scipy.special import stdtr
+from joblib import Parallel, delayed
+import copy
 import json
+import time
 from typing import List, Dict, Optional, Tuple
 from datetime import datetime, timedelta
 
+from model_registry import ModelRegistry, data_fingerprint
+from online_linear import OnlineLinearModel
+
+# Параметры модели настроения (входят в отпечаток обучающих данных)
+MOOD_MODEL_PARAMS = {'n_estimators': 100, 'random_state': 42, 'test_size': 0.2}
+
+# Режимы обучения: полный, дообучение леса новыми деревьями, онлайн-линейная
+# модель и выбор модели кросс-валидацией по времени
+TRAINING_MODES = ('full', 'warm_start', 'online_linear', 'time_series_cv')
+# Максимум деревьев при дообучении, после него лес обучается заново
+WARM_START_MAX_TREES = 300
+
+# Число разбиений rolling-origin кросс-валидации
+CV_SPLITS = 5
+# Кандидаты, которые сравниваются в режиме time_series_cv
+CV_CANDIDATES = {
+    'random_forest': lambda: RandomForestRegressor(
+        n_estimators=MOOD_MODEL_PARAMS['n_estimators'],
+        random_state=MOOD_MODEL_PARAMS['random_state']
+    ),
+    'linear_regression': LinearRegression
+}
+
+# Признаки и цель модели настроения по умолчанию
+MOOD_FEATURE_COLUMNS = [
+    'sleep_quality', 'sleep_duration_hours', 'wake_up_hour',
+    'avg_taste_rating', 'avg_health_rating', 'meals_count',
+    'activities_count', 'avg_intensity', 'avg_enjoyment',
+    'total_activity_hours'
+]
+MOOD_TARGET = 'overall_mood'
+
+# Числовые колонки таблицы признаков для корреляционного анализа
+CORRELATION_COLUMNS = [
+    'sleep_quality', 'sleep_duration_hours', 'wake_up_hour',
+    'overall_mood', 'physical_wellness', 'mental_wellness',
+    'avg_taste_rating', 'avg_health_rating', 'meals_count',
+    'avg_meal_hour', 'activities_count', 'avg_intensity',
+    'avg_enjoyment', 'total_activity_hours', 'avg_mood_intensity'
+]
+# Уровень значимости для поля significant
+SIGNIFICANCE_LEVEL = 0.05
+
+# Значение признака, не переданного в предсказание
+DEFAULT_FEATURE_VALUE = 5.0
+
+# Значения дневных признаков для дней без соответствующих событий
+DAILY_FEATURE_DEFAULTS = {
+    'sleep_duration_hours': 8.0,
+    'avg_taste_rating': 5.0,
+    'avg_health_rating': 5.0,
+    'meals_count': 3,
+    'avg_meal_hour': 12,
+    'activities_count': 0,
+    'avg_intensity': 5.0,
+    'avg_enjoyment': 5.0,
+    'total_activity_hours': 0,
+    'avg_mood_intensity': 5.0,
+    'mood_entries_count': 0
+}
+
+def _to_datetime(values: pd.Series) -> pd.Series:
+    """Разбирает даты один раз (уже разобранные колонки не трогает)"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    return pd.to_datetime(values)
+
+def _mode_by_group(keys: pd.Series, values: pd.Series) -> pd.Series:
+    """Самое частое значение в каждой группе за один векторный проход
+    
+    Совпадает с value_counts().index[0]: при равенстве частот выигрывает
+    значение, встретившееся в группе раньше. Значения кодируются как
+    categorical, поэтому группировка идет по целым кодам, а не по строкам.
+    """
+    categories = values.astype('category')
+    codes = categories.cat.codes
+    present = (codes >= 0).to_numpy()
+    
+    frame = pd.DataFrame({'key': keys.to_numpy()[present], 'code': codes.to_numpy()[present]})
+    counts = frame.groupby(['key', 'code'], sort=False).size()
+    # Устойчивая сортировка сохраняет порядок первого появления при равных частотах
+    counts = counts.sort_values(ascending=False, kind='stable')
+    top = counts.index.to_frame(index=False).drop_duplicates('key')
+    
+    mode = categories.cat.categories.take(top['code'].to_numpy())
+    return pd.Series(mode, index=pd.Index(top['key'].to_numpy(), name=keys.name))
+
+def time_series_folds(dates: Optional[pd.Series], n_rows: int,
+                      n_splits: int = CV_SPLITS) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Rolling-origin разбиения строк, упорядоченных по времени
+    
+    Каждый фолд обучается на всех более ранних днях и проверяется на
+    следующих, поэтому будущие дни не попадают в обучение. Записи одного
+    дня не разделяются; если разных дней слишком мало, строки делятся по
+    позиции.
+    """
+    if dates is not None:
+        codes, uniques = pd.factorize(dates, sort=True)
+        if len(uniques) > n_splits:
+            folds = []
+            for train_days, test_days in TimeSeriesSplit(n_splits=n_splits).split(np.arange(len(uniques))):
+                folds.append((np.flatnonzero(codes <= train_days[-1]),
+                              np.flatnonzero((codes >= test_days[0]) & (codes <= test_days[-1]))))
+            return folds
+    
+    n_splits = min(n_splits, n_rows - 1)
+    return list(TimeSeriesSplit(n_splits=n_splits).split(np.arange(n_rows)))
+
+def _evaluate_fold(name: str, fold: int, X: np.ndarray, y: np.ndarray,
+                   train_index: np.ndarray, test_index: np.ndarray) -> Dict:
+    """Обучает кандидата на фолде и считает метрики на следующем отрезке"""
+    model = CV_CANDIDATES[name]()
+    started = time.perf_counter()
+    model.fit(X[train_index], y[train_index])
+    fit_seconds = time.perf_counter() - started
+    y_pred = model.predict(X[test_index])
+    mse = mean_squared_error(y[test_index], y_pred)
+    return {
+        'candidate': name,
+        'fold': fold,
+        'train_rows': int(len(train_index)),
+        'test_rows': int(len(test_index)),
+        'rmse': float(np.sqrt(mse)),
+        'r2_score': float(r2_score(y[test_index], y_pred)) if len(test_index) > 1 else None,
+        'fit_seconds': round(fit_seconds, 4)
+    }
+
+def _linear_importances(model, X: np.ndarray) -> np.ndarray:
+    """Важность признаков линейной модели: доли |коэффициент| × std признака"""
+    weights = np.abs(model.coef_) * X.std(axis=0)
+    total = weights.sum()
+    return weights / total if total > 0 else np.full(len(weights), 1.0 / len(weights))
+
+def pairwise_correlations(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Корреляции Пирсона, p-значения и размеры выборок для всех пар колонок
+    
+    Пропуски (NaN) обрабатываются попарно, как в DataFrame.corr(): каждая пара
+    считается по строкам, где заполнены обе колонки. Все суммы по парам
+    получаются матричными произведениями маски наблюдений и значений за один
+    проход. p-значение — двусторонний t-тест с n - 2 степенями свободы; для
+    пар с n < 3 или нулевой дисперсией корреляция и p-значение — NaN.
+    """
+    values = np.asarray(values, dtype=float)
+    observed = ~np.isnan(values)
+    mask = observed.astype(float)
+    # Центрирование по столбцу уменьшает потерю точности в разностях сумм
+    counts = mask.sum(axis=0)
+    means = np.divide(np.where(observed, values, 0.0).sum(axis=0), counts,
+                      out=np.zeros(values.shape[1]), where=counts > 0)
+    centered = np.where(observed, values - means, 0.0)
+    
+    n = mask.T @ mask
+    # sums[i, j] — сумма колонки i по строкам, где заполнены i и j
+    sums = centered.T @ mask
+    squares = (centered ** 2).T @ mask
+    products = centered.T @ centered
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = products - sums * sums.T / n
+        variance = squares - sums ** 2 / n
+        r = np.clip(covariance / np.sqrt(variance * variance.T), -1.0, 1.0)
+        r[(n < 3) | ~np.isfinite(r)] = np.nan
+        
+        dof = np.maximum(n - 2, 1.0)
+        t = np.abs(r) * np.sqrt(dof / (1.0 - r ** 2))
+        p_values = 2.0 * stdtr(dof, -t)
+    p_values[np.isnan(r)] = np.nan
+    return r, p_values, n.astype(int)
+
+def expand_correlation_matrix(compact: Dict, field: str = 'correlation') -> pd.DataFrame:
+    """Квадратная матрица из компактного вида analyze_correlations
+    
+    compact['upper'][field] хранит значения над диагональю построчно:
+    (0, 1), (0, 2), ..., (1, 2), ...
+    """
+    columns = compact['columns']
+    rows, cols = np.triu_indices(len(columns), k=1)
+    matrix = np.full((len(columns), len(columns)), np.nan)
+    upper = np.array([np.nan if value is None else value for value in compact['upper'][field]], dtype=float)
+    matrix[rows, cols] = upper
+    matrix[cols, rows] = upper
+    if field == 'correlation':
+        np.fill_diagonal(matrix, 1.0)
+    elif field == 'sample_size':
+        np.fill_diagonal(matrix, compact['diagonal_sample_size'])
+    return pd.DataFrame(matrix, index=columns, columns=columns)
+
+def prepare_daily_records(df_records: pd.DataFrame) -> pd.DataFrame:
+    """Разбор дат и признаки сна для таблицы записей дня"""
+    if df_records.empty:
+        return df_records
+    
+    df_records['date'] = _to_datetime(df_records['date'])
+    df_records['wake_up_time'] = _to_datetime(df_records['wake_up_time'])
+    df_records['sleep_time'] = _to_datetime(df_records['sleep_time'])
+    
+    # Вычисляем продолжительность сна
+    df_records['sleep_duration_hours'] = (
+        df_records['sleep_time'] - df_records['wake_up_time']
+    ).dt.total_seconds() / 3600
+    
+    # Время пробуждения (час)
+    df_records['wake_up_hour'] = df_records['wake_up_time'].dt.hour
+    return df_records
+
+def combine_daily_features(df_records: pd.DataFrame, daily_aggregates: List[pd.DataFrame]) -> pd.DataFrame:
+    """Присоединяет дневные агрегаты (индекс — daily_record_id) к записям дня"""
+    df_combined = df_records
+    
+    # Агрегаты выравниваются по daily_record_id записей дня (как левое
+    # соединение) и добавляются одним concat
+    if daily_aggregates and not df_records.empty:
+        record_ids = df_records['daily_record_id']
+        aligned = []
+        for aggregate in daily_aggregates:
+            aggregate = aggregate.reindex(record_ids)
+            aggregate.index = df_records.index
+            aligned.append(aggregate)
+        df_combined = pd.concat([df_records] + aligned, axis=1)
+    
+    # Заполняем пропущенные значения
+    return df_combined.fillna(DAILY_FEATURE_DEFAULTS)
+
 class DayAnalyzer:
-    def __init__(self):
+    def __init__(self, feature_store=None, registry: Optional[ModelRegistry] = None,
+                 user_id=None, feature_columns: Optional[List[str]] = None,
+                 target: str = MOOD_TARGET, n_jobs: Optional[int] = None,
+                 training_mode: str = 'full'):
         self.mood_model = None
         self.correlation_matrix = None
         self.feature_importance = None
+        # DailyFeatureStore с заранее посчитанными дневными признаками
+        self.feature_store = feature_store
+        # Реестр сохраненных моделей; модель пользователя user_id
+        # загружается из него при первом predict_mood
+        self.registry = registry
+        self.user_id = user_id
+        self.model_fingerprint = None
+        # Признаки и цель модели (по умолчанию — схема DailyRecord)
+        self.feature_columns = list(feature_columns or MOOD_FEATURE_COLUMNS)
+        self.target = target
+        # Потоков на обучение одного леса (None — один поток, как в sklearn)
+        self.n_jobs = n_jobs
+        # Режим обучения по умолчанию (см. TRAINING_MODES)
+        self.training_mode = training_mode
+        # Метаданные текущей модели (учтенные строки, режим, метрики)
+        self.model_metadata = None
+        # Последний результат analyze_correlations: (ключ данных, результат)
+        self._correlations: Optional[Tuple] = None
+        
+    def get_daily_features(self, user_id: Optional[int] = None) -> pd.DataFrame:
+        """Таблица признаков по дням из материализованного хранилища"""
+        if self.feature_store is None:
+            raise ValueError("DayAnalyzer создан без feature_store; используйте prepare_data")
+        return self.feature_store.to_frame(user_id)
         
     def prepare_data(self, daily_records: List[Dict], meals: List[Dict], 
                     activities: List[Dict], mood_trackings: List[Dict]) -> pd.DataFrame:
-        """Подготовка данных для анализа"""
+        """Подготовка данных для анализа
+        
+        Каждая таблица агрегируется одним groupby по daily_record_id, строковые
+        категории (portion_size, emotion) обрабатываются как categorical, а
+        агрегаты выравниваются по записям дня и присоединяются за один concat.
+        """
         
         # Создаем DataFrame из записей дня
         df_records = pd.DataFrame(daily_records)
@@ -26,141 +286,124 @@ class DayAnalyzer:
         df_moods = pd.DataFrame(mood_trackings)
         
         # Обработка записей дня
-        if not df_records.empty:
-            df_records['date'] = pd.to_datetime(df_records['date'])
-            df_records['wake_up_time'] = pd.to_datetime(df_records['wake_up_time'])
-            df_records['sleep_time'] = pd.to_datetime(df_records['sleep_time'])
-            
-            # Вычисляем продолжительность сна
-            df_records['sleep_duration_hours'] = (
-                df_records['sleep_time'] - df_records['wake_up_time']
-            ).dt.total_seconds() / 3600
-            
-            # Время пробуждения (час)
-            df_records['wake_up_hour'] = df_records['wake_up_time'].dt.hour
-            
+        df_records = prepare_daily_records(df_records)
+        
+        daily_aggregates = []
+        
         # Обработка приемов пищи
         if not df_meals.empty:
-            df_meals['meal_time'] = pd.to_datetime(df_meals['meal_time'])
-            df_meals['meal_hour'] = df_meals['meal_time'].dt.hour
-            
-            # Группируем по дням
-            daily_meals = df_meals.groupby('daily_record_id').agg({
-                'taste_rating': 'mean',
-                'health_rating': 'mean',
-                'meal_hour': ['count', 'mean'],
-                'portion_size': lambda x: x.value_counts().index[0] if len(x) > 0 else 'medium'
-            }).reset_index()
+            meal_hour = _to_datetime(df_meals['meal_time']).dt.hour
+            grouped = df_meals.groupby('daily_record_id')
+            hours = meal_hour.groupby(df_meals['daily_record_id'])
             
-            daily_meals.columns = [
-                'daily_record_id', 'avg_taste_rating', 'avg_health_rating',
-                'meals_count', 'avg_meal_hour', 'most_common_portion'
-            ]
+            daily_aggregates.append(pd.DataFrame({
+                'avg_taste_rating': grouped['taste_rating'].mean(),
+                'avg_health_rating': grouped['health_rating'].mean(),
+                'meals_count': hours.count(),
+                'avg_meal_hour': hours.mean(),
+                'most_common_portion': _mode_by_group(df_meals['daily_record_id'], df_meals['portion_size'])
+            }))
         
         # Обработка активностей
         if not df_activities.empty:
-            df_activities['start_time'] = pd.to_datetime(df_activities['start_time'])
-            df_activities['end_time'] = pd.to_datetime(df_activities['end_time'])
-            
             # Вычисляем продолжительность активности
-            df_activities['activity_duration_hours'] = (
-                df_activities['end_time'] - df_activities['start_time']
+            activity_duration_hours = (
+                _to_datetime(df_activities['end_time']) - _to_datetime(df_activities['start_time'])
             ).dt.total_seconds() / 3600
+            grouped = df_activities.groupby('daily_record_id')
             
-            # Группируем по дням
-            daily_activities = df_activities.groupby('daily_record_id').agg({
-                'activity_type': 'count',
-                'intensity': 'mean',
-                'enjoyment_rating': 'mean',
-                'activity_duration_hours': 'sum'
-            }).reset_index()
-            
-            daily_activities.columns = [
-                'daily_record_id', 'activities_count', 'avg_intensity',
-                'avg_enjoyment', 'total_activity_hours'
-            ]
+            daily_aggregates.append(pd.DataFrame({
+                'activities_count': grouped['activity_type'].count(),
+                'avg_intensity': grouped['intensity'].mean(),
+                'avg_enjoyment': grouped['enjoyment_rating'].mean(),
+                'total_activity_hours': activity_duration_hours.groupby(df_activities['daily_record_id']).sum()
+            }))
         
         # Обработка настроения
         if not df_moods.empty:
-            df_moods['timestamp'] = pd.to_datetime(df_moods['timestamp'])
-            
-            # Группируем по дням
-            daily_moods = df_moods.groupby('daily_record_id').agg({
-                'emotion': lambda x: x.value_counts().index[0] if len(x) > 0 else 'neutral',
-                'intensity': 'mean',
-                'timestamp': 'count'
-            }).reset_index()
+            grouped = df_moods.groupby('daily_record_id')
             
-            daily_moods.columns = [
-                'daily_record_id', 'dominant_emotion', 'avg_mood_intensity', 'mood_entries_count'
-            ]
-        
-        # Объединяем все данные
-        df_combined = df_records.copy()
-        
-        if not df_meals.empty:
-            df_combined = df_combined.merge(daily_meals, on='daily_record_id', how='left')
+            daily_aggregates.append(pd.DataFrame({
+                'dominant_emotion': _mode_by_group(df_moods['daily_record_id'], df_moods['emotion']),
+                'avg_mood_intensity': grouped['intensity'].mean(),
+                'mood_entries_count': grouped['timestamp'].count()
+            }))
         
-        if not df_activities.empty:
-            df_combined = df_combined.merge(daily_activities, on='daily_record_id', how='left')
-        
-        if not df_moods.empty:
-            df_combined = df_combined.merge(daily_moods, on='daily_record_id', how='left')
-        
-        # Заполняем пропущенные значения
-        df_combined = df_combined.fillna({
-            'sleep_duration_hours': 8.0,
-            'avg_taste_rating': 5.0,
-            'avg_health_rating': 5.0,
-            'meals_count': 3,
-            'avg_meal_hour': 12,
-            'activities_count': 0,
-            'avg_intensity': 5.0,
-            'avg_enjoyment': 5.0,
-            'total_activity_hours': 0,
-            'avg_mood_intensity': 5.0,
-            'mood_entries_count': 0
-        })
-        
-        return df_combined
+        return combine_daily_features(df_records, daily_aggregates)
     
-    def analyze_correlations(self, df: pd.DataFrame) -> Dict:
-        """Анализ корреляций между факторами и настроением"""
-        
-        # Выбираем числовые колонки для корреляционного анализа
-        numeric_columns = [
-            'sleep_quality', 'sleep_duration_hours', 'wake_up_hour',
-            'overall_mood', 'physical_wellness', 'mental_wellness',
-            'avg_taste_rating', 'avg_health_rating', 'meals_count',
-            'avg_meal_hour', 'activities_count', 'avg_intensity',
-            'avg_enjoyment', 'total_activity_hours', 'avg_mood_intensity'
-        ]
+    def analyze_correlations(self, df: Optional[pd.DataFrame] = None, user_id: Optional[int] = None) -> Dict:
+        """Анализ корреляций между факторами и настроением
+        
+        Без df берется таблица из feature_store, и результат кэшируется по ее
+        версии; для переданной таблицы ключ кэша — отпечаток ее данных.
+        Матрица возвращается компактно: список колонок и значения над
+        диагональю (корреляции, p-значения и число совместных наблюдений),
+        см. expand_correlation_matrix. Возвращается копия: изменения
+        результата вызывающим кодом не портят кэш.
+        """
+        if df is None:
+            key = ('store', getattr(self.feature_store, 'version', None), user_id)
+            if self._correlations is not None and self._correlations[0] == key:
+                return copy.deepcopy(self._correlations[1])
+            df = self.get_daily_features(user_id)
+        else:
+            key = None
         
         # Фильтруем только существующие колонки
-        available_columns = [col for col in numeric_columns if col in df.columns]
+        available_columns = [col for col in CORRELATION_COLUMNS if col in df.columns]
         
         if len(available_columns) < 2:
             return {"error": "Недостаточно данных для анализа корреляций"}
         
-        correlation_matrix = df[available_columns].corr()
+        if key is None:
+            key = ('data', data_fingerprint(df, available_columns[:-1], available_columns[-1]))
+            if self._correlations is not None and self._correlations[0] == key:
+                return copy.deepcopy(self._correlations[1])
+        
+        values = df[available_columns].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+        r, p_values, n = pairwise_correlations(values)
+        
+        def to_list(array: np.ndarray) -> List:
+            return [None if np.isnan(value) else float(value) for value in array]
         
-        # Находим корреляции с настроением
+        rows, cols = np.triu_indices(len(available_columns), k=1)
+        correlation_matrix = {
+            'columns': available_columns,
+            'upper': {
+                'correlation': to_list(r[rows, cols]),
+                'p_value': to_list(p_values[rows, cols]),
+                'sample_size': n[rows, cols].tolist()
+            },
+            'diagonal_sample_size': np.diag(n).tolist()
+        }
+        
+        # Находим корреляции с настроением (по убыванию силы связи)
         mood_correlations = {}
-        if 'overall_mood' in correlation_matrix.columns:
-            mood_corr = correlation_matrix['overall_mood'].abs().sort_values(ascending=False)
-            mood_correlations = {
-                factor: {
+        if 'overall_mood' in available_columns:
+            target = available_columns.index('overall_mood')
+            strength = np.nan_to_num(np.abs(r[:, target]), nan=-1.0)
+            for index in np.argsort(-strength, kind='stable'):
+                corr = r[index, target]
+                if index == target or np.isnan(corr):
+                    continue
+                p_value = float(p_values[index, target])
+                mood_correlations[available_columns[index]] = {
                     'correlation': float(corr),
-                    'strength': self._get_correlation_strength(corr)
+                    'strength': self._get_correlation_strength(corr),
+                    'p_value': p_value,
+                    'sample_size': int(n[index, target]),
+                    # Уровень доверия, при котором связь считается значимой
+                    'confidence_level': 1.0 - SIGNIFICANCE_LEVEL,
+                    'significant': p_value < SIGNIFICANCE_LEVEL
                 }
-                for factor, corr in mood_corr.items()
-                if factor != 'overall_mood' and not pd.isna(corr)
-            }
         
-        return {
-            'correlation_matrix': correlation_matrix.to_dict(),
-            'mood_correlations': mood_correlations
+        result = {
+            'correlation_matrix': correlation_matrix,
+            'mood_correlations': mood_correlations,
+            'sample_size': len(df)
         }
+        self._correlations = (key, result)
+        return copy.deepcopy(result)
     
     def _get_correlation_strength(self, correlation: float) -> str:
         """Определение силы корреляции"""
@@ -174,59 +417,282 @@ class DayAnalyzer:
         else:
             return "очень слабая"
     
-    def train_mood_prediction_model(self, df: pd.DataFrame) -> Dict:
-        """Обучение модели для предсказания настроения"""
-        
-        # Подготавливаем признаки
-        feature_columns = [
-            'sleep_quality', 'sleep_duration_hours', 'wake_up_hour',
-            'avg_taste_rating', 'avg_health_rating', 'meals_count',
-            'activities_count', 'avg_intensity', 'avg_enjoyment',
-            'total_activity_hours'
-        ]
+    def train_mood_prediction_model(self, df: pd.DataFrame, mode: Optional[str] = None) -> Dict:
+        """Обучение модели для предсказания настроения
+        
+        mode (по умолчанию self.training_mode):
+        'full' — случайный лес заново на всех данных;
+        'warm_start' — к прошлому лесу добавляются деревья, обученные на
+        бутстрепе всей истории вместе с новыми строками (число деревьев
+        пропорционально доле новых данных);
+        'online_linear' — линейная модель, обновляемая по достаточным
+        статистикам новых строк.
+        В инкрементальных режимах стоимость обновления пропорциональна доле
+        новых записей, а метрики считаются на новых строках до их учета. Если
+        история изменилась не только добавлением строк, модель обучается заново.
+        """
+        mode = mode or self.training_mode
+        if mode not in TRAINING_MODES:
+            raise ValueError(f"Неизвестный режим обучения: {mode}")
         
         # Фильтруем только существующие колонки
-        available_features = [col for col in feature_columns if col in df.columns]
+        available_features = [col for col in self.feature_columns if col in df.columns]
         
-        if 'overall_mood' not in df.columns or len(available_features) < 3:
+        if self.target not in df.columns or len(available_features) < 3:
             return {"error": "Недостаточно данных для обучения модели"}
         
         # Удаляем строки с пропущенными значениями
-        df_clean = df[available_features + ['overall_mood']].dropna()
+        df_clean = df[available_features + [self.target]].dropna()
         
         if len(df_clean) < 10:
             return {"error": "Недостаточно данных для обучения модели"}
         
+        use_registry = self.registry is not None and self.user_id is not None
+        params = dict(MOOD_MODEL_PARAMS, mode=mode)
+        fingerprint = data_fingerprint(df_clean, available_features, self.target, params)
+        
+        # Данные не изменились с прошлого обучения: используем сохраненную модель
+        if use_registry:
+            metadata = self.registry.find(self.user_id, fingerprint)
+            if metadata is not None:
+                if self.model_fingerprint != fingerprint:
+                    # Сама модель загрузится лениво в predict_mood
+                    self.mood_model = None
+                self.feature_importance = metadata['feature_importance']
+                self.model_metadata = metadata
+                return {
+                    'model_performance': metadata['metrics'],
+                    'feature_importance': metadata['feature_importance'],
+                    'retrained': False
+                }
+        
+        if mode == 'time_series_cv':
+            return self._train_time_series_cv(df, available_features, fingerprint, len(df_clean))
+        
+        if mode != 'full':
+            seen = self._incremental_start(df, available_features, params, mode)
+            if seen is not None:
+                result = self._update_model(df, seen, available_features, mode)
+                if result is not None:
+                    model, metrics = result
+                    return self._store_model(model, available_features, fingerprint, metrics,
+                                             len(df_clean), len(df), mode, len(df) - seen)
+        
         X = df_clean[available_features]
-        y = df_clean['overall_mood']
+        y = df_clean[self.target]
         
         # Разделяем данные
         X_train, X_test, y_train, y_test = train_test_split(
-            X, y, test_size=0.2, random_state=42
+            X, y, test_size=MOOD_MODEL_PARAMS['test_size'],
+            random_state=MOOD_MODEL_PARAMS['random_state']
         )
         
         # Обучаем модель
-        model = RandomForestRegressor(n_estimators=100, random_state=42)
-        model.fit(X_train, y_train)
+        if mode == 'online_linear':
+            model = OnlineLinearModel().fit(X_train, y_train)
+        else:
+            model = RandomForestRegressor(
+                n_estimators=MOOD_MODEL_PARAMS['n_estimators'],
+                random_state=MOOD_MODEL_PARAMS['random_state'],
+                n_jobs=self.n_jobs
+            )
+            model.fit(X_train, y_train)
+            # Предсказания по нескольким строкам быстрее в одном потоке
+            model.set_params(n_jobs=None)
         
         # Оцениваем модель
         y_pred = model.predict(X_test)
         mse = mean_squared_error(y_test, y_pred)
         r2 = r2_score(y_test, y_pred)
+        metrics = {
+            'mse': float(mse),
+            'r2_score': float(r2),
+            'rmse': float(np.sqrt(mse))
+        }
+        
+        if mode == 'online_linear':
+            # Обновление дешевое, поэтому отложенные строки тоже учитываем
+            model.partial_fit(X_test, y_test)
+        
+        return self._store_model(model, available_features, fingerprint, metrics,
+                                 len(df_clean), len(df), mode, None)
+    
+    def _train_time_series_cv(self, df: pd.DataFrame, features: List[str],
+                              fingerprint: str, training_rows: int) -> Dict:
+        """Выбор модели rolling-origin кросс-валидацией по дате
+        
+        Матрица признаков и разбиения на фолды строятся один раз и общие для
+        всех кандидатов; фолды обучаются параллельно в n_jobs потоков (по
+        умолчанию в одном, чтобы обучение в веб-сервере не занимало все ядра).
+        Победитель по среднему RMSE обучается на всех данных.
+        """
+        columns = features + [self.target]
+        if 'date' in df.columns:
+            ordered = df.sort_values('date', kind='stable')
+            clean = ordered[columns + ['date']].dropna(subset=columns)
+            dates = clean['date'].astype(str)
+        else:
+            clean = df[columns].dropna()
+            dates = None
+        X = clean[features].to_numpy(dtype=float)
+        y = clean[self.target].to_numpy(dtype=float)
+        
+        folds = time_series_folds(dates, len(clean))
+        
+        started = time.perf_counter()
+        evaluations = Parallel(n_jobs=self.n_jobs or 1, prefer='threads')(
+            delayed(_evaluate_fold)(name, fold, X, y, train_index, test_index)
+            for name in CV_CANDIDATES
+            for fold, (train_index, test_index) in enumerate(folds)
+        )
+        cv_seconds = time.perf_counter() - started
+        
+        candidates = {}
+        for name in CV_CANDIDATES:
+            runs = [run for run in evaluations if run['candidate'] == name]
+            r2_values = [run['r2_score'] for run in runs if run['r2_score'] is not None]
+            candidates[name] = {
+                'rmse': float(np.mean([run['rmse'] for run in runs])),
+                'r2_score': float(np.mean(r2_values)) if r2_values else None,
+                'folds': [{key: value for key, value in run.items() if key != 'candidate'} for run in runs]
+            }
+        winner = min(candidates, key=lambda name: candidates[name]['rmse'])
+        
+        model = CV_CANDIDATES[winner]()
+        if isinstance(model, RandomForestRegressor):
+            model.set_params(n_jobs=self.n_jobs)
+        model.fit(clean[features], clean[self.target])
+        if isinstance(model, RandomForestRegressor):
+            model.set_params(n_jobs=None)
+        
+        rmse = candidates[winner]['rmse']
+        metrics = {
+            'mse': rmse ** 2,
+            'r2_score': candidates[winner]['r2_score'],
+            'rmse': rmse
+        }
+        cv_summary = {
+            'winner': winner,
+            'splits': len(folds),
+            'seconds': round(cv_seconds, 4),
+            'candidates': candidates
+        }
+        result = self._store_model(model, features, fingerprint, metrics, training_rows,
+                                   len(df), 'time_series_cv', None,
+                                   feature_importances=_linear_importances(model, X)
+                                   if not hasattr(model, 'feature_importances_') else None,
+                                   extra={'cv': cv_summary})
+        result['cv'] = cv_summary
+        return result
+    
+    def _incremental_start(self, df: pd.DataFrame, features: List[str], params: Dict,
+                           mode: str) -> Optional[int]:
+        """Сколько строк df уже учтено прошлой моделью (None — нужна полная переобучка)"""
+        if self.mood_model is None:
+            self._load_registered_model()
+        metadata = self.model_metadata
+        if self.mood_model is None or metadata is None:
+            return None
+        if (metadata.get('mode') != mode or metadata.get('features') != features
+                or metadata.get('target') != self.target):
+            return None
+        
+        seen = metadata.get('rows_seen')
+        if seen is None or seen > len(df):
+            return None
+        # История должна совпадать с той, на которой обучалась модель
+        history = df.iloc[:seen][features + [self.target]].dropna()
+        if data_fingerprint(history, features, self.target, params) != metadata.get('fingerprint'):
+            return None
+        return seen
+    
+    def _update_model(self, df: pd.DataFrame, seen: int, features: List[str], mode: str):
+        """Дообучает текущую модель строками df после seen; None — нужна полная переобучка
+        
+        Новые деревья леса обучаются на всей истории, а не только на новых
+        строках: иначе после одной-двух записей в лес попадали бы вырожденные
+        деревья, голосующие наравне со старыми.
+        """
+        new_rows = df.iloc[seen:][features + [self.target]].dropna()
+        # Копия: текущая модель может одновременно использоваться для предсказаний
+        model = copy.deepcopy(self.mood_model)
+        metrics = self.model_metadata['metrics']
+        if new_rows.empty:
+            return model, metrics
+        
+        X_new = new_rows[features]
+        y_new = new_rows[self.target]
+        
+        if mode == 'warm_start':
+            total_rows = self.model_metadata['training_rows'] + len(new_rows)
+            added_trees = max(1, round(MOOD_MODEL_PARAMS['n_estimators'] * len(new_rows) / total_rows))
+            if model.n_estimators + added_trees > WARM_START_MAX_TREES:
+                # Лес разросся: дешевле и точнее обучить его заново
+                return None
+        
+        # Метрики на новых строках до их учета (модель их еще не видела)
+        if len(new_rows) >= 2:
+            y_pred = model.predict(X_new)
+            mse = mean_squared_error(y_new, y_pred)
+            metrics = {
+                'mse': float(mse),
+                'r2_score': float(r2_score(y_new, y_pred)),
+                'rmse': float(np.sqrt(mse))
+            }
         
+        if mode == 'warm_start':
+            history = df[features + [self.target]].dropna()
+            model.set_params(warm_start=True, n_estimators=model.n_estimators + added_trees,
+                             n_jobs=self.n_jobs)
+            model.fit(history[features], history[self.target])
+            model.set_params(warm_start=False, n_jobs=None)
+        else:
+            model.partial_fit(X_new, y_new)
+        return model, metrics
+    
+    def _store_model(self, model, features: List[str], fingerprint: str, metrics: Dict,
+                     training_rows: int, rows_seen: int, mode: str,
+                     new_records: Optional[int], feature_importances=None,
+                     extra: Optional[Dict] = None) -> Dict:
+        """Запоминает обученную модель и сохраняет ее в реестр"""
         # Важность признаков
-        feature_importance = dict(zip(available_features, model.feature_importances_))
+        if feature_importances is None:
+            feature_importances = model.feature_importances_
+        feature_importance = {
+            feature: float(importance)
+            for feature, importance in zip(features, feature_importances)
+        }
+        metadata = {
+            'features': features,
+            'target': self.target,
+            'fingerprint': fingerprint,
+            'metrics': metrics,
+            'feature_importance': feature_importance,
+            'training_rows': training_rows,
+            'rows_seen': rows_seen,
+            'mode': mode,
+            'model_type': type(model).__name__,
+            **(extra or {})
+        }
         
         self.mood_model = model
         self.feature_importance = feature_importance
+        self.model_fingerprint = fingerprint
+        self.model_metadata = metadata
+        
+        if self.registry is not None and self.user_id is not None:
+            try:
+                self.registry.save(self.user_id, model, metadata)
+            except Exception as e:
+                print(f"Ошибка сохранения модели: {e}")
         
         return {
-            'model_performance': {
-                'mse': float(mse),
-                'r2_score': float(r2),
-                'rmse': float(np.sqrt(mse))
-            },
-            'feature_importance': feature_importance
+            'model_performance': metrics,
+            'feature_importance': feature_importance,
+            'retrained': True,
+            'mode': mode,
+            'incremental': new_records is not None,
+            'new_records': new_records if new_records is not None else training_rows
         }
     
     def generate_recommendations(self, df: pd.DataFrame, user_id: int = 1) -> List[Dict]:
@@ -309,16 +775,83 @@ class DayAnalyzer:
     def predict_mood(self, features: Dict) -> Optional[float]:
         """Предсказание настроения на основе факторов"""
         
-        if self.mood_model is None:
+        predictions = self.predict_mood_batch(pd.DataFrame([features]))
+        if predictions is None:
+            return None
+        return float(predictions[0])
+    
+    def predict_mood_batch(self, features) -> Optional[np.ndarray]:
+        """Предсказание настроения для многих строк одним вызовом модели
+        
+        features — DataFrame (недостающие признаки и пропуски заполняются
+        значением по умолчанию) или двумерный массив с колонками в порядке
+        признаков модели (model_features()).
+        """
+        if self.mood_model is None and not self._load_registered_model():
             return None
         
-        # Подготавливаем признаки
-        feature_names = list(self.feature_importance.keys())
-        feature_values = []
-        
-        for feature in feature_names:
-            feature_values.append(features.get(feature, 5.0))  # Значение по умолчанию
+        feature_names = self.model_features()
+        if isinstance(features, pd.DataFrame):
+            X = features.reindex(columns=feature_names)
+            X = X.apply(pd.to_numeric, errors='coerce').fillna(DEFAULT_FEATURE_VALUE)
+        else:
+            values = np.asarray(features, dtype=float)
+            if values.ndim != 2 or values.shape[1] != len(feature_names):
+                raise ValueError(
+                    f"Ожидается массив формы (n, {len(feature_names)}) с признаками {feature_names}"
+                )
+            X = pd.DataFrame(values, columns=feature_names)
+        
+        if X.empty:
+            return np.empty(0)
+        return self.mood_model.predict(X)
+    
+    def what_if_grid(self, base_features: Dict, grid: Dict[str, List]) -> Optional[pd.DataFrame]:
+        """Предсказания для всех сочетаний значений выбранных признаков
+        
+        base_features задает остальные признаки, grid — перебираемые значения,
+        например {'sleep_duration_hours': [6, 7, 8, 9]}. Все сценарии
+        оцениваются одним вызовом predict_mood_batch.
+        """
+        if not grid:
+            raise ValueError("Не заданы признаки для перебора")
+        
+        index = pd.MultiIndex.from_product(list(grid.values()), names=list(grid.keys()))
+        scenarios = index.to_frame(index=False)
+        for feature, value in base_features.items():
+            if feature not in grid:
+                scenarios[feature] = value
+        
+        predictions = self.predict_mood_batch(scenarios)
+        if predictions is None:
+            return None
         
-        # Делаем предсказание
-        prediction = self.mood_model.predict([feature_values])[0]
-        return float(prediction)
+        result = scenarios[list(grid.keys())].copy()
+        result['predicted_mood'] = predictions
+        return result
+    
+    def has_model(self) -> bool:
+        """Есть ли обученная модель (в памяти или в реестре)"""
+        return self.mood_model is not None or self._load_registered_model()
+    
+    def model_features(self) -> List[str]:
+        """Признаки обученной модели в порядке обучения"""
+        return list(self.feature_importance.keys()) if self.feature_importance else []
+    
+    def _load_registered_model(self) -> bool:
+        """Загружает сохраненную модель пользователя из реестра"""
+        if self.registry is None or self.user_id is None:
+            return False
+        
+        entry = self.registry.load(self.user_id)
+        if entry is None:
+            return False
+        
+        self.mood_model = entry['model']
+        self.model_metadata = {key: value for key, value in entry.items() if key != 'model'}
+        # Порядок признаков — как при обучении
+        self.feature_importance = {
+            feature: entry['feature_importance'][feature] for feature in entry['features']
+        }
+        self.model_fingerprint = entry['fingerprint']
+        return True
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк DayAnalyzer.prepare_data на синтетических данных
+
+Генерирует записи дня и по --rows приемов пищи, активностей и отметок
+настроения, затем замеряет время подготовки признаков и пропускную
+способность (строк в секунду):
+
+    python benchmark_prepare_data.py --rows 1000000 --days 50000
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from analyzer import DayAnalyzer
+
+def make_data(rows: int, days: int, seed: int = 42) -> tuple:
+    """Случайные записи дня, приемы пищи, активности и настроение"""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2024-01-01")
+    day_start = start + pd.to_timedelta(np.arange(days), unit="D")
+
+    wake_up = day_start + pd.to_timedelta(rng.integers(5 * 60, 10 * 60, days), unit="min")
+    daily_records = pd.DataFrame({
+        "daily_record_id": np.arange(days),
+        "date": day_start.strftime("%Y-%m-%d"),
+        "wake_up_time": wake_up.strftime("%Y-%m-%d %H:%M:%S"),
+        "sleep_time": (wake_up + pd.to_timedelta(rng.integers(14 * 60, 18 * 60, days), unit="min"))
+            .strftime("%Y-%m-%d %H:%M:%S"),
+        "sleep_quality": rng.integers(1, 11, days),
+        "overall_mood": rng.integers(1, 11, days),
+        "physical_wellness": rng.integers(1, 11, days),
+        "mental_wellness": rng.integers(1, 11, days),
+    }).to_dict("records")
+
+    def timestamps(ids: np.ndarray) -> pd.DatetimeIndex:
+        return day_start[ids] + pd.to_timedelta(rng.integers(6 * 60, 23 * 60, len(ids)), unit="min")
+
+    ids = rng.integers(0, days, rows)
+    meals = pd.DataFrame({
+        "daily_record_id": ids,
+        "meal_time": timestamps(ids).strftime("%Y-%m-%d %H:%M:%S"),
+        "portion_size": rng.choice(["small", "medium", "large"], rows),
+        "taste_rating": rng.integers(1, 11, rows),
+        "health_rating": rng.integers(1, 11, rows),
+    }).to_dict("records")
+
+    ids = rng.integers(0, days, rows)
+    activity_start = timestamps(ids)
+    activities = pd.DataFrame({
+        "daily_record_id": ids,
+        "activity_type": rng.choice(["sport", "walk", "social", "work", "hobby"], rows),
+        "start_time": activity_start.strftime("%Y-%m-%d %H:%M:%S"),
+        "end_time": (activity_start + pd.to_timedelta(rng.integers(10, 180, rows), unit="min"))
+            .strftime("%Y-%m-%d %H:%M:%S"),
+        "intensity": rng.integers(1, 11, rows),
+        "enjoyment_rating": rng.integers(1, 11, rows),
+    }).to_dict("records")
+
+    ids = rng.integers(0, days, rows)
+    mood_trackings = pd.DataFrame({
+        "daily_record_id": ids,
+        "timestamp": timestamps(ids).strftime("%Y-%m-%d %H:%M:%S"),
+        "emotion": rng.choice(["joy", "sadness", "anger", "calm", "anxiety", "excitement"], rows),
+        "intensity": rng.integers(1, 11, rows),
+    }).to_dict("records")
+
+    return daily_records, meals, activities, mood_trackings
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк подготовки признаков")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Строк в каждой из таблиц meals/activities/moods")
+    parser.add_argument("--days", type=int, default=50_000, help="Записей дня")
+    parser.add_argument("--repeat", type=int, default=3, help="Число замеров")
+    args = parser.parse_args()
+
+    print(f"📦 Генерация данных: {args.days} дней, по {args.rows} строк в таблицах...")
+    data = make_data(args.rows, args.days)
+
+    analyzer = DayAnalyzer()
+    total_rows = args.days + 3 * args.rows
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        df = analyzer.prepare_data(*data)
+        timings.append(time.perf_counter() - started)
+
+    best = min(timings)
+    print(f"\n✅ Результат: {df.shape[0]} строк × {df.shape[1]} колонок")
+    print(f"⏱️ Лучшее время: {best:.2f} с (все замеры: {', '.join(f'{t:.2f}' for t in timings)})")
+    print(f"🚀 Пропускная способность: {total_rows / best:,.0f} строк/с")
+
+if __name__ == "__main__":
+    main()
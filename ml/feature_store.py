@@ -0,0 +1,285 @@
+"""
+Материализованная таблица дневных признаков для DayAnalyzer.
+
+DailyFeatureStore хранит для каждого daily_record_id накопленные суммы и
+счетчики по приемам пищи, активностям и отметкам настроения. Новое событие
+обновляет только агрегаты своего дня, поэтому анализ и обучение читают
+готовую таблицу вместо повторной агрегации всей истории. to_frame()
+возвращает ту же таблицу, что и DayAnalyzer.prepare_data по тем же данным.
+
+bind_to_models подписывает хранилище на вставки Meal, Activity, MoodTracking
+и DailyRecord из backend/models.py: события копятся в сессии и применяются
+после commit (при rollback отбрасываются).
+"""
+
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from analyzer import combine_daily_features, prepare_daily_records
+
+def _number(value) -> Optional[float]:
+    """Числовое значение или None для пропуска"""
+    if value is None:
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if np.isnan(number) else number
+
+def _timestamp(value) -> Optional[pd.Timestamp]:
+    """Момент времени или None для пропуска"""
+    if value is None:
+        return None
+    timestamp = pd.Timestamp(value)
+    return None if pd.isna(timestamp) else timestamp
+
+def _is_missing(value) -> bool:
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+class _Mean:
+    """Сумма и число заполненных значений"""
+    __slots__ = ("total", "count")
+
+    def __init__(self):
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, value):
+        number = _number(value)
+        if number is not None:
+            self.total += number
+            self.count += 1
+
+    def value(self) -> float:
+        return self.total / self.count if self.count else np.nan
+
+class _Mode:
+    """Частоты значений; при равенстве выигрывает встретившееся раньше"""
+    __slots__ = ("counts",)
+
+    def __init__(self):
+        self.counts: Dict[str, int] = {}
+
+    def add(self, value):
+        if not _is_missing(value):
+            self.counts[value] = self.counts.get(value, 0) + 1
+
+    def value(self):
+        best, best_count = np.nan, 0
+        for value, count in self.counts.items():
+            if count > best_count:
+                best, best_count = value, count
+        return best
+
+class _DayMeals:
+    __slots__ = ("taste", "health", "hour", "portion")
+
+    def __init__(self):
+        self.taste, self.health, self.hour = _Mean(), _Mean(), _Mean()
+        self.portion = _Mode()
+
+class _DayActivities:
+    __slots__ = ("count", "intensity", "enjoyment", "hours")
+
+    def __init__(self):
+        self.count = 0
+        self.intensity, self.enjoyment = _Mean(), _Mean()
+        self.hours = 0.0
+
+class _DayMoods:
+    __slots__ = ("emotion", "intensity", "count")
+
+    def __init__(self):
+        self.emotion = _Mode()
+        self.intensity = _Mean()
+        self.count = 0
+
+class DailyFeatureStore:
+    """Инкрементально обновляемая таблица признаков по дням"""
+
+    def __init__(self):
+        self.version = 0
+        self._lock = threading.RLock()
+        self._records: Dict[int, Dict] = {}
+        self._meals: Dict[int, _DayMeals] = {}
+        self._activities: Dict[int, _DayActivities] = {}
+        self._moods: Dict[int, _DayMoods] = {}
+        # Были ли события каждого вида (как непустые таблицы в prepare_data)
+        self._has_meals = False
+        self._has_activities = False
+        self._has_moods = False
+        self._frame: Optional[pd.DataFrame] = None
+        self._frame_version = -1
+
+    def _changed(self):
+        self.version += 1
+
+    def add_daily_record(self, record: Dict):
+        """Добавляет или обновляет запись дня (ключ — daily_record_id)"""
+        with self._lock:
+            self._records[record["daily_record_id"]] = dict(record)
+            self._changed()
+
+    def add_meal(self, meal: Dict):
+        """Учитывает прием пищи в агрегатах его дня"""
+        day_id = meal.get("daily_record_id")
+        with self._lock:
+            self._has_meals = True
+            if day_id is not None:
+                day = self._meals.get(day_id)
+                if day is None:
+                    day = self._meals[day_id] = _DayMeals()
+                day.taste.add(meal.get("taste_rating"))
+                day.health.add(meal.get("health_rating"))
+                meal_time = _timestamp(meal.get("meal_time"))
+                if meal_time is not None:
+                    day.hour.add(meal_time.hour)
+                day.portion.add(meal.get("portion_size"))
+            self._changed()
+
+    def add_activity(self, activity: Dict):
+        """Учитывает активность в агрегатах ее дня"""
+        day_id = activity.get("daily_record_id")
+        with self._lock:
+            self._has_activities = True
+            if day_id is not None:
+                day = self._activities.get(day_id)
+                if day is None:
+                    day = self._activities[day_id] = _DayActivities()
+                if not _is_missing(activity.get("activity_type")):
+                    day.count += 1
+                day.intensity.add(activity.get("intensity"))
+                day.enjoyment.add(activity.get("enjoyment_rating"))
+                start_time = _timestamp(activity.get("start_time"))
+                end_time = _timestamp(activity.get("end_time"))
+                if start_time is not None and end_time is not None:
+                    day.hours += (end_time - start_time).total_seconds() / 3600
+            self._changed()
+
+    def add_mood(self, mood: Dict):
+        """Учитывает отметку настроения в агрегатах ее дня"""
+        day_id = mood.get("daily_record_id")
+        with self._lock:
+            self._has_moods = True
+            if day_id is not None:
+                day = self._moods.get(day_id)
+                if day is None:
+                    day = self._moods[day_id] = _DayMoods()
+                day.emotion.add(mood.get("emotion"))
+                day.intensity.add(mood.get("intensity"))
+                if not _is_missing(mood.get("timestamp")):
+                    day.count += 1
+            self._changed()
+
+    def load(self, daily_records: Iterable[Dict] = (), meals: Iterable[Dict] = (),
+             activities: Iterable[Dict] = (), mood_trackings: Iterable[Dict] = ()):
+        """Заполняет хранилище существующей историей"""
+        with self._lock:
+            for record in daily_records:
+                self.add_daily_record(record)
+            for meal in meals:
+                self.add_meal(meal)
+            for activity in activities:
+                self.add_activity(activity)
+            for mood in mood_trackings:
+                self.add_mood(mood)
+
+    def _aggregates(self) -> List[pd.DataFrame]:
+        """Дневные агрегаты в формате groupby из prepare_data"""
+        aggregates = []
+
+        if self._has_meals:
+            days = self._meals
+            aggregates.append(pd.DataFrame({
+                "avg_taste_rating": [day.taste.value() for day in days.values()],
+                "avg_health_rating": [day.health.value() for day in days.values()],
+                "meals_count": np.array([day.hour.count for day in days.values()], dtype=np.int64),
+                "avg_meal_hour": [day.hour.value() for day in days.values()],
+                "most_common_portion": [day.portion.value() for day in days.values()]
+            }, index=pd.Index(list(days.keys()), name="daily_record_id")))
+
+        if self._has_activities:
+            days = self._activities
+            aggregates.append(pd.DataFrame({
+                "activities_count": np.array([day.count for day in days.values()], dtype=np.int64),
+                "avg_intensity": [day.intensity.value() for day in days.values()],
+                "avg_enjoyment": [day.enjoyment.value() for day in days.values()],
+                "total_activity_hours": np.array([day.hours for day in days.values()], dtype=float)
+            }, index=pd.Index(list(days.keys()), name="daily_record_id")))
+
+        if self._has_moods:
+            days = self._moods
+            aggregates.append(pd.DataFrame({
+                "dominant_emotion": [day.emotion.value() for day in days.values()],
+                "avg_mood_intensity": [day.intensity.value() for day in days.values()],
+                "mood_entries_count": np.array([day.count for day in days.values()], dtype=np.int64)
+            }, index=pd.Index(list(days.keys()), name="daily_record_id")))
+
+        return aggregates
+
+    def to_frame(self, user_id: Optional[int] = None) -> pd.DataFrame:
+        """Таблица признаков по дням (пересобирается только после изменений)"""
+        with self._lock:
+            if self._frame is None or self._frame_version != self.version:
+                df_records = prepare_daily_records(pd.DataFrame(list(self._records.values())))
+                self._frame = combine_daily_features(df_records, self._aggregates())
+                self._frame_version = self.version
+            frame = self._frame
+
+        if user_id is not None and "user_id" in frame.columns:
+            frame = frame[frame["user_id"] == user_id]
+        return frame.copy()
+
+def _row(target) -> Dict:
+    """Значения колонок ORM-объекта"""
+    from sqlalchemy import inspect
+
+    return {attr.key: getattr(target, attr.key) for attr in inspect(target).mapper.column_attrs}
+
+def bind_to_models(store: DailyFeatureStore):
+    """Обновляет store при сохранении Meal, Activity, MoodTracking и DailyRecord
+
+    Модули backend (models.py) должны быть доступны в sys.path.
+    """
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session, object_session
+
+    from models import Activity, DailyRecord, Meal, MoodTracking
+
+    pending_key = "daily_feature_events"
+
+    def daily_record_row(target) -> Dict:
+        row = _row(target)
+        row["daily_record_id"] = target.id
+        return row
+
+    handlers = [
+        (DailyRecord, daily_record_row, store.add_daily_record),
+        (Meal, _row, store.add_meal),
+        (Activity, _row, store.add_activity),
+        (MoodTracking, _row, store.add_mood),
+    ]
+
+    def remember(to_row, apply):
+        def listener(mapper, connection, target):
+            session = object_session(target)
+            # Снимок значений берется сразу: после commit объект может истечь
+            session.info.setdefault(pending_key, []).append((apply, to_row(target)))
+        return listener
+
+    for model, to_row, apply in handlers:
+        event.listen(model, "after_insert", remember(to_row, apply))
+    event.listen(DailyRecord, "after_update", remember(daily_record_row, store.add_daily_record))
+
+    @event.listens_for(Session, "after_commit")
+    def apply_pending(session):
+        for apply, row in session.info.pop(pending_key, []):
+            apply(row)
+
+    @event.listens_for(Session, "after_rollback")
+    def drop_pending(session):
+        session.info.pop(pending_key, None)
@@ -0,0 +1,137 @@
+"""
+Реестр обученных моделей настроения по пользователям.
+
+Для каждого пользователя на диске хранятся два файла:
+<user_id>.json с метаданными (признаки, цель, отпечаток обучающих данных,
+метрики, важность признаков) и <user_id>.joblib с самой моделью. Метаданные
+читаются без десериализации модели, поэтому проверка «нужно ли переобучать»
+почти бесплатна, а модель загружается только при первом предсказании.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+try:
+    import joblib
+except ImportError:  # joblib ставится вместе с scikit-learn, но на всякий случай
+    joblib = None
+    import pickle
+
+# atomic_write берется из ../backend/file_lock.py
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+if BACKEND_DIR not in sys.path:
+    sys.path.append(BACKEND_DIR)
+
+from file_lock import atomic_write
+
+# Каталог с моделями по умолчанию
+MODELS_DIR = os.getenv("MODELS_DIR", "models")
+
+def data_fingerprint(df: pd.DataFrame, features: List[str], target: str, params: Optional[Dict] = None) -> str:
+    """Отпечаток обучающих данных и параметров модели"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps({"features": features, "target": target, "params": params or {}},
+                             sort_keys=True, default=str).encode("utf-8"))
+    columns = df[features + [target]]
+    digest.update(pd.util.hash_pandas_object(columns, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+class ModelRegistry:
+    """Сохранение и ленивая загрузка моделей пользователей"""
+
+    def __init__(self, models_dir: str = MODELS_DIR):
+        self.models_dir = models_dir
+        self._lock = threading.RLock()
+        # user_id -> (mtime файла модели, запись с загруженной моделью)
+        self._loaded: Dict[str, tuple] = {}
+
+    def _key(self, user_id) -> str:
+        return re.sub(r"[^A-Za-z0-9_.-]", "_", str(user_id))
+
+    def _meta_path(self, user_id) -> str:
+        return os.path.join(self.models_dir, f"{self._key(user_id)}.json")
+
+    def _model_path(self, user_id) -> str:
+        return os.path.join(self.models_dir, f"{self._key(user_id)}.joblib")
+
+    def get_metadata(self, user_id) -> Optional[Dict]:
+        """Метаданные модели пользователя (без загрузки модели)"""
+        try:
+            with open(self._meta_path(user_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Ошибка чтения метаданных модели {user_id}: {e}")
+            return None
+
+    def find(self, user_id, fingerprint: str) -> Optional[Dict]:
+        """Метаданные модели, обученной на данных с таким отпечатком (или None)"""
+        metadata = self.get_metadata(user_id)
+        if metadata is None or metadata.get("fingerprint") != fingerprint:
+            return None
+        if not os.path.exists(self._model_path(user_id)):
+            return None
+        return metadata
+
+    def save(self, user_id, model, metadata: Dict) -> Dict:
+        """Сохраняет модель и ее метаданные"""
+        metadata = dict(metadata, trained_at=datetime.now().isoformat())
+        with self._lock:
+            os.makedirs(self.models_dir, exist_ok=True)
+            with atomic_write(self._model_path(user_id), "wb") as f:
+                if joblib is not None:
+                    joblib.dump(model, f)
+                else:
+                    pickle.dump(model, f)
+            # Метаданные пишутся последними: по ним определяется готовность модели
+            with atomic_write(self._meta_path(user_id)) as f:
+                json.dump(metadata, f, ensure_ascii=False, indent=2)
+            self._loaded[self._key(user_id)] = (os.stat(self._model_path(user_id)).st_mtime_ns,
+                                                dict(metadata, model=model))
+        return metadata
+
+    def load(self, user_id) -> Optional[Dict]:
+        """Метаданные вместе с моделью (модель кэшируется до изменения файла)"""
+        key = self._key(user_id)
+        path = self._model_path(user_id)
+        with self._lock:
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                self._loaded.pop(key, None)
+                return None
+
+            cached = self._loaded.get(key)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+
+            metadata = self.get_metadata(user_id)
+            if metadata is None:
+                return None
+            try:
+                with open(path, "rb") as f:
+                    model = joblib.load(f) if joblib is not None else pickle.load(f)
+            except Exception as e:
+                print(f"Ошибка загрузки модели {user_id}: {e}")
+                return None
+
+            entry = dict(metadata, model=model)
+            self._loaded[key] = (mtime, entry)
+            return entry
+
+    def delete(self, user_id):
+        """Удаляет модель пользователя"""
+        with self._lock:
+            self._loaded.pop(self._key(user_id), None)
+            for path in (self._meta_path(user_id), self._model_path(user_id)):
+                if os.path.exists(path):
+                    os.remove(path)
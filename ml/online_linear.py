@@ -0,0 +1,93 @@
+"""
+Линейная регрессия, обновляемая по достаточным статистикам.
+
+Модель хранит XᵀX, Xᵀy, yᵀy и число строк (с колонкой единиц для свободного
+члена), поэтому partial_fit на новых строках стоит O(новых строк · признаков²)
+и не требует истории. Коэффициенты — решение нормальных уравнений с
+небольшой гребневой регуляризацией, как у LinearRegression на всех данных.
+"""
+
+from typing import Dict, Optional
+
+import numpy as np
+
+class OnlineLinearModel:
+    """Онлайн-аналог sklearn LinearRegression (fit / partial_fit / predict)"""
+
+    def __init__(self, ridge: float = 1e-6):
+        self.ridge = ridge
+        self.n_features: Optional[int] = None
+        self.n_samples = 0
+        self.xtx: Optional[np.ndarray] = None
+        self.xty: Optional[np.ndarray] = None
+        self.yty = 0.0
+        self.y_sum = 0.0
+        self.coef_: Optional[np.ndarray] = None
+        self.intercept_ = 0.0
+
+    def _design(self, X) -> np.ndarray:
+        X = np.asarray(X, dtype=float)
+        return np.hstack([np.ones((X.shape[0], 1)), X])
+
+    def fit(self, X, y) -> "OnlineLinearModel":
+        """Обучение с нуля"""
+        self.n_features = None
+        return self.partial_fit(X, y)
+
+    def partial_fit(self, X, y) -> "OnlineLinearModel":
+        """Учитывает новые строки в статистиках и пересчитывает коэффициенты"""
+        A = self._design(X)
+        y = np.asarray(y, dtype=float)
+        if self.n_features is None:
+            self.n_features = A.shape[1] - 1
+            self.n_samples = 0
+            self.xtx = np.zeros((A.shape[1], A.shape[1]))
+            self.xty = np.zeros(A.shape[1])
+            self.yty = 0.0
+            self.y_sum = 0.0
+        elif A.shape[1] - 1 != self.n_features:
+            raise ValueError(f"Ожидается {self.n_features} признаков, получено {A.shape[1] - 1}")
+
+        self.xtx += A.T @ A
+        self.xty += A.T @ y
+        self.yty += float(y @ y)
+        self.y_sum += float(y.sum())
+        self.n_samples += len(y)
+        self._solve()
+        return self
+
+    def _solve(self):
+        # Свободный член не регуляризуем
+        penalty = self.ridge * np.eye(self.xtx.shape[0])
+        penalty[0, 0] = 0.0
+        try:
+            beta = np.linalg.solve(self.xtx + penalty, self.xty)
+        except np.linalg.LinAlgError:
+            beta = np.linalg.lstsq(self.xtx + penalty, self.xty, rcond=None)[0]
+        self.intercept_ = float(beta[0])
+        self.coef_ = beta[1:]
+
+    def predict(self, X) -> np.ndarray:
+        return np.asarray(X, dtype=float) @ self.coef_ + self.intercept_
+
+    def training_metrics(self) -> Dict:
+        """MSE и R² на всех учтенных строках (из статистик, без данных)"""
+        beta = np.concatenate([[self.intercept_], self.coef_])
+        sse = max(self.yty - 2 * beta @ self.xty + beta @ self.xtx @ beta, 0.0)
+        sst = self.yty - self.y_sum ** 2 / self.n_samples
+        mse = sse / self.n_samples
+        return {
+            "mse": float(mse),
+            "r2_score": float(1 - sse / sst) if sst > 0 else 0.0,
+            "rmse": float(np.sqrt(mse))
+        }
+
+    @property
+    def feature_importances_(self) -> np.ndarray:
+        """Доли |коэффициент| × стандартное отклонение признака"""
+        n = self.n_samples
+        means = self.xtx[0, 1:] / n
+        variances = np.maximum(np.diag(self.xtx)[1:] / n - means ** 2, 0.0)
+        weights = np.abs(self.coef_) * np.sqrt(variances)
+        total = weights.sum()
+        return weights / total if total > 0 else np.full(len(weights), 1.0 / len(weights))
@@ -0,0 +1,211 @@
+"""
+Общая (популяционная) модель оценки дня с калибровкой по пользователям.
+
+Один случайный лес обучается на объединенных таблицах признаков всех
+пользователей, а поверх него для каждого пользователя хранится только сдвиг —
+средний остаток модели на его днях, стянутый к нулю:
+
+    offset = sum(y - prediction) / (n + CALIBRATION_PRIOR_ROWS)
+
+Пока записей мало, пользователь получает почти чистое популяционное
+предсказание, с ростом истории сдвиг приближается к его среднему отклонению.
+Для пользователей из обучающей выборки остатки берутся по out-of-bag
+предсказаниям леса, для новых — по обычным предсказаниям, поэтому калибровка
+нового пользователя стоит одного predict по его строкам и не требует обучения.
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_squared_error, r2_score
+
+from analyzer import DEFAULT_FEATURE_VALUE, MOOD_FEATURE_COLUMNS, MOOD_MODEL_PARAMS, MOOD_TARGET, DayAnalyzer
+from model_registry import ModelRegistry, data_fingerprint
+
+# Идентификатор общей модели в ModelRegistry
+POPULATION_MODEL_ID = "__population__"
+# Сила стягивания сдвига к нулю (в «виртуальных» днях без отклонения)
+CALIBRATION_PRIOR_ROWS = 10
+# Минимум строк для обучения общей модели
+MIN_POPULATION_ROWS = 10
+
+class CalibratedModel:
+    """Общая модель со сдвигом пользователя (интерфейс регрессора sklearn)"""
+
+    def __init__(self, base, offset: float = 0.0):
+        self.base = base
+        self.offset = offset
+
+    def predict(self, X) -> np.ndarray:
+        return self.base.predict(X) + self.offset
+
+    @property
+    def feature_importances_(self) -> np.ndarray:
+        return self.base.feature_importances_
+
+def shrunk_offset(residuals: np.ndarray, prior_rows: int = CALIBRATION_PRIOR_ROWS) -> float:
+    """Средний остаток, стянутый к нулю пропорционально нехватке данных"""
+    return float(np.sum(residuals) / (len(residuals) + prior_rows))
+
+class PopulationModel:
+    """Обучение общей модели и калибровка пользователей"""
+
+    def __init__(self, registry: Optional[ModelRegistry] = None,
+                 feature_columns: Optional[List[str]] = None,
+                 target: str = MOOD_TARGET, n_jobs: Optional[int] = None):
+        self.registry = registry or ModelRegistry()
+        self.feature_columns = list(feature_columns or MOOD_FEATURE_COLUMNS)
+        self.target = target
+        self.n_jobs = n_jobs
+
+    def train(self, frames: Dict[str, pd.DataFrame]) -> Dict:
+        """Обучает общую модель на таблицах признаков пользователей (user_id -> DataFrame)
+
+        Если данные не изменились с прошлого обучения, сохраненная модель
+        переиспользуется.
+        """
+        features = [
+            col for col in self.feature_columns
+            if any(col in df.columns for df in frames.values())
+        ]
+        if len(features) < 3:
+            return {"error": "Недостаточно данных для обучения модели"}
+
+        parts = []
+        for user_id, df in frames.items():
+            if self.target not in df.columns:
+                continue
+            part = df.reindex(columns=features + [self.target])
+            part = part.apply(pd.to_numeric, errors="coerce").dropna()
+            if len(part):
+                parts.append(part.assign(_user_id=str(user_id)))
+        if not parts:
+            return {"error": "Недостаточно данных для обучения модели"}
+        combined = pd.concat(parts, ignore_index=True)
+        if len(combined) < MIN_POPULATION_ROWS:
+            return {"error": "Недостаточно данных для обучения модели"}
+
+        params = dict(MOOD_MODEL_PARAMS, population=True, prior_rows=CALIBRATION_PRIOR_ROWS)
+        fingerprint = data_fingerprint(combined, features + ["_user_id"], self.target, params)
+        metadata = self.registry.find(POPULATION_MODEL_ID, fingerprint)
+        if metadata is not None:
+            return {
+                "model_performance": metadata["metrics"],
+                "feature_importance": metadata["feature_importance"],
+                "users": len(metadata["calibration"]),
+                "retrained": False
+            }
+
+        X = combined[features].to_numpy(dtype=float)
+        y = combined[self.target].to_numpy(dtype=float)
+        model = RandomForestRegressor(
+            n_estimators=MOOD_MODEL_PARAMS["n_estimators"],
+            random_state=MOOD_MODEL_PARAMS["random_state"],
+            oob_score=True,
+            n_jobs=self.n_jobs
+        )
+        model.fit(pd.DataFrame(X, columns=features), y)
+        model.set_params(n_jobs=None)
+
+        # Out-of-bag предсказания: строки, не попавшие в бутстреп дерева,
+        # дают честную оценку и метрик, и остатков для калибровки
+        oob = model.oob_prediction_
+        scored = ~np.isnan(oob)
+        mse = mean_squared_error(y[scored], oob[scored])
+        metrics = {
+            "mse": float(mse),
+            "r2_score": float(r2_score(y[scored], oob[scored])),
+            "rmse": float(np.sqrt(mse))
+        }
+
+        residuals = pd.Series(np.where(scored, y - oob, 0.0))
+        counts = combined["_user_id"].value_counts()
+        sums = residuals.groupby(combined["_user_id"].to_numpy()).sum()
+        calibration = {
+            user_id: {
+                "offset": float(sums[user_id] / (counts[user_id] + CALIBRATION_PRIOR_ROWS)),
+                "rows": int(counts[user_id])
+            }
+            for user_id in counts.index
+        }
+
+        feature_importance = {
+            feature: float(importance) for feature, importance in zip(features, model.feature_importances_)
+        }
+        metadata = {
+            "features": features,
+            "target": self.target,
+            "fingerprint": fingerprint,
+            "metrics": metrics,
+            "feature_importance": feature_importance,
+            "training_rows": len(combined),
+            "rows_seen": len(combined),
+            "mode": "population",
+            "model_type": type(model).__name__,
+            "prior_rows": CALIBRATION_PRIOR_ROWS,
+            "calibration": calibration
+        }
+        self.registry.save(POPULATION_MODEL_ID, model, metadata)
+
+        return {
+            "model_performance": metrics,
+            "feature_importance": feature_importance,
+            "users": len(calibration),
+            "retrained": True
+        }
+
+    def is_trained(self) -> bool:
+        """Сохранена ли общая модель"""
+        return self.registry.get_metadata(POPULATION_MODEL_ID) is not None
+
+    def calibrate(self, user_id, df=None) -> Optional[Dict]:
+        """Сдвиг пользователя: сохраненный при обучении или по его текущим строкам
+
+        df — таблица пользователя или функция, которая ее загружает (вызывается,
+        только если сдвиг не сохранен при обучении).
+        """
+        entry = self.registry.load(POPULATION_MODEL_ID)
+        if entry is None:
+            return None
+
+        stored = entry["calibration"].get(str(user_id))
+        if stored is not None:
+            return dict(stored, source="training")
+
+        if callable(df):
+            df = df()
+        if df is None or self.target not in df.columns:
+            return {"offset": 0.0, "rows": 0, "source": "prior"}
+        rows = df.reindex(columns=entry["features"] + [self.target])
+        rows = rows.apply(pd.to_numeric, errors="coerce").dropna(subset=[self.target])
+        if rows.empty:
+            return {"offset": 0.0, "rows": 0, "source": "prior"}
+
+        X = rows[entry["features"]].fillna(DEFAULT_FEATURE_VALUE)
+        residuals = rows[self.target].to_numpy(dtype=float) - entry["model"].predict(X)
+        return {
+            "offset": shrunk_offset(residuals, entry.get("prior_rows", CALIBRATION_PRIOR_ROWS)),
+            "rows": len(rows),
+            "source": "history"
+        }
+
+    def analyzer(self, user_id, df=None) -> Optional[DayAnalyzer]:
+        """DayAnalyzer с общей моделью, откалиброванной под пользователя"""
+        calibration = self.calibrate(user_id, df)
+        if calibration is None:
+            return None
+        entry = self.registry.load(POPULATION_MODEL_ID)
+
+        analyzer = DayAnalyzer(feature_columns=entry["features"], target=self.target)
+        analyzer.mood_model = CalibratedModel(entry["model"], calibration["offset"])
+        analyzer.feature_importance = {
+            feature: entry["feature_importance"][feature] for feature in entry["features"]
+        }
+        analyzer.model_fingerprint = entry["fingerprint"]
+        analyzer.model_metadata = {
+            key: value for key, value in entry.items() if key not in ("model", "calibration")
+        }
+        analyzer.model_metadata["calibration"] = calibration
+        return analyzer
@@ -0,0 +1,70 @@
+import hashlib
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import auth_tokens
+from auth_tokens import TokenSigner
+from passwords import needs_rehash, verify_password
+from user_manager import UserManager
+
+def test_login_rehashes_legacy_passwords_and_issues_tokens(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manager = UserManager(str(tmp_path / "users.json"), str(tmp_path / "user_data"),
+                          tokens=TokenSigner(secret_key="test-key"))
+    manager.register_user("tester", "secret")
+    user = manager._get_user("tester")
+    assert not needs_rehash(user["password_hash"])
+
+    # Хеш старого формата принимается и заменяется при входе
+    user["password_hash"] = hashlib.sha256(b"secret").hexdigest()
+    manager.storage.save_users({"tester": user}, ["tester"])
+    assert not manager.authenticate_user("tester", "wrong")["success"]
+    token = manager.issue_token("tester", "secret")["access_token"]
+    stored = UserManager(str(tmp_path / "users.json"), str(tmp_path / "user_data"))._get_user("tester")
+    assert stored["password_hash"].startswith("$") and verify_password("secret", stored["password_hash"])
+
+    assert manager.authenticate_token(token) == "tester"
+    assert manager.authenticate_token(token[:-2] + ("AA" if token[-2:] != "AA" else "BB")) is None
+    assert UserManager(str(tmp_path / "users.json"), str(tmp_path / "user_data"),
+                       tokens=TokenSigner(secret_key="other-key")).authenticate_token(token) is None
+    assert manager.authenticate_token(TokenSigner(secret_key="test-key", ttl=-1)
+                                      .issue("tester", stored["user_id"])["access_token"]) is None
+
+    # Токен удаленного пользователя не подходит новому с тем же именем
+    manager.delete_user("tester")
+    manager.register_user("tester", "secret")
+    assert manager.authenticate_token(token) is None
+
+def test_deleted_user_is_rejected_by_other_workers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    signer = TokenSigner(secret_key="test-key")
+    first, second = (UserManager(str(tmp_path / "users.json"), str(tmp_path / "user_data"), tokens=signer)
+                     for _ in range(2))
+    first.register_user("alice", "secret")
+    token = first.issue_token("alice", "secret")["access_token"]
+    assert second.authenticate_token(token) == "alice"
+    assert second.authenticate_user("alice", "secret")["success"]
+
+    first.delete_user("alice")
+    assert second.authenticate_token(token) is None
+    assert not second.authenticate_user("alice", "secret")["success"]
+
+def test_secret_key_file_is_never_empty(tmp_path, monkeypatch):
+    monkeypatch.delenv("SECRET_KEY", raising=False)
+    monkeypatch.setattr(auth_tokens, "SECRET_KEY_WAIT", 0.0)
+    path = str(tmp_path / "secret_key")
+    key = auth_tokens.load_secret_key(path)
+    assert key and auth_tokens.load_secret_key(path) == key
+    assert [name for name in os.listdir(tmp_path)] == ["secret_key"]
+
+    # Пустой файл (сбой между созданием и записью) и пустой SECRET_KEY отвергаются
+    open(path, "w").close()
+    with pytest.raises(RuntimeError):
+        auth_tokens.load_secret_key(path)
+    monkeypatch.setenv("SECRET_KEY", " ")
+    with pytest.raises(RuntimeError):
+        auth_tokens.load_secret_key(path)
@@ -0,0 +1,79 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from columnar_storage import ColumnarStorage
+from fields_registry import FieldRegistry
+from storage import FileStorage
+from test_correlations import make_records
+from user_manager import UserManager
+
+def test_columnar_matches_csv_and_converts_legacy_tables(tmp_path):
+    fields = FieldRegistry(str(tmp_path / "fields_config.json"))
+    user = {"user_id": "u1", "username": "tester", "data_file": "u1_data.csv"}
+    records = make_records(30, seed=4, missing=0.1)
+
+    csv = FileStorage(str(tmp_path / "users.json"), str(tmp_path / "csv"))
+    csv.append_records(user, records[:20])
+
+    # Таблица, созданная в CSV, читается как есть и переводится при записи
+    columnar = ColumnarStorage(str(tmp_path / "users.json"), str(tmp_path / "csv"), fields)
+    pd.testing.assert_frame_equal(columnar.read_records(user), csv.read_records(user))
+    columnar.append_records(user, records[20:])
+    assert not os.path.exists(tmp_path / "csv" / "u1_data.csv")
+
+    csv = FileStorage(str(tmp_path / "users.json"), str(tmp_path / "reference"))
+    csv.append_records(user, records)
+    pd.testing.assert_frame_equal(columnar.read_records(user), csv.read_records(user))
+    pd.testing.assert_frame_equal(columnar.read_records(user, ["date", "ocenka_dny"]),
+                                  csv.read_records(user, ["date", "ocenka_dny"]))
+
+    chunks = list(columnar.iter_records(user, since="2025-01-10", after=4, chunk_size=7))
+    expected = list(csv.iter_records(user, since="2025-01-10", after=4, chunk_size=7))
+    pd.testing.assert_frame_equal(pd.concat(chunks), pd.concat(expected), check_dtype=False)
+
+    # Новая колонка: у прежних строк пропуски
+    columnar.append_records(user, [dict(records[0], extra=2.5)])
+    extra = columnar.read_records(user)["extra"]
+    assert extra.iloc[-1] == 2.5 and extra.iloc[:-1].isna().all()
+    assert columnar.columns(user)[-1] == "extra"
+    assert np.dtype(next(column["dtype"] for column in columnar._load_meta(user)["columns"]
+                         if column["name"] == "chteniy")) == np.int8
+
+def test_typed_reads_follow_field_schema(tmp_path):
+    fields = FieldRegistry(str(tmp_path / "fields_config.json"))
+    dtypes = fields.get_dtypes()
+    user = {"user_id": "u1", "username": "tester", "data_file": "u1_data.csv"}
+    records = make_records(30, seed=5, missing=0.1)
+
+    csv = FileStorage(str(tmp_path / "users.json"), str(tmp_path / "csv"))
+    columnar = ColumnarStorage(str(tmp_path / "users.json"), str(tmp_path / "columnar"), fields)
+    csv.append_records(user, records)
+    columnar.append_records(user, records)
+
+    typed = csv.read_records(user, dtypes=dtypes)
+    assert typed["date"].dtype == "datetime64[s]"
+    assert typed["chteniy"].dtype == "Int8" and typed["kol_sna"].dtype == "float32"
+    assert typed.memory_usage(deep=True).sum() < csv.read_records(user).memory_usage(deep=True).sum()
+    pd.testing.assert_frame_equal(columnar.read_records(user, dtypes=dtypes), typed)
+
+    # Значение вне диапазона схемы не обрезается: колонка остается с выведенным типом
+    csv.append_records(user, [dict(records[0], kolichestvo_sna_0=300)])
+    assert csv.read_records(user, dtypes=dtypes)["kolichestvo_sna_0"].iloc[-1] == 300
+
+def test_paged_reads_use_schema_dtypes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    fields = FieldRegistry(str(tmp_path / "fields_config.json"))
+    manager = UserManager(str(tmp_path / "users.json"), str(tmp_path / "user_data"), fields=fields)
+    manager.register_user("tester", "secret")
+    manager.add_user_records("tester", make_records(25, seed=6, missing=0.1))
+
+    full = manager.get_user_data("tester")
+    chunks = list(manager.iter_user_records("tester", limit=20, chunk_size=8))
+    paged = pd.concat(chunks)
+    assert all((chunk.dtypes == full.dtypes).all() for chunk in chunks)
+    pd.testing.assert_frame_equal(paged.reset_index(drop=True), full.iloc[:20])
@@ -0,0 +1,93 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from correlations import CorrelationAccumulator
+from user_manager import UserManager
+
+FIELDS = ["kol_sna", "kolichestvo_sna_0", "nalichee_zarydki", "chteniy", "ocenka_dny"]
+
+def make_records(count: int, seed: int = 0, missing: float = 0.0):
+    """Случайные записи дня; часть значений можно пропустить"""
+    rng = np.random.default_rng(seed)
+    records = []
+    for i in range(count):
+        record = {
+            "date": f"2025-01-{i % 28 + 1:02d}",
+            "kol_sna": float(rng.normal(7.5, 1.5)),
+            "kolichestvo_sna_0": int(rng.integers(0, 11)),
+            "nalichee_zarydki": int(rng.integers(0, 2)),
+            "chteniy": int(rng.integers(0, 2)),
+            "ocenka_dny": int(rng.integers(1, 11)),
+        }
+        for field in FIELDS:
+            if rng.random() < missing:
+                record[field] = np.nan
+        records.append(record)
+    return records
+
+def test_matches_dataframe_corr_with_missing_values():
+    df = pd.DataFrame(make_records(200, seed=1, missing=0.2))
+
+    accumulator = CorrelationAccumulator.from_dataframe(df)
+
+    expected = df[FIELDS].corr()
+    pd.testing.assert_frame_equal(accumulator.correlation_matrix(), expected, atol=1e-9)
+
+def test_incremental_updates_match_full_recompute():
+    records = make_records(150, seed=2, missing=0.1)
+    history = pd.DataFrame(records[:100])
+
+    accumulator = CorrelationAccumulator.from_dataframe(history)
+    accumulator.update_many(records[100:])
+
+    expected = pd.DataFrame(records)[FIELDS].corr()
+    pd.testing.assert_frame_equal(accumulator.correlation_matrix(), expected, atol=1e-9)
+
+def test_vectorized_history_matches_row_updates():
+    df = pd.DataFrame(make_records(120, seed=4, missing=0.3))
+    df["zavrrak_koloriy"] = 1e6 + np.random.default_rng(5).normal(size=len(df))
+    df["pusto"] = np.nan
+
+    accumulator = CorrelationAccumulator.from_dataframe(df)
+
+    # Тот же накопитель, построенный по одной строке (как при добавлении записей)
+    expected = CorrelationAccumulator(accumulator.columns)
+    expected.update_many(df.to_dict("records"))
+    for name in ("n", "mean", "m2", "comoment"):
+        np.testing.assert_allclose(getattr(accumulator, name), getattr(expected, name),
+                                   rtol=1e-9, atol=1e-6)
+
+def test_serialization_roundtrip():
+    accumulator = CorrelationAccumulator.from_dataframe(pd.DataFrame(make_records(30)), (1, 2))
+
+    restored = CorrelationAccumulator.from_dict(accumulator.to_dict())
+
+    assert restored.signature == (1, 2)
+    pd.testing.assert_frame_equal(restored.correlation_matrix(), accumulator.correlation_matrix())
+
+def test_user_manager_correlations_follow_new_records(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manager = UserManager(str(tmp_path / "users.json"), str(tmp_path / "user_data"))
+    manager.register_user("tester", "secret")
+    records = make_records(40, seed=3)
+
+    for record in records[:20]:
+        manager.add_user_record("tester", dict(record))
+    manager.get_correlations("tester")
+    for record in records[20:]:
+        manager.add_user_record("tester", dict(record))
+
+    df = manager.get_user_data("tester")
+    expected = df.drop(columns=["date"]).corr()["ocenka_dny"].drop("ocenka_dny")
+    pd.testing.assert_series_equal(manager.get_correlations("tester"), expected,
+                                   atol=1e-9, check_names=False)
+
+    # Новый экземпляр подхватывает сохраненный накопитель
+    reloaded = UserManager(str(tmp_path / "users.json"), str(tmp_path / "user_data"))
+    pd.testing.assert_series_equal(reloaded.get_correlations("tester"), expected,
+                                   atol=1e-9, check_names=False)
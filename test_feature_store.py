@@ -0,0 +1,92 @@
+import os
+import random
+import sys
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "ml"))
+
+from analyzer import DayAnalyzer
+from feature_store import DailyFeatureStore
+
+def make_history(days: int, seed: int = 0):
+    """Случайные записи дня и события; у части дней событий нет"""
+    rnd = random.Random(seed)
+    start = pd.Timestamp("2025-01-01 07:00")
+    records, meals, activities, moods = [], [], [], []
+    for day in range(days):
+        wake_up = start + pd.Timedelta(days=day, minutes=rnd.randint(0, 120))
+        records.append({
+            "daily_record_id": day,
+            "date": str(wake_up.date()),
+            "wake_up_time": str(wake_up),
+            "sleep_time": str(wake_up + pd.Timedelta(hours=rnd.uniform(14, 18))),
+            "sleep_quality": rnd.randint(1, 10),
+            "overall_mood": rnd.randint(1, 10),
+        })
+        if rnd.random() < 0.2:
+            continue
+        for _ in range(rnd.randint(1, 5)):
+            moment = wake_up + pd.Timedelta(hours=rnd.randint(0, 14))
+            meals.append({"daily_record_id": day, "meal_time": str(moment),
+                          "portion_size": rnd.choice(["small", "medium", "large", None]),
+                          "taste_rating": rnd.randint(1, 10), "health_rating": rnd.randint(1, 10)})
+            activities.append({"daily_record_id": day, "activity_type": "walk",
+                               "start_time": str(moment),
+                               "end_time": str(moment + pd.Timedelta(minutes=rnd.randint(10, 90))),
+                               "intensity": rnd.randint(1, 10), "enjoyment_rating": rnd.randint(1, 10)})
+            moods.append({"daily_record_id": day, "timestamp": str(moment),
+                          "emotion": rnd.choice(["joy", "calm", "anger"]), "intensity": rnd.randint(1, 10)})
+    return records, meals, activities, moods
+
+def test_incremental_store_matches_prepare_data():
+    records, meals, activities, moods = make_history(60, seed=1)
+    store = DailyFeatureStore()
+    store.load(records[:30], meals[:40], activities[:10])
+
+    pd.testing.assert_frame_equal(
+        store.to_frame(), DayAnalyzer().prepare_data(records[:30], meals[:40], activities[:10], []))
+
+    for record in records[30:]:
+        store.add_daily_record(record)
+    for meal in meals[40:]:
+        store.add_meal(meal)
+    for activity in activities[10:]:
+        store.add_activity(activity)
+    for mood in moods:
+        store.add_mood(mood)
+
+    expected = DayAnalyzer().prepare_data(records, meals, activities, moods)
+    pd.testing.assert_frame_equal(DayAnalyzer(store).get_daily_features(), expected)
+
+def test_correlations_with_significance_match_pandas_and_cache_by_version():
+    import numpy as np
+    from scipy import stats
+    from analyzer import expand_correlation_matrix
+
+    records, meals, activities, moods = make_history(60, seed=3)
+    store = DailyFeatureStore()
+    store.load(records, meals, activities, moods)
+    analyzer = DayAnalyzer(store)
+
+    # Повторный вызов берет результат из кэша, а изменения копии его не портят
+    analyzer.analyze_correlations()["mood_correlations"].clear()
+    cached = analyzer._correlations
+    result = analyzer.analyze_correlations()
+    assert analyzer._correlations is cached and result["mood_correlations"]
+
+    df = store.to_frame()
+    columns = result["correlation_matrix"]["columns"]
+    pd.testing.assert_frame_equal(expand_correlation_matrix(result["correlation_matrix"]),
+                                  df[columns].astype(float).corr(), check_exact=False)
+
+    sleep = result["mood_correlations"]["sleep_quality"]
+    expected = stats.pearsonr(df["sleep_quality"], df["overall_mood"])
+    assert sleep["sample_size"] == len(df)
+    assert np.isclose(sleep["p_value"], expected.pvalue)
+    assert sleep["confidence_level"] == 0.95
+
+    store.add_mood({"daily_record_id": 0, "timestamp": records[0]["wake_up_time"],
+                    "emotion": "joy", "intensity": 10})
+    analyzer.analyze_correlations()
+    assert analyzer._correlations is not cached
@@ -0,0 +1,103 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "ml"))
+
+from analyzer import DayAnalyzer
+from model_registry import ModelRegistry
+from test_feature_store import make_history
+
+def test_registry_skips_retraining_and_loads_lazily(tmp_path):
+    df = DayAnalyzer().prepare_data(*make_history(80, seed=2))
+    features = {"sleep_quality": 8, "sleep_duration_hours": 7.5}
+
+    trained = DayAnalyzer(registry=ModelRegistry(str(tmp_path)), user_id="u1")
+    assert trained.train_mood_prediction_model(df)["retrained"] is True
+    expected = trained.predict_mood(features)
+
+    # Новый процесс: модель не обучается заново и читается с диска при предсказании
+    restarted = DayAnalyzer(registry=ModelRegistry(str(tmp_path)), user_id="u1")
+    assert restarted.predict_mood(features) == expected
+    assert restarted.train_mood_prediction_model(df)["retrained"] is False
+
+    df.loc[0, "sleep_quality"] += 1
+    assert restarted.train_mood_prediction_model(df)["retrained"] is True
+
+def test_incremental_modes_update_on_new_rows_only(tmp_path):
+    import numpy as np
+    import pandas as pd
+    from sklearn.linear_model import LinearRegression
+
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(300, 3))
+    df = pd.DataFrame(X, columns=["a", "b", "c"])
+    df["t"] = X @ [1.0, -2.0, 0.5] + 3 + rng.normal(size=300) * 0.1
+
+    def analyzer(mode):
+        return DayAnalyzer(registry=ModelRegistry(str(tmp_path / mode)), user_id="u1",
+                           feature_columns=["a", "b", "c"], target="t", training_mode=mode)
+
+    for mode in ("online_linear", "warm_start"):
+        assert analyzer(mode).train_mood_prediction_model(df.iloc[:250])["incremental"] is False
+        result = analyzer(mode).train_mood_prediction_model(df)
+        assert result["incremental"] is True
+        assert result["new_records"] == 50
+
+    linear = analyzer("online_linear")
+    linear.has_model()
+    expected = LinearRegression().fit(df[["a", "b", "c"]], df["t"])
+    np.testing.assert_allclose(linear.mood_model.coef_, expected.coef_, atol=1e-6)
+
+    forest = analyzer("warm_start")
+    forest.has_model()
+    assert forest.mood_model.n_estimators > 100
+
+def test_time_series_cv_selects_model_on_past_folds(tmp_path):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(200, 3))
+    df = pd.DataFrame(X, columns=["a", "b", "c"])
+    df["t"] = X @ [1.0, -2.0, 0.5] + 3 + rng.normal(size=200) * 0.1
+    df["date"] = pd.date_range("2025-01-01", periods=200).strftime("%Y-%m-%d")
+
+    analyzer = DayAnalyzer(registry=ModelRegistry(str(tmp_path)), user_id="u1",
+                           feature_columns=["a", "b", "c"], target="t", training_mode="time_series_cv")
+    result = analyzer.train_mood_prediction_model(df.sample(frac=1, random_state=0))
+    assert result["cv"]["winner"] == "linear_regression"
+    for candidate in result["cv"]["candidates"].values():
+        folds = candidate["folds"]
+        assert len(folds) == 5
+        assert [fold["train_rows"] for fold in folds] == sorted(fold["train_rows"] for fold in folds)
+    assert analyzer.model_metadata["model_type"] == "LinearRegression"
+
+def test_population_model_calibrates_cold_start_users(tmp_path):
+    import numpy as np
+    import pandas as pd
+    from population_model import PopulationModel
+
+    rng = np.random.default_rng(2)
+
+    def history(rows, bias):
+        X = rng.normal(size=(rows, 3))
+        df = pd.DataFrame(X, columns=["a", "b", "c"])
+        df["t"] = X @ [1.0, -2.0, 0.5] + 5 + bias + rng.normal(size=rows) * 0.1
+        return df
+
+    population = PopulationModel(ModelRegistry(str(tmp_path)), ["a", "b", "c"], "t")
+    frames = {"u1": history(150, 0.0), "u2": history(150, 0.0)}
+    assert population.train(frames)["retrained"] is True
+    assert population.train(frames)["retrained"] is False
+
+    # Новый пользователь с тремя днями: сдвиг есть, но стянут к нулю
+    newcomer = history(3, 3.0)
+    analyzer = population.analyzer("u3", newcomer)
+    calibration = analyzer.model_metadata["calibration"]
+    assert calibration["source"] == "history"
+    assert 0 < calibration["offset"] < 3.0
+
+    row = pd.DataFrame([{"a": 0.0, "b": 0.0, "c": 0.0}])
+    base = population.analyzer("u3").predict_mood_batch(row)[0]
+    assert np.isclose(analyzer.predict_mood_batch(row)[0] - base, calibration["offset"])
+    assert population.analyzer("u1").model_metadata["calibration"]["source"] == "training"
@@ -0,0 +1,76 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from fields_registry import FieldRegistry
+from schema_migration import compact_users
+from test_correlations import make_records
+from user_manager import UserManager
+
+def test_field_changes_are_projected_on_read_and_compacted_lazily(tmp_path):
+    fields = FieldRegistry(str(tmp_path / "fields_config.json"))
+    manager = UserManager(str(tmp_path / "users.json"), str(tmp_path / "user_data"), fields=fields)
+    for username in ("first", "second"):
+        manager.register_user(username, "secret")
+        manager.add_user_records(username, [dict(record) for record in make_records(10, seed=1)])
+    user = manager._get_user("first")
+    signature = manager.storage.data_signature(user)
+
+    # Изменение схемы не трогает таблицы: новое поле читается со значением по умолчанию
+    fields.add_field({"name": "voda", "display_name": "Вода", "field_type": "integer",
+                      "min_value": 0, "max_value": 10, "default_value": 3})
+    fields.delete_field("chteniy")
+    df = manager.get_user_data("first")
+    assert manager.storage.data_signature(user) == signature
+    assert "chteniy" not in df.columns and (df["voda"] == 3).all() and df["voda"].dtype == "Int8"
+
+    # Поле, удаленное и добавленное заново, не показывает старые значения
+    fields.add_field({"name": "chteniy", "display_name": "Чтение", "field_type": "boolean"})
+    assert manager.get_user_data("first")["chteniy"].isna().all()
+
+    # Запись с новыми полями сначала переводит таблицу в текущую схему
+    manager.add_user_record("first", dict(make_records(1, seed=2)[0], voda=7, chteniy=1))
+    df = manager.get_user_data("first")
+    assert df["chteniy"].iloc[-1] == 1 and df["chteniy"].iloc[:-1].isna().all()
+    assert df["voda"].tolist() == [3] * 10 + [7]
+    assert manager.storage.columns(user)[-2:] == ["voda", "chteniy"]
+
+    # Фоновый перевод остальных таблиц не меняет того, что видят чтения
+    before = manager.get_user_data("second")
+    report = compact_users(manager, batch_size=1)
+    assert report["migrated"] == 1 and report["failed"] == 0
+    pd.testing.assert_frame_equal(manager.get_user_data("second"), before)
+    assert "chteniy" in manager.storage.columns(manager._get_user("second"))
+    assert compact_users(manager)["migrated"] == 0
+
+def test_correlations_follow_field_deletion(tmp_path):
+    fields = FieldRegistry(str(tmp_path / "fields_config.json"))
+    manager = UserManager(str(tmp_path / "users.json"), str(tmp_path / "user_data"), fields=fields)
+    manager.register_user("first", "secret")
+    manager.add_user_records("first", [dict(record) for record in make_records(20, seed=3)])
+    assert "chteniy" in manager.get_correlations("first").index
+
+    # Таблица не переписывается, но корреляции считаются в новой схеме
+    fields.delete_field("chteniy")
+    assert "chteniy" not in manager.get_correlations("first").index
+    reloaded = UserManager(str(tmp_path / "users.json"), str(tmp_path / "user_data"), fields=fields)
+    assert "chteniy" not in reloaded.get_correlations("first").index
+
+def test_field_changes_from_two_processes_are_not_lost(tmp_path):
+    config_file = str(tmp_path / "fields_config.json")
+    first, second = FieldRegistry(config_file), FieldRegistry(config_file)
+    base_version = first.get_schema_version()
+    mtime = os.stat(config_file).st_mtime_ns
+
+    # Второй процесс меняет схему, а mtime файла остается прежним
+    second.add_field({"name": "voda", "display_name": "Вода", "field_type": "integer"})
+    os.utime(config_file, ns=(mtime, mtime))
+    assert first.add_field({"name": "progulka", "display_name": "Прогулка", "field_type": "boolean"})
+
+    names = FieldRegistry(config_file).get_field_names()
+    assert "voda" in names and "progulka" in names
+    changes = FieldRegistry(config_file).get_config()["schema_changes"]
+    assert [change["version"] for change in changes] == [base_version + 1, base_version + 2]
@@ -0,0 +1,59 @@
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from user_directory import UserDirectory
+from user_manager import UserManager
+
+def make_user(index: int) -> dict:
+    return {"user_id": f"id{index}", "username": f"user{index}", "email": "",
+            "created_at": "2025-01-01T00:00:00", "last_login": None, "data_file": f"id{index}_data.csv"}
+
+def test_directory_logs_changes_and_takes_snapshots(tmp_path):
+    path = str(tmp_path / "users.json")
+    # Прежний users.json читается как снимок
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"user0": make_user(0)}, f)
+
+    directory = UserDirectory(path, snapshot_every=5)
+    other = UserDirectory(path, snapshot_every=5)
+    assert directory.get("user0")["user_id"] == "id0"
+
+    assert directory.add(make_user(1)) and not other.add(make_user(1))
+    directory.update([dict(make_user(1), last_login="2025-01-02")])
+    assert other.get_by_id("id1")["last_login"] == "2025-01-02"
+    assert other.remove("user1", "id1") and directory.get("user1") is None
+    assert not directory.remove("user0", "other-id")
+
+    # Снимок записывается после snapshot_every строк журнала
+    for index in range(2, 6):
+        other.add(make_user(index))
+    with open(path, encoding="utf-8") as f:
+        assert set(json.load(f)) == {"user0", "user2", "user3"}
+    assert directory.get_by_id("id5")["username"] == "user5"
+    assert directory.all() == other.all() == UserDirectory(path).all()
+
+def test_user_manager_loads_users_on_demand(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manager = UserManager(str(tmp_path / "users.json"), str(tmp_path / "user_data"))
+    user_id = manager.register_user("tester", "secret")["user_id"]
+
+    reloaded = UserManager(str(tmp_path / "users.json"), str(tmp_path / "user_data"))
+    assert reloaded.get_user_by_id(user_id)["username"] == "tester"
+    assert reloaded.authenticate_user("tester", "secret")["success"]
+    # В памяти остаются только несохраненные изменения
+    assert list(reloaded._dirty_users) == ["tester"]
+    assert reloaded.get_user_by_id(user_id)["last_login"] is not None
+    reloaded.flush()
+    assert reloaded._dirty_users == {}
+    assert manager.storage.load_user("tester")["last_login"] is not None
+
+    # Удаление в другом процессе видно сразу, отложенные изменения отбрасываются
+    reloaded.authenticate_user("tester", "secret")
+    manager.delete_user("tester")
+    assert reloaded._get_user("tester") is None and reloaded._dirty_users == {}
+    assert not reloaded.authenticate_user("tester", "secret")["success"]
+    reloaded.flush()
+    assert manager.storage.load_user("tester") is None